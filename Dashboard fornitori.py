@@ -1,80 +1,257 @@
 import streamlit as st
 import pandas as pd
 import plotly.express as px
-import sqlite3
+import threading
+import math
+from datetime import datetime, timedelta
 from pathlib import Path
-from datetime import datetime
-from io import BytesIO
-
-# --- Dipendenze per il Report PDF ---
-from reportlab.lib.pagesizes import A4
-from reportlab.platypus import BaseDocTemplate, Frame, PageTemplate, Table, TableStyle, Paragraph, Spacer, Image
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+
+from aggregations import risk_summary, risk_kpis, risk_counts_by, overdue_reminders, snapshot_trends, trend_charts_data
+from db import (CACHED_TABLES, DELTA_TABLES, ROW_VERSION_SQL, init_db, prune_tombstones, read_connection, write_connection, pool_stats,
+                get_table_version, bump_table_version, risk_filters_sql, parse_dates, REMINDER_SOGLIA_GIORNI)
+from save_engine import InvalidRows, SaveConflict, save_editor_changes
+from history import ensure_snapshot, risk_history
+from search import SEARCH_PAGE_SIZE, match_suppliers, search
+from suppliers import advance_scores, after_write, supplier_aliases, supplier_names, supplier_ranking
+from report_pdf import cached_report, report_key, submit_report, job_status
+from risk_import import (GRAVITA_VALUES, RISCHIO_SCENARI, STATI_RISCHIO, REQUIRED_COLUMNS, errors_csv, file_kind, import_risks,
+                         insert_risks, validate_risks)
+from auth import LoginLimiter, TOKEN_TTL_S, authenticate, create_user, issue_token, read_token, revoke_tokens, token_matches, update_user
+import data_export
+import profiling
 
 st.set_page_config(layout="wide", page_title="Risk Management Dashboard", initial_sidebar_state="expanded")
 
 # —————————————————————————————
 # 1) DB & HELPERS
 # —————————————————————————————
-DB_PATH = Path("app.db")
-
-def get_connection():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-def init_db():
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("""
-      CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY, username TEXT UNIQUE NOT NULL, password TEXT NOT NULL,
-        role TEXT NOT NULL CHECK(role IN ('read','modify','admin'))
-      )
-    """)
-    c.execute("""
-      CREATE TABLE IF NOT EXISTS risks (
-        id INTEGER PRIMARY KEY, data_inizio TEXT NOT NULL, data_fine TEXT NOT NULL, fornitore TEXT NOT NULL,
-        rischio TEXT NOT NULL, stato TEXT NOT NULL, gravita TEXT NOT NULL, note TEXT, data_chiusura TEXT,
-        contract_owner TEXT NOT NULL, area_riferimento TEXT NOT NULL, perc_avanzamento INTEGER NOT NULL DEFAULT 0
-      )
-    """)
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS reminders (
-            id INTEGER PRIMARY KEY, fornitore_nome TEXT NOT NULL, data_invio TEXT NOT NULL,
-            stato_reminder TEXT NOT NULL CHECK(stato_reminder IN ('Attivo', 'Risposto')),
-            note TEXT, test_bc INTEGER NOT NULL DEFAULT 0, test_it INTEGER NOT NULL DEFAULT 0,
-            test_pt_va INTEGER NOT NULL DEFAULT 0, access_review INTEGER NOT NULL DEFAULT 0, ppt INTEGER NOT NULL DEFAULT 0
-        )
-    """)
-    c.execute("SELECT 1 FROM users WHERE username = ?", ("Flavio",))
-    if not c.fetchone():
-        c.execute("INSERT INTO users(username,password,role) VALUES(?,?,?)", ("Flavio","Dashboard2003","admin"))
-    conn.commit()
-    conn.close()
+# Righe per pagina delle griglie paginate (Dettaglio Rischi, Modifica)
+PAGE_SIZE = 50
+# Reminder scaduti elencati nel banner della Dashboard prima di "Mostra tutti"
+OVERDUE_BANNER_MAX = 10
+# Errori di validazione conservati e mostrati nella pagina Import Rischi
+IMPORT_ERRORI_MAX = 10_000
+# Righe massime esportabili con st.download_button (senza l'endpoint in streaming di asgi.py)
+EXPORT_MAX_RIGHE_APP = 200_000
+# Periodi selezionabili nei grafici di andamento (giorni)
+TREND_PERIODI = {"Ultimi 30 giorni": 30, "Ultimi 90 giorni": 90, "Ultimo anno": 365, "Tutto": None}
+# Fornitori mostrati nella classifica per punteggio di rischio della Dashboard
+CLASSIFICA_FORNITORI = 15
 
 init_db()
-conn = get_connection()
 
+# Ordinamento (colonna, ascendente) e colonne data di ogni tabella in cache
+TABLE_QUERIES = {
+    "users": (None, True, None),
+    "risks": ("id", False, parse_dates("risks")),
+    "reminders": ("data_invio", True, parse_dates("reminders")),
+}
+
+def current_version(table):
+    with read_connection() as conn:
+        return get_table_version(conn, table)
+
+def _select_all_sql(table):
+    order_col, ascending, _ = TABLE_QUERIES[table]
+    return f"SELECT * FROM {table}" + (f" ORDER BY {order_col} {'ASC' if ascending else 'DESC'}" if order_col else "")
+
+@st.cache_resource
+def get_cache_stats():
+    # Contatori condivisi tra tutte le sessioni ("delta" = sincronizzazione incrementale)
+    return {"lock": threading.Lock(), "tables": {t: {"hit": 0, "miss": 0, "delta": 0} for t in CACHED_TABLES}}
+
+@st.cache_resource
+def get_delta_store():
+    # DataFrame mantenuti in memoria e condivisi tra le sessioni, con la versione a cui sono allineati
+    return {"lock": threading.Lock(), "tables": {}}
+
+@st.cache_data(show_spinner=False, max_entries=len(CACHED_TABLES) * 2)
+def _read_table(table, version):
+    # Eseguita solo in caso di miss: la chiave comprende la versione corrente della tabella
+    stats = get_cache_stats()
+    with stats["lock"]: stats["tables"][table]["miss"] += 1
+    with read_connection() as conn:
+        return pd.read_sql_query(text(_select_all_sql(table)), conn, parse_dates=TABLE_QUERIES[table][2])
+
+def load_delta_table(table):
+    """
+    Restituisce la tabella allineata all'ultima versione, leggendo dal DB solo le righe
+    modificate (row_version) e i tombstone successivi alla versione già in memoria. Se i tombstone
+    successivi sono già stati rimossi (db.prune_tombstones) la tabella è riletta per intero.
+    """
+    order_col, ascending, date_cols = TABLE_QUERIES[table]
+    store, stats = get_delta_store(), get_cache_stats()
+    with store["lock"], read_connection() as conn:
+        version, pruned = conn.execute(text("SELECT versione, tombstone_fino FROM table_versions WHERE tabella=:t"), {"t": table}).one()
+        held = store["tables"].get(table)
+        if held is None or held["version"] < pruned:
+            df, outcome = pd.read_sql_query(text(_select_all_sql(table)), conn, parse_dates=date_cols), "miss"
+        elif held["version"] == version:
+            df, outcome = held["df"], "hit"
+        else:
+            changed = pd.read_sql_query(text(f"SELECT * FROM {table} WHERE row_version > :v"), conn, params={"v": held["version"]}, parse_dates=date_cols)
+            deleted = conn.execute(text("SELECT row_id FROM tombstones WHERE tabella=:t AND row_version > :v"), {"t": table, "v": held["version"]}).scalars().all()
+            df = held["df"]
+            df = df[~df["id"].isin(changed["id"]) & ~df["id"].isin(deleted)]
+            df = pd.concat([df, changed], ignore_index=True) if not changed.empty else df
+            df, outcome = df.sort_values(order_col, ascending=ascending, kind="stable").reset_index(drop=True), "delta"
+        store["tables"][table] = {"version": version, "df": df}
+    with stats["lock"]: stats["tables"][table][outcome] += 1
+    return df.copy()
+
+def load_cached_table(table):
+    if table in DELTA_TABLES:
+        return load_delta_table(table)
+    stats = get_cache_stats()
+    misses = stats["tables"][table]["miss"]
+    df = _read_table(table, current_version(table))
+    with stats["lock"]:
+        if stats["tables"][table]["miss"] == misses: stats["tables"][table]["hit"] += 1
+    return df
+
+@profiling.profiled("load_users")
 def load_users():
-    return pd.read_sql_query("SELECT * FROM users", conn)
-
-def load_risks_df():
-    return pd.read_sql_query("SELECT * FROM risks ORDER BY id DESC", conn, parse_dates=["data_inizio","data_fine","data_chiusura"])
-
-def load_reminders_df():
-    df_reminders = pd.read_sql_query("SELECT * FROM reminders ORDER BY data_invio ASC", conn, parse_dates=["data_invio"])
+    return load_cached_table("users")
+
+@st.cache_data(show_spinner=False, max_entries=256)
+def _fetch_risks_page(version, where, params, after_id, limit):
+    if after_id is not None:
+        where, params = where + (" AND" if where else " WHERE") + " id < :after_id", {**params, "after_id": after_id}
+    with read_connection() as conn:
+        return pd.read_sql_query(text(f"SELECT * FROM risks{where} ORDER BY id DESC LIMIT :limit"), conn, params={**params, "limit": limit}, parse_dates=TABLE_QUERIES["risks"][2])
+
+@st.cache_data(show_spinner=False, max_entries=256)
+def _count_risks(version, where, params):
+    with read_connection() as conn:
+        return conn.execute(text(f"SELECT COUNT(*) FROM risks{where}"), params).scalar_one()
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def _distinct_risk_values(version, column):
+    with read_connection() as conn:
+        return conn.execute(text(f"SELECT DISTINCT {column} FROM risks ORDER BY {column}")).scalars().all()
+
+@profiling.profiled("load_risks_page")
+def load_risks_page(filters, after_id=None, limit=PAGE_SIZE):
+    """Pagina di rischi filtrata lato SQL, in ordine di id decrescente a partire dal cursore after_id (keyset)."""
+    return _fetch_risks_page(current_version("risks"), *risk_filters_sql(**filters), after_id, limit)
+
+@profiling.profiled("count_risks")
+def count_risks(filters):
+    return _count_risks(current_version("risks"), *risk_filters_sql(**filters))
+
+@profiling.profiled("load_risk_options")
+def load_risk_options(column):
+    """Valori distinti di una colonna dei rischi (es. fornitore, gravita) per popolare i filtri."""
+    return _distinct_risk_values(current_version("risks"), column)
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def _risk_summary(version, fornitori):
+    with read_connection() as conn:
+        return risk_summary(conn, list(fornitori) if fornitori else None)
+
+@profiling.profiled("load_risk_summary")
+def load_risk_summary(fornitori=None):
+    """Conteggi per (stato, gravita) calcolati in SQL e memorizzati per versione della tabella e fornitori selezionati."""
+    return _risk_summary(current_version("risks"), tuple(fornitori) if fornitori else None)
+
+@profiling.profiled("load_reminders_df")
+def load_reminders_df(stato=None):
+    """Reminder (solo quelli nello 'stato' indicato, se presente); l'anzianità è calcolata solo sulle righe restituite."""
+    df_reminders = load_cached_table("reminders")
+    if stato is not None:
+        df_reminders = df_reminders[df_reminders['stato_reminder'] == stato].reset_index(drop=True)
     if not df_reminders.empty:
         today = pd.to_datetime(datetime.now().date())
-        df_reminders['giorni_trascorsi'] = (today - df_reminders['data_invio']).dt.days
-        df_reminders['giorni_al_reminder'] = (5 - df_reminders['giorni_trascorsi']).clip(lower=0)
+        df_reminders['giorni_trascorsi'] = (today - df_reminders['data_invio'].dt.normalize()).dt.days
+        df_reminders['giorni_al_reminder'] = (REMINDER_SOGLIA_GIORNI - df_reminders['giorni_trascorsi']).clip(lower=0)
     return df_reminders
 
+@st.cache_data(show_spinner=False, max_entries=16)
+def _overdue_reminders(version, today, limit):
+    with read_connection() as conn:
+        return overdue_reminders(conn, today, limit)
+
+@profiling.profiled("load_overdue_reminders")
+def load_overdue_reminders(limit=None):
+    """Reminder scaduti selezionati in SQL (numero totale, prime 'limit' righe), memorizzati per versione della tabella e giorno."""
+    return _overdue_reminders(current_version("reminders"), datetime.now().date(), limit)
+
+@st.cache_data(show_spinner=False, max_entries=1)
+def _daily_refresh(today):
+    # Una volta al giorno per processo, se scheduler.py non è attivo: fotografia di oggi, rischi scaduti nei punteggi fornitori
+    # e rimozione dei tombstone scaduti
+    with write_connection() as conn:
+        ensure_snapshot(conn, today); advance_scores(conn, today); prune_tombstones(conn); conn.commit()
+
+# ttl: il punto di oggi è ricalcolato da scheduler.py a ogni passaggio
+@st.cache_data(show_spinner=False, max_entries=64, ttl=300)
+def _snapshot_trends(today, fornitori, gravita, dal):
+    with read_connection() as conn:
+        return trend_charts_data(snapshot_trends(conn, list(fornitori) if fornitori else None, list(gravita), dal))
+
+@profiling.profiled("load_snapshot_trends")
+def load_snapshot_trends(fornitori, gravita, giorni):
+    """Serie per i grafici di andamento (aperti, scaduti/in tempo, tempo medio di chiusura) lette da risk_snapshots."""
+    today = datetime.now().date()
+    _daily_refresh(today)
+    dal = today - timedelta(days=giorni) if giorni else None
+    return _snapshot_trends(today, tuple(fornitori) if fornitori else None, tuple(gravita), dal)
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def _supplier_directory(versions):
+    with read_connection() as conn:
+        aliases = supplier_aliases(conn)
+        return supplier_names(conn), aliases, {alias: name for name, names in aliases.items() for alias in names}
+
+@profiling.profiled("load_supplier_directory")
+def load_supplier_directory():
+    """Anagrafica fornitori (suppliers.py): nomi dei fornitori con rischi, grafie di ciascun fornitore, fornitore di ciascuna grafia."""
+    return _supplier_directory((current_version("risks"), current_version("reminders")))
+
+def supplier_filter(names):
+    """Filtro 'fornitori' per i fornitori selezionati: tutte le grafie con cui compaiono nei dati. Nessuna selezione = None."""
+    if not names: return None
+    aliases = load_supplier_directory()[1]
+    return [alias for name in names for alias in aliases.get(name, [name])]
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def _supplier_ranking(versions, today, limit):
+    with read_connection() as conn:
+        return pd.DataFrame([dict(r) for r in supplier_ranking(conn, limit)])
+
+@profiling.profiled("load_supplier_ranking")
+def load_supplier_ranking(limit=CLASSIFICA_FORNITORI):
+    """Fornitori con punteggio di rischio più alto, letti dai punteggi mantenuti a ogni scrittura (nessun ricalcolo)."""
+    today = datetime.now().date()
+    _daily_refresh(today)
+    return _supplier_ranking((current_version("risks"), current_version("reminders")), today, limit)
+
+@st.cache_data(show_spinner=False, max_entries=128)
+def _search(version, table, query, offset):
+    with read_connection() as conn:
+        return search(conn, table, query, SEARCH_PAGE_SIZE, offset)
+
+@profiling.profiled("search_text")
+def search_text(table, query, offset=0):
+    """Pagina di risultati della ricerca full-text (search.py), memorizzata per versione della tabella."""
+    return _search(current_version(table), table, query, offset)
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def _similar_suppliers(versions, name):
+    with read_connection() as conn:
+        return match_suppliers(conn, name)
+
+@profiling.profiled("load_similar_suppliers")
+def load_similar_suppliers(name):
+    """Fornitori con nome simile al testo cercato (anche grafie diverse), memorizzati per versione di rischi e reminder."""
+    return _similar_suppliers((current_version("risks"), current_version("reminders")), name)
+
 # —————————————————————————————
 # 2) SESSION_STATE INIT
 # —————————————————————————————
-for key, val in [("authenticated", False), ("username", ""), ("role", ""), ("page", "Dashboard"), ("last_activity", None)]:
+for key, val in [("authenticated", False), ("username", ""), ("role", ""), ("user", None), ("page", "Dashboard"), ("last_activity", None), ("token_issued", None)]:
     if key not in st.session_state:
         st.session_state[key] = val
 
@@ -145,60 +322,231 @@ def set_page_style():
     """
     st.markdown(css, unsafe_allow_html=True)
 
-### CORREZIONE FINALE ###
-# Funzione di styling che gestisce correttamente date mancanti (NaT)
-def style_risk_dataframe(df: pd.DataFrame):
-    """
-    Applica stili condizionali al DataFrame dei rischi.
-    Gestisce l'assenza di matplotlib e formatta correttamente le date mancanti (NaT).
-    """
-    def style_gravita(v):
-        color_map = {
-            "Critical": "background-color: #d9534f; color: white; font-weight: bold;",
-            "High": "background-color: #f0ad4e; color: black;",
-            "Low": "background-color: #5cb85c; color: white;"
-        }
-        return color_map.get(v, None)
-
-    def style_stato(v):
-        return "background-color: #3182bd; color: white;" if v == "aperto" else "background-color: #4A5568; color: #E2E8F0;"
-
-    # Applica gli stili base
-    styled_df = df.style.applymap(style_gravita, subset=['gravita']) \
-                        .applymap(style_stato, subset=['stato'])
-    
-    # Tenta di applicare il gradiente per la % avanzamento
+# Stili precalcolati per valore: applicati a intere colonne, senza callback per cella
+GRAVITA_CSS = {
+    "Critical": "background-color: #d9534f; color: white; font-weight: bold;",
+    "High": "background-color: #f0ad4e; color: black;",
+    "Low": "background-color: #5cb85c; color: white;"
+}
+STATO_CSS = {"aperto": "background-color: #3182bd; color: white;"}
+STATO_CSS_DEFAULT = "background-color: #4A5568; color: #E2E8F0;"
+RISK_DATE_COLUMNS = ("data_inizio", "data_fine", "data_chiusura")
+
+@st.cache_resource
+def perc_gradient_css():
+    """Gradiente 'Blues' per perc_avanzamento (0-100) calcolato una volta sola; None se matplotlib non è installato."""
     try:
-        styled_df = styled_df.background_gradient(cmap='Blues', subset=['perc_avanzamento'], vmin=0, vmax=100)
+        from matplotlib import colormaps
+        from matplotlib.colors import to_hex
     except ImportError:
         print("Avviso: 'matplotlib' non trovato. Lo stile 'background_gradient' non sarà applicato.")
+        return None
+    css = []
+    for i in range(101):
+        rgb = colormaps["Blues"](i / 100)[:3]
+        # Stessa regola di Styler.background_gradient per il colore del testo (luminanza relativa < 0.408)
+        r, g, b = (x / 12.92 if x <= 0.04045 else ((x + 0.055) / 1.055) ** 2.4 for x in rgb)
+        css.append(f"background-color: {to_hex(rgb)}; color: {'#f1f1f1' if 0.2126 * r + 0.7152 * g + 0.0722 * b < 0.408 else '#000000'};")
+    return css
+
+@st.cache_data(max_entries=64)
+def risk_style_frames(df: pd.DataFrame):
+    """
+    Valori già formattati e matrice CSS della pagina di rischi, calcolati per colonne intere.
+    La cache è per contenuto della pagina, quindi per versione dei dati, filtri e cursore.
+    """
+    display = df.copy()
+    css = pd.DataFrame("", index=df.index, columns=df.columns)
+    if "gravita" in df: css["gravita"] = df["gravita"].map(GRAVITA_CSS).fillna("")
+    if "stato" in df: css["stato"] = df["stato"].map(STATO_CSS).fillna(STATO_CSS_DEFAULT)
+    if "perc_avanzamento" in df:
+        gradient = perc_gradient_css()
+        if gradient is not None:
+            steps = pd.to_numeric(df["perc_avanzamento"], errors="coerce").clip(0, 100).round()
+            css["perc_avanzamento"] = pd.Series(gradient).reindex(steps).fillna("").to_numpy()
+        display["perc_avanzamento"] = df["perc_avanzamento"].astype(str) + "%"
+    for col in RISK_DATE_COLUMNS:
+        if col in df: display[col] = pd.to_datetime(df[col]).dt.strftime("%d/%m/%Y").fillna("N/A")
+    return display, css
+
+@profiling.profiled("style_risk_dataframe", kind="styler")
+def style_risk_dataframe(df: pd.DataFrame):
+    """
+    Applica stili condizionali al DataFrame dei rischi (una pagina della griglia).
+    Stili e formattazione delle date sono precalcolati da risk_style_frames: lo Styler applica solo la matrice CSS.
+    """
+    display, css = risk_style_frames(df)
+    return display.style.apply(lambda _: css, axis=None)
 
-    # Applica la formattazione finale, gestendo correttamente i valori NaT per tutte le date
-    styled_df = styled_df.format({
-        "data_inizio": lambda t: t.strftime("%d/%m/%Y") if pd.notna(t) else "N/A",
-        "data_fine": lambda t: t.strftime("%d/%m/%Y") if pd.notna(t) else "N/A",
-        "data_chiusura": lambda t: t.strftime("%d/%m/%Y") if pd.notna(t) else "N/A",
-        "perc_avanzamento": "{}%"
-    })
-    
-    return styled_df
+def paged_risks(key, filters, reset_keys=()):
+    """
+    Restituisce la pagina corrente dei rischi filtrati e disegna i controlli di paginazione keyset.
+    Lo stato (pila dei cursori) è per sessione e si azzera quando cambiano i filtri;
+    reset_keys sono i widget da reinizializzare al cambio pagina (es. data_editor).
+    """
+    state = st.session_state.setdefault(f"pager_{key}", {"filters": None, "cursors": [None]})
+    if state["filters"] != filters:
+        state.update(filters=filters, cursors=[None])
+    df_page = load_risks_page(filters, state["cursors"][-1], PAGE_SIZE + 1)
+    has_next, df_page = len(df_page) > PAGE_SIZE, df_page.head(PAGE_SIZE)
+    total = count_risks(filters)
+
+    def render_controls():
+        p1, p2, p3 = st.columns([1, 2, 1])
+        if p1.button("◀ Precedente", key=f"prev_{key}", disabled=len(state["cursors"]) == 1, use_container_width=True):
+            state["cursors"].pop()
+            for k in reset_keys: st.session_state.pop(k, None)
+            st.rerun()
+        p2.caption(f"Pagina {len(state['cursors'])} di {max(1, -(-total // PAGE_SIZE))} · {total} rischi")
+        if p3.button("Successiva ▶", key=f"next_{key}", disabled=not has_next, use_container_width=True):
+            state["cursors"].append(int(df_page["id"].iloc[-1]))
+            for k in reset_keys: st.session_state.pop(k, None)
+            st.rerun()
+    return df_page, render_controls
+
+def editor_page(key, df, page=None):
+    """
+    Dati da passare al data_editor 'key'. Al primo rendering la pagina (righe con id e row_version) è salvata in
+    session_state; finché l'editor ha modifiche non salvate si continua a mostrare quella, anche se nel frattempo i dati
+    sono cambiati: le posizioni di edited_rows/deleted_rows restano riferite alle righe che l'utente ha modificato e il
+    salvataggio confronta le row_version lette dall'utente (SaveConflict se un altro utente le ha modificate).
+    'page' identifica la pagina mostrata (es. filtro e cursore): se cambia, le modifiche non salvate sono scartate.
+    """
+    saved, edits = st.session_state.get(f"{key}_pagina"), st.session_state.get(key) or {}
+    if saved is not None and saved["page"] == page and any(edits.get(k) for k in ("edited_rows", "added_rows", "deleted_rows")):
+        return saved["df"]
+    if saved is not None and saved["page"] != page: st.session_state.pop(key, None)
+    st.session_state[f"{key}_pagina"] = {"page": page, "df": df}
+    return df
+
+def reset_editor(key):
+    """Scarta le modifiche non salvate del data_editor 'key' e la pagina salvata: il rerun successivo mostra i dati aggiornati."""
+    st.session_state.pop(key, None); st.session_state.pop(f"{key}_pagina", None)
+
+def export_controls(key, filters):
+    """Scelta di dati e formato e download dell'export (data_export.py) con i filtri della pagina."""
+    c1, c2, c3 = st.columns([2, 2, 3])
+    table = c1.selectbox("Dati", data_export.EXPORT_TABLES, format_func={"risks": "Rischi", "reminders": "Reminder"}.get, key=f"export_tabella_{key}")
+    fmt = c2.selectbox("Formato", list(data_export.EXPORT_FORMATS), format_func=str.upper, key=f"export_formato_{key}")
+    if table == "reminders": c3.caption("Per i reminder si applica solo il filtro fornitore.")
+    if data_export.STREAMING_ROUTE:
+        # App avviata con asgi.py: il file è inviato in streaming dall'endpoint, autorizzato dal token di sessione
+        st.link_button("⬇️ Scarica", data_export.export_url(table, fmt, filters, st.query_params.get(TOKEN_PARAM, "")), use_container_width=True)
+        return
+    n_rows = count_risks(filters) if table == "risks" else data_export.count_rows(table, filters)
+    if n_rows > EXPORT_MAX_RIGHE_APP:
+        st.info(f"{n_rows} righe: oltre {EXPORT_MAX_RIGHE_APP} l'export dalla pagina richiede l'avvio con \"uvicorn asgi:app\" "
+                "(download in streaming) oppure la riga di comando \"python data_export.py\".")
+        return
+    # Con "streamlit run" il file è generato al clic e passa dal media storage di Streamlit (in memoria)
+    st.download_button(f"⬇️ Scarica {n_rows} righe", data=lambda: b"".join(data_export.stream_export(fmt, table, filters)),
+                       file_name=data_export.export_filename(table, fmt), mime=data_export.EXPORT_FORMATS[fmt][0],
+                       key=f"export_download_{key}", use_container_width=True)
+
+def search_panel(key, supplier_widget=None):
+    """
+    Casella di ricerca su rischi e reminder: risultati per pertinenza, paginati, e fornitori con nome simile.
+    Con supplier_widget (chiave del selectbox fornitore della pagina) i fornitori simili sono pulsanti che lo impostano.
+    """
+    c1, c2 = st.columns([4, 1])
+    query = c1.text_input("🔎 Cerca", key=f"cerca_{key}", placeholder="Fornitore, scenario di rischio o testo delle note")
+    table = c2.selectbox("In", ("risks", "reminders"), format_func={"risks": "Rischi", "reminders": "Reminder"}.get, key=f"cerca_tabella_{key}")
+    if not query.strip(): return
+    state = st.session_state.setdefault(f"cerca_pagina_{key}", {"query": None, "offset": 0})
+    if state["query"] != (query, table): state.update(query=(query, table), offset=0)
+
+    similar = load_similar_suppliers(query)
+    if similar:
+        st.caption("Fornitori con nome simile")
+        cols = st.columns(min(len(similar), 5))
+        for i, m in enumerate(similar[:5]):
+            label = f"{m['fornitore']} ({m['rischi']} rischi, {m['reminder']} reminder)"
+            if supplier_widget and m["rischi"]:
+                # Il filtro della pagina elenca i fornitori dell'anagrafica: la grafia trovata è tradotta nel suo fornitore
+                supplier = load_supplier_directory()[2].get(m["fornitore"], m["fornitore"])
+                cols[i].button(label, key=f"simile_{key}_{i}", use_container_width=True,
+                               on_click=lambda name=supplier: st.session_state.update({supplier_widget: name}))
+            else: cols[i].caption(label)
+
+    total, page = search_text(table, query, state["offset"])
+    if not total:
+        st.info("Nessun risultato per la ricerca."); return
+    st.dataframe(page, use_container_width=True, hide_index=True, column_config={
+        "estratto": st.column_config.TextColumn("Estratto note", width="large"), "id": st.column_config.NumberColumn("ID")})
+    p1, p2, p3 = st.columns([1, 2, 1])
+    if p1.button("◀ Precedente", key=f"cerca_prev_{key}", disabled=state["offset"] == 0, use_container_width=True):
+        state["offset"] -= SEARCH_PAGE_SIZE; st.rerun()
+    p2.caption(f"Pagina {state['offset'] // SEARCH_PAGE_SIZE + 1} di {-(-total // SEARCH_PAGE_SIZE)} · {total} risultati")
+    if p3.button("Successiva ▶", key=f"cerca_next_{key}", disabled=state["offset"] + SEARCH_PAGE_SIZE >= total, use_container_width=True):
+        state["offset"] += SEARCH_PAGE_SIZE; st.rerun()
 
 # —————————————————————————————
 # 4) LOGIN, LOGOUT & GESTIONE SESSIONE
 # —————————————————————————————
+# Il token di sessione firmato è nell'URL (?sessione=...): dopo un riavvio del server il browser si riconnette
+# con lo stesso URL e la sessione è ripristinata senza un nuovo login
+TOKEN_PARAM = "sessione"
+# Il token è rinnovato (nuova scadenza) al più una volta in questo intervallo; al rinnovo si verifica anche che
+# non sia stato revocato (logout da un'altra sessione, cambio password o ruolo)
+TOKEN_REFRESH_S = 60
+
+@st.cache_resource
+def get_login_limiter():
+    return LoginLimiter()
+
+def start_session(user, page="Dashboard"):
+    """'user': {id, username, role, generazione_token} (auth.authenticate o riga della cache users)."""
+    user = {k: user[k] for k in ("id", "username", "role", "generazione_token")}
+    st.session_state.update(authenticated=True, username=user["username"], role=user["role"], user=user, page=page,
+                            last_activity=datetime.now(), token_issued=datetime.now())
+    st.query_params[TOKEN_PARAM] = issue_token(user)
+
+def cached_user(user_id):
+    """Riga corrente dell'utente dalla cache condivisa di users (None se eliminato)."""
+    users = load_users()
+    rows = users[users["id"] == user_id]
+    return None if rows.empty else rows.iloc[0]
+
 def do_login(user, pwd):
-    row = conn.execute("SELECT role FROM users WHERE username=? AND password=?", (user, pwd)).fetchone()
-    if row:
-        st.session_state.update(authenticated=True, username=user, role=row["role"], page="Dashboard", last_activity=datetime.now())
-        return True
-    return False
+    """Restituisce None se il login riesce, altrimenti il messaggio di errore."""
+    limiter = get_login_limiter()
+    wait = limiter.retry_after(user)
+    if wait: return f"Troppi tentativi falliti per questo utente. Riprova tra {math.ceil(wait / 60)} minuti."
+    account = authenticate(read_connection, write_connection, user, pwd)
+    if account is None:
+        limiter.failed(user)
+        return "Credenziali errate"
+    limiter.succeeded(user)
+    start_session(account)
+    return None
+
+def restore_session():
+    """Ripristina la sessione dal token nell'URL: solo verifica della firma e dell'utente (dalla cache), nessun hash."""
+    token = read_token(st.query_params.get(TOKEN_PARAM, ""))
+    if token is None: return False
+    # Utenti eliminati, con ruolo cambiato o token revocati dopo l'emissione devono rifare il login
+    user = cached_user(token.get("i"))
+    if not token_matches(token, user): return False
+    start_session(user, page=st.session_state.page)
+    return True
+
+def revoke_sessions(username):
+    """Revoca i token di sessione dell'utente: l'URL con il token (cronologia, link condivisi) non ripristina più la sessione."""
+    with write_connection() as conn:
+        revoke_tokens(conn, username)
+        bump_table_version(conn, "users")
+        conn.commit()
 
 def do_logout(message="Logout effettuato con successo."):
-    st.session_state.update(authenticated=False, username="", role="", page="Login", last_activity=None)
+    st.session_state.update(authenticated=False, username="", role="", user=None, page="Login", last_activity=None)
+    st.query_params.pop(TOKEN_PARAM, None)
     st.info(message)
 
 set_page_style()
 
+if not st.session_state.authenticated and TOKEN_PARAM in st.query_params and not restore_session():
+    st.query_params.pop(TOKEN_PARAM, None)
+
 if not st.session_state.authenticated:
     st.title("Risk Management Dashboard")
     st.markdown("---")
@@ -215,18 +563,27 @@ if not st.session_state.authenticated:
         with st.form("login_form"):
             user, pwd = st.text_input("Username"), st.text_input("Password", type="password")
             if st.form_submit_button("Entra", use_container_width=True):
-                if do_login(user, pwd): st.rerun()
-                else: st.error("Credenziali errate")
+                error = do_login(user, pwd)
+                if error is None: st.rerun()
+                else: st.error(error)
     st.stop()
 
 if st.session_state.authenticated:
     if st.session_state.last_activity:
-        # La sessione scade dopo 30 minuti (1800 secondi) di inattività
-        if (datetime.now() - st.session_state.last_activity).total_seconds() > 1800:
+        # La sessione scade dopo TOKEN_TTL_S secondi (30 minuti) di inattività, come il token
+        if (datetime.now() - st.session_state.last_activity).total_seconds() > TOKEN_TTL_S:
             do_logout(message="Sessione scaduta per inattività. Effettua nuovamente il login.")
             st.rerun()
         else:
             st.session_state.last_activity = datetime.now()
+            # Rinnovo della scadenza del token: la sessione ripristinabile segue l'attività dell'utente
+            if (st.session_state.last_activity - st.session_state.token_issued).total_seconds() > TOKEN_REFRESH_S:
+                current = cached_user(st.session_state.user["id"]) if st.session_state.user else None
+                if current is None or (int(current["generazione_token"]), current["role"]) != (st.session_state.user["generazione_token"], st.session_state.role):
+                    do_logout(message="Sessione revocata (logout, cambio password o ruolo). Effettua nuovamente il login.")
+                    st.rerun()
+                st.session_state.token_issued = st.session_state.last_activity
+                st.query_params[TOKEN_PARAM] = issue_token(st.session_state.user)
     else:
         do_logout(message="Errore di sessione. Effettua nuovamente il login.")
         st.rerun()
@@ -236,7 +593,7 @@ with st.sidebar:
     st.markdown(f"Benvenuto, **{st.session_state.username}**!")
     st.markdown(f"Ruolo: `{st.session_state.role}`")
     st.markdown("---")
-    base_menu, modify_menu, admin_menu = ["Dashboard", "Report PDF"], ["Censimento Fornitori", "Modifica", "Follow-up"], ["Admin"]
+    base_menu, modify_menu, admin_menu = ["Dashboard", "Report PDF"], ["Censimento Fornitori", "Import Rischi", "Modifica", "Follow-up"], ["Admin"]
     final_menu = base_menu.copy()
     if st.session_state.role in ['modify', 'admin']: final_menu.extend(modify_menu)
     if st.session_state.role == 'admin': final_menu.extend(admin_menu)
@@ -246,6 +603,7 @@ with st.sidebar:
             st.rerun()
     st.markdown("---")
     if st.button("🔓 Logout"):
+        revoke_sessions(st.session_state.username)
         do_logout()
         st.rerun()
 
@@ -253,53 +611,87 @@ with st.sidebar:
 # 5) ROUTING DELLE PAGINE
 # —————————————————————————————
 page = st.session_state.page
+# Il rerun si chiude in fondo al file; se interrotto da st.rerun/st.stop viene chiuso all'avvio del successivo
+profiling.begin_rerun(page, st.session_state.username)
 st.title(page)
 
 if page == "Dashboard":
-    df_risks = load_risks_df()
-    df_reminders = load_reminders_df()
-
-    st.subheader("Reminder Scaduti (5+ giorni)")
-    if not df_reminders.empty and 'giorni_trascorsi' in df_reminders.columns:
-        reminders_scaduti = df_reminders[(df_reminders['giorni_trascorsi'] >= 5) & (df_reminders['stato_reminder'] == 'Attivo')]
-    else:
-        reminders_scaduti = pd.DataFrame()
-
-    if reminders_scaduti.empty:
+    st.subheader(f"Reminder Scaduti ({REMINDER_SOGLIA_GIORNI}+ giorni)")
+    n_scaduti, reminders_scaduti = load_overdue_reminders(OVERDUE_BANNER_MAX)
+    if not n_scaduti:
         st.success("✔️ Nessun reminder scaduto. Ottimo lavoro!")
     else:
-        for _, row in reminders_scaduti.iterrows():
-            st.warning(f"⚠️ **{row['fornitore_nome']}**: Sono passati **{row['giorni_trascorsi']} giorni** dall'invio dell'email. Controllare le risposte.")
+        # Un solo banner per tutti i reminder mostrati, dal più vecchio
+        st.warning("\n".join(f"- ⚠️ **{fornitore}**: Sono passati **{giorni} giorni** dall'invio dell'email. Controllare le risposte."
+                             for fornitore, giorni in zip(reminders_scaduti['fornitore_nome'], reminders_scaduti['giorni_trascorsi'])))
+        if n_scaduti > OVERDUE_BANNER_MAX:
+            with st.expander(f"Mostra tutti i {n_scaduti} reminder scaduti"):
+                st.dataframe(load_overdue_reminders()[1], use_container_width=True, hide_index=True, column_config={
+                    "id": None, "fornitore_nome": "Fornitore", "data_invio": st.column_config.DateColumn("Data Invio", format="DD/MM/YYYY"),
+                    "giorni_trascorsi": st.column_config.NumberColumn("Giorni Trascorsi")})
 
     st.markdown("---")
     st.subheader("Riepilogo Rapido Rischi")
-    total, open_r, closed = len(df_risks), len(df_risks[df_risks['stato'] == 'aperto']), len(df_risks[df_risks['stato'] == 'chiuso'])
+    kpis = risk_kpis(load_risk_summary())
     c1, c2, c3 = st.columns(3)
-    c1.metric("Rischi Totali", total); c2.metric("Rischi Aperti", open_r); c3.metric("Rischi Chiusi", closed)
+    c1.metric("Rischi Totali", kpis["totale"]); c2.metric("Rischi Aperti", kpis["aperti"]); c3.metric("Rischi Chiusi", kpis["chiusi"])
+    st.markdown("---")
+    search_panel("dashboard", supplier_widget="dashboard_sel")
+    st.markdown("---")
+    st.subheader("Fornitori più a Rischio")
+    ranking = load_supplier_ranking()
+    if ranking.empty: st.info("Nessun fornitore con rischi aperti o test mancanti.")
+    else:
+        st.dataframe(ranking, use_container_width=True, hide_index=True, column_order=["nome", "punteggio", "rischi_aperti", "rischi_scaduti", "test_mancanti", "rischi", "reminder"],
+                     column_config={"nome": "Fornitore", "punteggio": st.column_config.ProgressColumn("Punteggio", format="%.1f", min_value=0, max_value=float(ranking["punteggio"].max())),
+                                    "rischi_aperti": "Rischi Aperti", "rischi_scaduti": "Aperti Scaduti", "test_mancanti": "Test Mancanti", "rischi": "Rischi Totali", "reminder": "Reminder"})
     st.markdown("---")
 
     c1, c2 = st.columns([1, 3])
     with c1:
         st.subheader("Filtri Rischi")
-        sup_opts = ["Tutti"] + sorted(df_risks["fornitore"].unique().tolist())
-        sel_sup = st.selectbox("Fornitore", sup_opts)
+        sup_opts = ["Tutti"] + load_supplier_directory()[0]
+        sel_sup = st.selectbox("Fornitore", sup_opts, key="dashboard_sel")
         sel_stati = st.multiselect("Stato", ["aperto", "chiuso"], default=["aperto", "chiuso"])
-    dff = df_risks[df_risks["stato"].isin(sel_stati)]
-    if sel_sup != "Tutti": dff = dff[dff["fornitore"] == sel_sup]
+        gravita_opts = load_risk_options("gravita")
+        sel_gravita = st.multiselect("Gravità", gravita_opts, default=gravita_opts)
+    risk_filters = {"fornitori": None if sel_sup == "Tutti" else supplier_filter([sel_sup]), "stati": sel_stati, "gravita": sel_gravita}
+    summary = load_risk_summary(risk_filters["fornitori"])
+    agg_bar = risk_counts_by(summary, "stato", sel_stati, sel_gravita)
     with c2:
         st.subheader("Grafici di Riepilogo Rischi")
-        if dff.empty: st.warning("Nessun rischio da visualizzare con i filtri correnti.")
+        if agg_bar.empty: st.warning("Nessun rischio da visualizzare con i filtri correnti.")
         else:
             gc1, gc2 = st.columns(2)
             with gc1:
-                fig_bar = px.bar(dff.groupby("stato").size().reset_index(name="count"), x="stato", y="count", color="stato", title="Conteggio Rischi per Stato")
+                fig_bar = px.bar(agg_bar, x="stato", y="count", color="stato", title="Conteggio Rischi per Stato")
                 st.plotly_chart(fig_bar, use_container_width=True)
             with gc2:
-                agg_pie = dff.groupby("gravita").size().reset_index(name="count")
+                agg_pie = risk_counts_by(summary, "gravita", sel_stati, sel_gravita)
                 fig_pie = px.pie(agg_pie, values="count", names="gravita", hole=0.4, title="Ripartizione Rischi per Gravità", color_discrete_map={"Critical": "#d9534f", "High": "#f0ad4e", "Low": "#5cb85c"})
                 st.plotly_chart(fig_pie, use_container_width=True)
     st.subheader("Dettaglio Rischi")
-    st.dataframe(style_risk_dataframe(dff), use_container_width=True)
+    df_page, render_pager = paged_risks("dashboard", risk_filters)
+    with profiling.span("render", "Dettaglio Rischi"):
+        st.dataframe(style_risk_dataframe(df_page), use_container_width=True, column_config={"row_version": None, "supplier_id": None})
+    render_pager()
+    with st.expander("⬇️ Esporta dati (CSV, Parquet, Excel)"):
+        export_controls("dashboard", risk_filters)
+
+    st.markdown("---")
+    st.subheader("Andamento Rischi")
+    periodo = st.selectbox("Periodo", list(TREND_PERIODI), index=1, key="trend_periodo")
+    open_df, overdue_df, mttc_df = load_snapshot_trends(risk_filters["fornitori"], sel_gravita, TREND_PERIODI[periodo])
+    if open_df.empty: st.info("Nessuna fotografia giornaliera nel periodo: i giorni passati si ricostruiscono con 'python history.py --ricostruisci'.")
+    else:
+        tc1, tc2, tc3 = st.columns(3)
+        with tc1:
+            st.plotly_chart(px.line(open_df, x="giorno", y="aperti", title="Rischi Aperti nel Tempo"), use_container_width=True)
+        with tc2:
+            st.plotly_chart(px.area(overdue_df, x="giorno", y="rischi", color="situazione", title="Aperti: Scaduti vs In Tempo",
+                                    color_discrete_map={"Scaduti": "#d9534f", "In tempo": "#5cb85c"}), use_container_width=True)
+        with tc3:
+            st.plotly_chart(px.bar(mttc_df, x="mese", y="giorni_medi", title="Tempo Medio di Chiusura (giorni)"), use_container_width=True)
 
 
 elif page == "Follow-up":
@@ -310,22 +702,26 @@ elif page == "Follow-up":
             data_invio = st.date_input("Data di invio email", value=datetime.today())
             if st.form_submit_button("Aggiungi Reminder", use_container_width=True):
                 if fornitore_nome:
-                    conn.execute("INSERT INTO reminders (fornitore_nome, data_invio, stato_reminder) VALUES (?, ?, 'Attivo')", (fornitore_nome, data_invio.isoformat()))
-                    conn.commit()
+                    with write_connection() as conn:
+                        bump_table_version(conn, "reminders")
+                        conn.execute(text(f"INSERT INTO reminders (fornitore_nome, data_invio, stato_reminder, row_version) VALUES (:fornitore_nome, :data_invio, 'Attivo', {ROW_VERSION_SQL.format('reminders')})"),
+                                     {"fornitore_nome": fornitore_nome, "data_invio": data_invio.isoformat()})
+                        after_write(conn, "reminders")
+                        conn.commit()
                     st.success(f"Reminder per {fornitore_nome} aggiunto!"); st.rerun()
                 else: st.error("Il nome del fornitore è obbligatorio.")
     st.markdown("---")
     st.subheader("Tracciamento Reminder Attivi")
-    df_reminders = load_reminders_df()
-    dff_attivi = df_reminders[df_reminders['stato_reminder'] == 'Attivo'].copy()
+    if (conflict := st.session_state.pop("editor_reminders_conflitto", None)): st.warning(conflict)
+    dff_attivi = editor_page("editor_reminders", load_reminders_df("Attivo"))
     if dff_attivi.empty:
         st.success("✔️ Nessun reminder attivo al momento.")
     else:
-        edited_reminders = st.data_editor(dff_attivi, column_config={
-                "id": None, "fornitore_nome": st.column_config.TextColumn("Fornitore", width="medium"),
+        st.data_editor(dff_attivi, column_config={
+                "id": None, "row_version": None, "supplier_id": None, "fornitore_nome": st.column_config.TextColumn("Fornitore", width="medium"),
                 "data_invio": st.column_config.DateColumn("Data Invio", format="DD/MM/YYYY", disabled=True),
                 "giorni_trascorsi": st.column_config.NumberColumn("Giorni Trascorsi"),
-                "giorni_al_reminder": st.column_config.ProgressColumn("Giorni a Notifica (5)", format="%f", min_value=0, max_value=5),
+                "giorni_al_reminder": st.column_config.ProgressColumn(f"Giorni a Notifica ({REMINDER_SOGLIA_GIORNI})", format="%f", min_value=0, max_value=REMINDER_SOGLIA_GIORNI),
                 "stato_reminder": st.column_config.SelectboxColumn("Stato", options=["Attivo", "Risposto"]),
                 "note": st.column_config.TextColumn("Note", width="large"), "test_bc": st.column_config.CheckboxColumn("Test BC"),
                 "test_it": st.column_config.CheckboxColumn("Test IT"), "test_pt_va": st.column_config.CheckboxColumn("PT/VA"),
@@ -333,21 +729,16 @@ elif page == "Follow-up":
             }, use_container_width=True, hide_index=True, key="editor_reminders")
         if st.button("Salva Modifiche Reminder", use_container_width=True):
             try:
-                original_to_compare = dff_attivi.set_index('id')
-                edited_to_compare = pd.DataFrame(edited_reminders).set_index('id')
-                diff_df = original_to_compare.compare(edited_to_compare, keep_shape=True).dropna(how='all', axis=0)
-
-                if diff_df.empty: st.toast("Nessuna modifica da salvare.")
+                with write_connection() as conn:
+                    saved = save_editor_changes(conn, "reminders", dff_attivi, st.session_state.get("editor_reminders"))
+                if not saved["modificate"]: st.toast("Nessuna modifica da salvare.")
                 else:
-                    ids_to_update = diff_df.index.unique()
-                    for row_id in ids_to_update:
-                        row_to_update = edited_to_compare.loc[row_id]
-                        data_tuple = (row_to_update["fornitore_nome"], row_to_update["stato_reminder"], row_to_update["note"],
-                            int(row_to_update["test_bc"]), int(row_to_update["test_it"]), int(row_to_update["test_pt_va"]),
-                            int(row_to_update["access_review"]), int(row_to_update["ppt"]), int(row_id))
-                        conn.execute("UPDATE reminders SET fornitore_nome=?, stato_reminder=?, note=?, test_bc=?, test_it=?, test_pt_va=?, access_review=?, ppt=? WHERE id=?", data_tuple)
-                    conn.commit()
-                    st.success(f"Salvate {len(ids_to_update)} modifiche."); st.rerun()
+                    # Lo stato delta dell'editor va azzerato: le posizioni non valgono più sui dati ricaricati
+                    reset_editor("editor_reminders")
+                    st.success(f"Salvate {saved['modificate']} modifiche."); st.rerun()
+            except SaveConflict as e:
+                # Le modifiche in conflitto sono scartate: l'editor riparte dai dati aggiornati
+                reset_editor("editor_reminders"); st.session_state["editor_reminders_conflitto"] = f"{e} I dati sono stati ricaricati: ripeti le modifiche."; st.rerun()
             except Exception as e: st.error(f"Errore durante il salvataggio: {e}")
 
 elif page == "Censimento Fornitori":
@@ -358,10 +749,10 @@ elif page == "Censimento Fornitori":
             fornitore = st.text_input("Nome fornitore")
             contract_owner = st.text_input("Contract Owner")
             area_riferimento = st.text_input("Area di riferimento")
-            gravita = st.selectbox("Livello di gravità", ["Low","High","Critical"])
+            gravita = st.selectbox("Livello di gravità", GRAVITA_VALUES)
         with c2:
-            rischio = st.selectbox("Scenario di rischio", ["-- seleziona --", "Inadeguate Security of third party", "Inadeguate resilience of third party", "Inadequate outsourcing of third party"])
-            stato = st.radio("Stato", ["aperto","chiuso"], horizontal=True)
+            rischio = st.selectbox("Scenario di rischio", ["-- seleziona --", *RISCHIO_SCENARI])
+            stato = st.radio("Stato", STATI_RISCHIO, horizontal=True)
             data_inizio = st.date_input("Data inizio", value=datetime.today())
             data_fine = st.date_input("Due Date", value=datetime.today())
             data_chiusura = st.date_input("Data di chiusura effettiva", value=datetime.today()) if stato == "chiuso" else None
@@ -370,133 +761,139 @@ elif page == "Censimento Fornitori":
         perc_avanzamento = st.slider("Percentuale di avanzamento (%)", 0, 100, 0)
         note = st.text_area("Note libere")
         if st.form_submit_button("Salva Rischio", use_container_width=True):
-            if not all([fornitore, contract_owner, area_riferimento]) or rischio.startswith("--"):
+            # Stesse regole dell'import massivo (risk_import.validate_risks)
+            records, errors = validate_risks(pd.DataFrame([{
+                "data_inizio": data_inizio.isoformat(), "data_fine": data_fine.isoformat(), "fornitore": fornitore, "rischio": "" if rischio.startswith("--") else rischio,
+                "stato": stato, "gravita": gravita, "note": note, "data_chiusura": data_chiusura.isoformat() if data_chiusura else None,
+                "contract_owner": contract_owner, "area_riferimento": area_riferimento, "perc_avanzamento": perc_avanzamento}]))
+            if any(e["errore"] == "Campo obbligatorio" for e in errors):
                 st.error("Compila tutti i campi obbligatori.")
+            elif errors:
+                st.error("; ".join(f"{e['colonna']}: {e['errore']}" for e in errors))
             else:
-                conn.execute("INSERT INTO risks(data_inizio,data_fine,fornitore,rischio,stato,gravita,note,data_chiusura,contract_owner,area_riferimento,perc_avanzamento) VALUES(?,?,?,?,?,?,?,?,?,?,?)",
-                             (data_inizio.isoformat(), data_fine.isoformat(), fornitore, rischio, stato, gravita, note, data_chiusura.isoformat() if data_chiusura else None, contract_owner, area_riferimento, perc_avanzamento))
-                conn.commit()
+                with write_connection() as conn:
+                    insert_risks(conn, records, st.session_state.username)
+                    conn.commit()
                 st.success("Rischio inserito.")
 
+elif page == "Import Rischi":
+    st.info("Importa in blocco i rischi da un file CSV o Excel (.xlsx) con una riga di intestazione. "
+            "Ogni riga è validata con le stesse regole del censimento; le righe valide sono inserite a blocchi e quelle scartate elencate con il motivo.")
+    st.caption(f"Colonne obbligatorie: {', '.join(REQUIRED_COLUMNS)}. Facoltative: note, data_chiusura (obbligatoria per i rischi chiusi), perc_avanzamento. "
+               "Sono accettate anche le etichette del form (es. \"Nome fornitore\", \"Due Date\"); date in formato aaaa-mm-gg o gg/mm/aaaa.")
+    uploaded = st.file_uploader("File da importare", type=["csv", "xlsx"])
+    dry_run = st.checkbox("Solo verifica (nessun inserimento)")
+    if uploaded and st.button("Verifica file" if dry_run else "Importa", use_container_width=True):
+        import_errors, progress = [], st.empty()
+        def keep_errors(errors):
+            # Nella pagina sono conservati al più IMPORT_ERRORI_MAX errori; il totale è nel riepilogo
+            import_errors.extend(errors[:IMPORT_ERRORI_MAX - len(import_errors)])
+        def show_progress(summary):
+            progress.info(f"⏳ {summary['lette']} righe elaborate, {summary['importate']} importate, {summary['scartate']} scartate...")
+        try:
+            summary = import_risks(uploaded, file_kind(uploaded.name), dry_run=dry_run, on_errors=keep_errors, on_progress=show_progress,
+                                   user=st.session_state.username)
+            st.session_state.import_result = {"file": uploaded.name, "verifica": dry_run, "riepilogo": summary, "errori": import_errors}
+        except ValueError as e:
+            st.session_state.pop("import_result", None)
+            st.error(str(e))
+        progress.empty()
+    result = st.session_state.get("import_result")
+    if result:
+        summary = result["riepilogo"]
+        st.subheader(f"Esito {'verifica' if result['verifica'] else 'import'}: {result['file']}")
+        c1, c2, c3, c4 = st.columns(4)
+        c1.metric("Righe lette", summary["lette"]); c2.metric("Importate", summary["importate"])
+        c3.metric("Scartate", summary["scartate"]); c4.metric("Righe/s", f"{summary['lette'] / max(summary['secondi'], 1e-9):,.0f}")
+        if result["errori"]:
+            if summary["errori"] > len(result["errori"]):
+                st.warning(f"Mostrati i primi {len(result['errori'])} errori su {summary['errori']}: per l'elenco completo usa risk_import.py --errori.")
+            st.dataframe(pd.DataFrame(result["errori"]), use_container_width=True, hide_index=True)
+            st.download_button("⬇️ Scarica errori (CSV)", data=errors_csv(result["errori"]), file_name="errori_import.csv", mime="text/csv")
+        else:
+            st.success("Nessuna riga scartata.")
+
 elif page == "Modifica":
-    df_risks = load_risks_df()
     st.info("In questa sezione puoi modificare i dati dei rischi esistenti.")
-    sup_opts = ["Tutti"] + sorted(df_risks["fornitore"].unique().tolist())
+    search_panel("modifica", supplier_widget="modifica_sel")
+    sup_opts = ["Tutti"] + load_supplier_directory()[0]
     sel = st.selectbox("Filtra Fornitore per modificare", sup_opts, key="modifica_sel")
-    dff_original = df_risks.copy()
-    if sel != "Tutti":
-        dff_original = dff_original[dff_original["fornitore"] == sel]
+    dff_page, render_pager = paged_risks("modifica", {"fornitori": None if sel == "Tutti" else supplier_filter([sel])}, reset_keys=("data_editor_modifica",))
+    if (conflict := st.session_state.pop("data_editor_modifica_conflitto", None)): st.warning(conflict)
+    dff_original = editor_page("data_editor_modifica", dff_page, page=(sel, st.session_state["pager_modifica"]["cursors"][-1]))
 
-    edited_df = st.data_editor(dff_original, use_container_width=True,
-        column_config={"id": st.column_config.NumberColumn("ID", disabled=True), "data_fine": st.column_config.DateColumn("Due Date", format="YYYY-MM-DD")},
+    st.data_editor(dff_original, use_container_width=True, num_rows="dynamic",
+        column_config={"id": st.column_config.NumberColumn("ID", disabled=True), "row_version": None, "supplier_id": None, "data_fine": st.column_config.DateColumn("Due Date", format="YYYY-MM-DD")},
         key="data_editor_modifica")
+    render_pager()
 
     if st.button("Salva Modifiche", use_container_width=True):
         try:
-            original_to_compare = dff_original.set_index('id')
-            edited_to_compare = edited_df.set_index('id')
-            diff_df = original_to_compare.compare(edited_to_compare)
-
-            if diff_df.empty:
+            with write_connection() as conn:
+                saved = save_editor_changes(conn, "risks", dff_original, st.session_state.get("data_editor_modifica"), st.session_state.username)
+            if not any(saved.values()):
                 st.toast("Nessuna modifica da salvare.")
             else:
-                ids_to_update = diff_df.index.get_level_values('id').unique()
-                for row_id in ids_to_update:
-                    row_to_update = edited_to_compare.loc[row_id]
-                    data_tuple = (
-                        row_to_update["data_inizio"].isoformat() if pd.notna(row_to_update["data_inizio"]) else None,
-                        row_to_update["data_fine"].isoformat() if pd.notna(row_to_update["data_fine"]) else None,
-                        row_to_update["fornitore"], row_to_update["rischio"], row_to_update["stato"], row_to_update["gravita"], row_to_update["note"],
-                        row_to_update["data_chiusura"].isoformat() if pd.notna(row_to_update["data_chiusura"]) else None,
-                        row_to_update["contract_owner"], row_to_update["area_riferimento"], int(row_to_update["perc_avanzamento"]), int(row_id))
-                    conn.execute("UPDATE risks SET data_inizio=?, data_fine=?, fornitore=?, rischio=?, stato=?, gravita=?, note=?, data_chiusura=?, contract_owner=?, area_riferimento=?, perc_avanzamento=? WHERE id=?", data_tuple)
-                conn.commit()
-                st.success(f"Salvate {len(ids_to_update)} modifiche."); st.rerun()
+                reset_editor("data_editor_modifica")
+                st.success(f"Salvate {saved['modificate']} modifiche, {saved['inserite']} inserimenti, {saved['eliminate']} eliminazioni."); st.rerun()
+        except SaveConflict as e:
+            reset_editor("data_editor_modifica"); st.session_state["data_editor_modifica_conflitto"] = f"{e} I dati sono stati ricaricati: ripeti le modifiche."; st.rerun()
+        except InvalidRows as e:
+            # Stesse regole del form di censimento; le modifiche restano nell'editor per la correzione
+            st.error(f"{e} " + "; ".join(f"nuova riga {x['riga']}, {x['colonna']}: {x['errore']}" for x in e.errors))
         except Exception as e:
             st.error(f"Errore durante il salvataggio: {e}")
 
+    with st.expander("🕘 Storico modifiche di un rischio"):
+        risk_id = st.number_input("ID rischio", min_value=1, step=1, value=None, key="storico_id")
+        if risk_id:
+            with read_connection() as conn:
+                versions = pd.DataFrame(risk_history(conn, int(risk_id)))
+            if versions.empty: st.info("Nessuna modifica registrata per questo rischio.")
+            else: st.dataframe(versions, use_container_width=True, hide_index=True, column_config={"id": None, "risk_id": None, "row_version": None})
+
 elif page == "Report PDF":
-    df_risks = load_risks_df()
     st.info("Genera un report PDF avanzato con grafici di sintesi e dettagli strutturati per ogni rischio.")
     st.subheader("1. Seleziona il Perimetro del Report")
-    all_suppliers = sorted(df_risks["fornitore"].unique().tolist())
-    default_stati = list(df_risks["stato"].unique())
-    default_gravita = sorted(list(df_risks["gravita"].unique()))
+    all_suppliers = load_supplier_directory()[0]
+    default_stati = load_risk_options("stato")
+    default_gravita = load_risk_options("gravita")
     sel_suppliers = st.multiselect("Filtro Fornitore/i", all_suppliers)
     c1, c2 = st.columns(2)
     with c1: sel_stati = st.multiselect("Filtro Stato", default_stati, default=default_stati)
     with c2: sel_gravita = st.multiselect("Filtro Gravità", default_gravita, default=default_gravita)
-
-    dff = df_risks.copy()
-    if sel_suppliers: dff = dff[dff["fornitore"].isin(sel_suppliers)]
-    dff = dff[dff["stato"].isin(sel_stati) & dff["gravita"].isin(sel_gravita)]
+    report_filters = {"fornitori": supplier_filter(sel_suppliers), "stati": sel_stati, "gravita": sel_gravita}
+    n_selected = count_risks(report_filters)
 
     st.markdown("---")
     st.subheader("2. Anteprima Dati e Generazione PDF")
-    if dff.empty: st.warning("Nessun dato corrisponde ai filtri selezionati.")
+    if not n_selected: st.warning("Nessun dato corrisponde ai filtri selezionati.")
     else:
-        st.write(f"**{len(dff)} record selezionati** per il report.")
-        st.dataframe(dff.head(), use_container_width=True)
-        if st.button("🚀 Genera Report PDF Avanzato", use_container_width=True):
-            def build_advanced_pdf(data: pd.DataFrame) -> bytes:
-                buffer = BytesIO()
-                doc = BaseDocTemplate(buffer, pagesize=A4, leftMargin=30, rightMargin=30, topMargin=30, bottomMargin=50)
-                styles=getSampleStyleSheet()
-                style_title, style_h1, style_h2, style_body = styles['Title'], styles['h1'], styles['h2'], styles['BodyText']
-                style_body.leading = 14
-                color_map = {"Critical": colors.HexColor("#d9534f"), "High": colors.HexColor("#f0ad4e"), "Low": colors.HexColor("#5cb85c")}
-
-                def header_footer(canvas, doc):
-                    canvas.saveState()
-                    canvas.setFont('Helvetica', 9)
-                    canvas.drawString(doc.leftMargin, doc.pagesize[1] - 20, "Report Rischi Fornitori | Confidenziale")
-                    canvas.drawRightString(doc.pagesize[0] - doc.rightMargin, doc.bottomMargin - 20, f"Pagina {doc.page}")
-                    canvas.restoreState()
-
-                frame = Frame(doc.leftMargin, doc.bottomMargin, doc.width, doc.height, id='normal')
-                template = PageTemplate(id='main', frames=frame, onPage=header_footer)
-                doc.addPageTemplates([template])
-
-                story = []
-                story.append(Paragraph("Report di Analisi Rischi", style_title)); story.append(Spacer(1, 24))
-                story.append(Paragraph(f"Data di Generazione: {datetime.now().strftime('%d/%m/%Y %H:%M')}", style_body))
-                story.append(Paragraph(f"Fornitori Analizzati: {', '.join(sel_suppliers) if sel_suppliers else 'Tutti'}", style_body)); story.append(Spacer(1, 48))
-                story.append(Paragraph("Executive Summary", style_h1)); story.append(Spacer(1, 12))
-                total, open_r, critical = len(data), len(data[data['stato'] == 'aperto']), len(data[data['gravita'] == 'Critical'])
-                story.append(Paragraph(f"Totale riscontri: {total} | Aperti: {open_r} | Critici: {critical}", style_body)); story.append(Spacer(1, 24))
-
-                if not data.empty and not data.groupby("gravita").size().empty:
-                    try:
-                        agg_pie = data.groupby("gravita").size().reset_index(name="count")
-                        fig_pie = px.pie(agg_pie, values="count", names="gravita", title="Ripartizione per Gravità", color="gravita", color_discrete_map=color_map)
-                        pie_img_bytes = fig_pie.to_image(format="png", width=500, height=350, engine="kaleido")
-                        story.append(Image(BytesIO(pie_img_bytes), width=450, height=315))
-                    except Exception as e: story.append(Paragraph(f"Errore generazione grafico: {e}", style_body))
-
-                story.append(Spacer(1, 24)); story.append(Paragraph("Dettaglio dei Riscontri", style_h1))
-                for fornitore, group in data.groupby("fornitore"):
-                    story.append(Spacer(1, 12)); story.append(Paragraph(f"Fornitore: {fornitore}", style_h2))
-                    for _, risk in group.iterrows():
-                        risk_color = color_map.get(risk['gravita'], colors.black)
-                        risk_title_style = ParagraphStyle(name=f'RiskTitleStyle_{risk["id"]}', parent=style_h2, textColor=risk_color)
-                        story.append(Spacer(1, 12)); story.append(Paragraph(f"ID {risk['id']}: {risk.get('rischio', 'N/D')}", risk_title_style))
-                        details_data = [['Gravità:', Paragraph(f"<b>{risk.get('gravita', 'N/D')}</b>", style_body)],
-                                        ['Stato:', risk.get('stato', 'N/D')],
-                                        ['Due Date:', risk['data_fine'].strftime('%d/%m/%Y') if pd.notna(risk['data_fine']) else 'N/A'],
-                                        ['Owner:', risk.get('contract_owner', 'N/D')], ['Avanz.:', f"{risk.get('perc_avanzamento', 0)}%"],
-                                        ['Note:', Paragraph(risk.get('note', 'Nessuna nota.') if pd.notna(risk.get('note')) else 'Nessuna nota.', style_body)],
-                                        ['Data Chiusura:', risk['data_chiusura'].strftime('%d/%m/%Y') if pd.notna(risk['data_chiusura']) else 'N/A']]
-                        details_table = Table(details_data, colWidths=[100, doc.width - 100])
-                        details_table.setStyle(TableStyle([('VALIGN', (0,0), (-1,-1), 'TOP'), ('ALIGN', (0,0), (-1,-1), 'LEFT'), ('FONTNAME', (0,0), (0,-1), 'Helvetica-Bold'), ('BOX', (0,0), (-1,-1), 1, risk_color), ('INNERGRID', (0,0), (-1,-1), 0.25, colors.grey), ('BACKGROUND', (0,0), (0,-1), colors.HexColor("#F0F0F0"))]))
-                        story.append(details_table)
-                doc.build(story)
-                return buffer.getvalue()
-            with st.spinner("Creazione del report PDF avanzato..."):
-                try:
-                    pdf_bytes = build_advanced_pdf(dff)
-                    st.download_button(label="✅ Download Report PDF", data=pdf_bytes, file_name=f"report_rischi_{datetime.now().strftime('%Y%m%d')}.pdf", mime="application/pdf", use_container_width=True)
-                except Exception as e:
-                    st.error(f"Errore generazione PDF: {e}. Assicurati che la libreria 'kaleido' sia installata (`pip install kaleido`).")
+        st.write(f"**{n_selected} record selezionati** per il report.")
+        st.dataframe(load_risks_page(report_filters, limit=5), use_container_width=True, column_config={"row_version": None, "supplier_id": None})
+        with st.expander("⬇️ Esporta i dati del perimetro (CSV, Parquet, Excel)"):
+            export_controls("report", report_filters)
+        version = current_version("risks")
+        report_file = cached_report(report_key(report_filters, version))
+        if st.button("🚀 Genera Report PDF Avanzato", use_container_width=True) and not report_file:
+            # La generazione avviene in un processo worker: la sessione resta libera e controlla lo stato del job
+            st.session_state.report_job = {"id": submit_report(report_filters, version), "filtri": report_filters}
+        job = st.session_state.get("report_job")
+        if job and job["filtri"] != report_filters: job = None
+        status = job_status(job["id"]) if job else None
+        if status and status["stato"] == "completato": report_file = Path(status["file"])
+
+        if report_file:
+            st.download_button(label="✅ Download Report PDF", data=report_file.read_bytes, file_name=f"report_rischi_{datetime.now().strftime('%Y%m%d')}.pdf", mime="application/pdf", use_container_width=True)
+        elif status and status["stato"] in ("in coda", "in corso"):
+            @st.fragment(run_every=2)
+            def report_job_progress():
+                current = job_status(job["id"])
+                if current["stato"] not in ("in coda", "in corso"): st.rerun()
+                st.info(f"⏳ Report {current['stato']} ({current['secondi']:.0f}s). La pagina si aggiornerà automaticamente.")
+            report_job_progress()
+        elif status and status["stato"] == "errore":
+            st.error(f"Errore generazione PDF: {status['errore']}")
 
 elif page == "Admin":
     users_df = load_users()
@@ -513,10 +910,27 @@ elif page == "Admin":
                 if not nu or not npwd: st.error("Compila tutti i campi.")
                 else:
                     try:
-                        conn.execute("INSERT INTO users(username,password,role) VALUES(?,?,?)", (nu, npwd, nrole))
-                        conn.commit()
+                        with write_connection() as conn:
+                            create_user(conn, nu, npwd, nrole)
+                            bump_table_version(conn, "users")
+                            conn.commit()
                         st.success("Utente creato."); st.rerun()
-                    except sqlite3.IntegrityError: st.error("Username già esistente.")
+                    except IntegrityError: st.error("Username già esistente.")
+        st.markdown("---")
+        with st.form("update_user", clear_on_submit=True):
+            st.subheader("Modifica Utente")
+            user_to_update = st.selectbox("Seleziona utente", users_df["username"].tolist())
+            upwd = st.text_input("Nuova password (vuota = invariata)", type="password")
+            urole = st.selectbox("Ruolo", ["invariato", "read", "modify", "admin"])
+            if st.form_submit_button("Aggiorna Utente", use_container_width=True):
+                if not upwd and urole == "invariato": st.error("Indica una nuova password o un nuovo ruolo.")
+                else:
+                    # Le sessioni aperte dall'utente (anche da link con il token) sono revocate
+                    with write_connection() as conn:
+                        update_user(conn, user_to_update, password=upwd or None, role=None if urole == "invariato" else urole)
+                        bump_table_version(conn, "users")
+                        conn.commit()
+                    st.success(f"Utente '{user_to_update}' aggiornato: dovrà effettuare di nuovo il login."); st.rerun()
         st.markdown("---")
         with st.form("delete_user", clear_on_submit=True):
             st.subheader("Elimina Utente")
@@ -525,6 +939,31 @@ elif page == "Admin":
             else:
                 user_to_delete = st.selectbox("Seleziona utente", users_list)
                 if st.form_submit_button("Elimina Utente", type="primary", use_container_width=True):
-                    conn.execute("DELETE FROM users WHERE username = ?", (user_to_delete,))
-                    conn.commit()
+                    with write_connection() as conn:
+                        conn.execute(text("DELETE FROM users WHERE username = :u"), {"u": user_to_delete})
+                        bump_table_version(conn, "users")
+                        conn.commit()
                     st.success(f"Utente '{user_to_delete}' eliminato."); st.rerun()
+    st.markdown("---")
+    st.subheader("Cache Dati")
+    cache_stats = get_cache_stats()
+    with cache_stats["lock"]:
+        df_cache = pd.DataFrame([{"tabella": t, "versione": current_version(t), **c} for t, c in cache_stats["tables"].items()])
+    st.dataframe(df_cache, use_container_width=True, hide_index=True)
+    st.subheader("Pool Connessioni")
+    st.dataframe(pd.DataFrame(pool_stats()), use_container_width=True, hide_index=True)
+    st.subheader("Profiling")
+    profiling_on = st.toggle("Profiling attivo (tutte le sessioni)", value=profiling.enabled())
+    if profiling_on != profiling.enabled():
+        profiling.set_enabled(profiling_on); st.rerun()
+    runs = profiling.recent_runs()
+    if not runs: st.info("Nessun rerun registrato. Attiva il profiling e visita le pagine da analizzare.")
+    else:
+        st.dataframe(pd.DataFrame([{k: r[k] for k in ("inizio", "pagina", "utente", "secondi", "sql_n", "sql_secondi", "memoria_kb", "interrotto")} for r in runs]),
+                     use_container_width=True, hide_index=True, column_config={"secondi": st.column_config.NumberColumn(format="%.3f"), "sql_secondi": st.column_config.NumberColumn(format="%.3f")})
+        sel_run = st.selectbox("Dettaglio rerun", range(len(runs)), format_func=lambda i: f"{runs[i]['inizio']} · {runs[i]['pagina']} · {runs[i]['secondi']:.3f}s")
+        df_events = pd.DataFrame(runs[sel_run]["eventi"], columns=["tipo", "nome", "secondi", "righe", "memoria_kb"])
+        st.dataframe(df_events.sort_values("secondi", ascending=False), use_container_width=True, hide_index=True, column_config={"secondi": st.column_config.NumberColumn(format="%.4f")})
+    st.download_button("Esporta metriche (Prometheus)", data=profiling.prometheus_text(), file_name="dashboard_metrics.prom", mime="text/plain")
+
+profiling.end_rerun()
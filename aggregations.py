@@ -0,0 +1,103 @@
+"""
+Aggregazioni lato SQL per i KPI e i grafici della Dashboard.
+Tutti i conteggi derivano da una sola query raggruppata per (stato, gravita): la Dashboard
+non ha bisogno di caricare le righe di dettaglio per disegnare metriche e grafici.
+Le aggregazioni per fornitore e per mese alimentano i grafici del report PDF.
+I reminder scaduti sono selezionati in SQL sull'indice parziale dei reminder attivi.
+I grafici di andamento leggono le fotografie giornaliere di risk_snapshots (vedi history.py), non lo storico.
+"""
+from datetime import timedelta
+
+import pandas as pd
+from sqlalchemy import text
+
+from db import REMINDER_SOGLIA_GIORNI, in_list, risk_filters_sql
+from history import TUTTI_FORNITORI
+
+def risk_summary(conn, fornitori=None):
+    """
+    Conteggi dei rischi per (stato, gravita) in un'unica scansione.
+    'totale' considera tutti i fornitori, 'filtrato' solo quelli indicati (tutti se None).
+    """
+    if fornitori:
+        placeholders, params = in_list("f", fornitori)
+        sel_sql = f"SUM(CASE WHEN fornitore IN {placeholders} THEN 1 ELSE 0 END)"
+    else:
+        sel_sql, params = "COUNT(*)", {}
+    rows = conn.execute(text(f"SELECT stato, gravita, COUNT(*) AS totale, {sel_sql} AS filtrato FROM risks GROUP BY stato, gravita"), params).fetchall()
+    return pd.DataFrame([tuple(r) for r in rows], columns=["stato", "gravita", "totale", "filtrato"])
+
+def risk_kpis(summary):
+    """Metriche del 'Riepilogo Rapido Rischi' (su tutti i rischi)."""
+    by_stato = summary.groupby("stato")["totale"].sum()
+    return {"totale": int(summary["totale"].sum()), "aperti": int(by_stato.get("aperto", 0)), "chiusi": int(by_stato.get("chiuso", 0))}
+
+def risk_counts_by(summary, column, stati=None, gravita=None):
+    """Conteggi filtrati raggruppati per 'stato' o 'gravita', nel formato atteso dai grafici (colonne [column, count])."""
+    sel = summary
+    if stati is not None: sel = sel[sel["stato"].isin(stati)]
+    if gravita is not None: sel = sel[sel["gravita"].isin(gravita)]
+    agg = sel.groupby(column)["filtrato"].sum().reset_index(name="count")
+    return agg[agg["count"] > 0].reset_index(drop=True)
+
+def risk_counts_by_fornitore(conn, filters, limit=15):
+    """Rischi per fornitore nel perimetro dei filtri (vedi db.risk_filters_sql), i 'limit' fornitori più numerosi."""
+    where, params = risk_filters_sql(**filters)
+    rows = conn.execute(text(f"SELECT fornitore, COUNT(*) AS n FROM risks{where} GROUP BY fornitore ORDER BY n DESC, fornitore LIMIT :limit"), {**params, "limit": limit}).fetchall()
+    return pd.DataFrame([tuple(r) for r in rows], columns=["fornitore", "count"])
+
+def risk_trend(conn, filters):
+    """Rischi per mese di data_inizio (AAAA-MM) e stato, nel perimetro dei filtri."""
+    where, params = risk_filters_sql(**filters)
+    rows = conn.execute(text(f"SELECT SUBSTR(data_inizio, 1, 7) AS mese, stato, COUNT(*) FROM risks{where} GROUP BY mese, stato ORDER BY mese"), params).fetchall()
+    return pd.DataFrame([tuple(r) for r in rows], columns=["mese", "stato", "count"])
+
+def overdue_reminders(conn, today, limit=None):
+    """
+    Reminder 'Attivo' inviati da almeno REMINDER_SOGLIA_GIORNI giorni, dal più vecchio: (numero totale, DataFrame).
+    Il DataFrame contiene al massimo 'limit' righe (tutte se None) con la colonna giorni_trascorsi.
+    """
+    # data_invio è testo ISO ('AAAA-MM-GG' o con orario): il confronto con il giorno successivo alla soglia include entrambi
+    params = {"limite": (today - timedelta(days=REMINDER_SOGLIA_GIORNI - 1)).isoformat()}
+    where = " WHERE stato_reminder = 'Attivo' AND data_invio < :limite"
+    total = conn.execute(text(f"SELECT COUNT(*) FROM reminders{where}"), params).scalar_one()
+    limit_sql = " LIMIT :limit" if limit is not None else ""
+    rows = conn.execute(text(f"SELECT id, fornitore_nome, data_invio FROM reminders{where} ORDER BY data_invio, id{limit_sql}"),
+                        {**params, "limit": limit} if limit is not None else params).fetchall()
+    df = pd.DataFrame([tuple(r) for r in rows], columns=["id", "fornitore_nome", "data_invio"])
+    df["data_invio"] = pd.to_datetime(df["data_invio"], format="ISO8601")
+    df["giorni_trascorsi"] = (pd.Timestamp(today) - df["data_invio"].dt.normalize()).dt.days
+    return total, df
+
+def snapshot_trends(conn, fornitori=None, gravita=None, dal=None):
+    """
+    Serie giornaliere per stato dalle fotografie: rischi, scaduti, chiusi nel giorno e relativi giorni di chiusura.
+    Senza filtro fornitore usa le righe aggregate TUTTI_FORNITORI (poche righe per giorno).
+    """
+    placeholders, params = in_list("f", fornitori or [TUTTI_FORNITORI])
+    clauses = [f"fornitore IN {placeholders}"]
+    if gravita is not None:
+        if not gravita: clauses.append("1 = 0")
+        else:
+            g_placeholders, g_params = in_list("g", gravita)
+            clauses.append(f"gravita IN {g_placeholders}"); params.update(g_params)
+    if dal is not None:
+        clauses.append("giorno >= :dal"); params["dal"] = dal.isoformat()
+    rows = conn.execute(text(f"SELECT giorno, stato, SUM(rischi), SUM(scaduti), SUM(chiusi_nel_giorno), SUM(giorni_chiusura) FROM risk_snapshots "
+                             f"WHERE {' AND '.join(clauses)} GROUP BY giorno, stato ORDER BY giorno"), params).fetchall()
+    df = pd.DataFrame([tuple(r) for r in rows], columns=["giorno", "stato", "rischi", "scaduti", "chiusi_nel_giorno", "giorni_chiusura"])
+    df["giorno"] = pd.to_datetime(df["giorno"], format="ISO8601")
+    return df
+
+def trend_charts_data(trends):
+    """Dai risultati di snapshot_trends: aperti per giorno, aperti scaduti/in tempo, tempo medio di chiusura per mese."""
+    # Pivot su tutti i giorni fotografati: un giorno senza rischi aperti vale 0 invece di mancare dalla serie
+    days = pd.Index(trends["giorno"].drop_duplicates().sort_values(), name="giorno")
+    aperti = trends[trends["stato"] == "aperto"].groupby("giorno")[["rischi", "scaduti"]].sum().reindex(days, fill_value=0)
+    open_df = aperti["rischi"].rename("aperti").reset_index()
+    overdue_df = pd.DataFrame({"Scaduti": aperti["scaduti"], "In tempo": aperti["rischi"] - aperti["scaduti"]}).reset_index() \
+        .melt(id_vars="giorno", var_name="situazione", value_name="rischi")
+    monthly = trends.groupby(trends["giorno"].dt.strftime("%Y-%m"))[["chiusi_nel_giorno", "giorni_chiusura"]].sum()
+    monthly = monthly[monthly["chiusi_nel_giorno"] > 0]
+    mttc_df = (monthly["giorni_chiusura"] / monthly["chiusi_nel_giorno"]).rename("giorni_medi").rename_axis("mese").reset_index()
+    return open_df, overdue_df, mttc_df
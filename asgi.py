@@ -0,0 +1,20 @@
+"""
+Avvio dell'app come applicazione ASGI (st.App), con l'endpoint di export in streaming accanto a Streamlit.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 8501
+
+Rispetto a "streamlit run" aggiunge la route data_export.STREAMING_ROUTE: i file di export (data_export.py)
+sono inviati al browser blocco per blocco mentre la query è ancora in corso, senza passare dal media
+storage di Streamlit che li terrebbe interamente in memoria. L'accesso è autorizzato dal token di sessione
+firmato (auth.py) già presente nell'URL dell'utente.
+"""
+from pathlib import Path
+
+import streamlit as st
+from starlette.routing import Route
+
+import data_export
+
+data_export.STREAMING_ROUTE = "/api/esporta"
+
+app = st.App(Path(__file__).with_name("Dashboard fornitori.py"), routes=[Route(data_export.STREAMING_ROUTE, data_export.export_endpoint)])
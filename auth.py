@@ -0,0 +1,266 @@
+"""
+Credenziali degli utenti: hash delle password, token di sessione firmati e limite ai tentativi di login.
+
+Le password sono salvate come hash con sale (hashlib.scrypt o, con AUTH_HASH=pbkdf2, PBKDF2-SHA256).
+Il costo è configurabile con AUTH_SCRYPT_N / AUTH_SCRYPT_R / AUTH_PBKDF2_ITERATIONS ed è registrato
+nell'hash stesso: cambiarlo non invalida le password esistenti, che vengono ricalcolate al login successivo.
+Le righe in chiaro dei database precedenti sono convertite da migrate_plaintext_passwords (in db.init_db).
+
+    python auth.py --confronta          # tempo di verifica e tentativi/s per core con costi diversi
+
+I token di sessione contengono id, utente, ruolo, generazione e scadenza, firmati con HMAC-SHA256 e la chiave
+AUTH_SECRET (o, se assente, una chiave casuale salvata in AUTH_SECRET_FILE) e restano validi dopo un riavvio del
+server, purché la chiave non cambi. La firma si verifica senza accedere al database; token_matches li confronta
+con la riga dell'utente: logout, cambio password o ruolo incrementano users.generazione_token (revoke_tokens)
+e tutti i token emessi prima per quell'utente smettono di valere, anche se presenti in un link o nella cronologia.
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+from collections import deque
+
+from sqlalchemy import text
+
+AUTH_HASH = os.environ.get("AUTH_HASH", "scrypt")
+AUTH_SCRYPT_N = int(os.environ.get("AUTH_SCRYPT_N", 2 ** 14))
+AUTH_SCRYPT_R = int(os.environ.get("AUTH_SCRYPT_R", 8))
+AUTH_SCRYPT_P = int(os.environ.get("AUTH_SCRYPT_P", 1))
+AUTH_PBKDF2_ITERATIONS = int(os.environ.get("AUTH_PBKDF2_ITERATIONS", 600_000))
+AUTH_SECRET_FILE = os.environ.get("AUTH_SECRET_FILE", "auth_secret")
+# Durata di un token senza attività (stessa soglia di inattività della sessione Streamlit)
+TOKEN_TTL_S = 1800
+# Tentativi falliti ammessi per utente nella finestra, poi i login dell'utente sono respinti fino alla sua scadenza
+LOGIN_MAX_FALLITI = int(os.environ.get("AUTH_LOGIN_MAX_FALLITI", 5))
+LOGIN_FINESTRA_S = int(os.environ.get("AUTH_LOGIN_FINESTRA_S", 300))
+
+SALT_BYTES = 16
+HASH_PREFIXES = ("scrypt$", "pbkdf2_sha256$")
+
+# —————————————————————————————
+# Hash delle password
+# —————————————————————————————
+def _b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+def _unb64(value):
+    return base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+
+def _scrypt(password, salt, n, r, p):
+    # maxmem: scrypt usa 128 * r * n byte; il default di OpenSSL (32 MB) non basta per costi più alti
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * r * n + 2 ** 20, dklen=32)
+
+def _current_params(algorithm):
+    return (AUTH_SCRYPT_N, AUTH_SCRYPT_R, AUTH_SCRYPT_P) if algorithm == "scrypt" else (AUTH_PBKDF2_ITERATIONS,)
+
+def hash_password(password, algorithm=None, params=None):
+    """Hash con sale nel formato algoritmo$parametri$sale$hash (es. scrypt$16384$8$1$...)."""
+    algorithm = algorithm or AUTH_HASH
+    params, salt = params or _current_params(algorithm), secrets.token_bytes(SALT_BYTES)
+    if algorithm == "scrypt":
+        digest = _scrypt(password, salt, *params)
+    elif algorithm == "pbkdf2":
+        algorithm, digest = "pbkdf2_sha256", hashlib.pbkdf2_hmac("sha256", password.encode(), salt, params[0])
+    else:
+        raise ValueError(f"Algoritmo di hash non supportato: {algorithm}")
+    return "$".join([algorithm, *map(str, params), _b64(salt), _b64(digest)])
+
+def verify_password(password, stored):
+    """
+    Confronta la password con l'hash salvato. Restituisce (valida, da_ricalcolare): da_ricalcolare è vero
+    se l'hash usa un algoritmo o un costo diverso da quelli correnti, o se la password è ancora in chiaro.
+    Un hash non interpretabile (campi mancanti, parametri o base64 non validi) vale come password errata.
+    """
+    if not stored.startswith(HASH_PREFIXES):
+        return hmac.compare_digest(password.encode(), stored.encode()), True
+    try:
+        algorithm, *fields = stored.split("$")
+        *params, salt, digest = fields
+        params = tuple(int(v) for v in params)
+        if algorithm == "scrypt":
+            candidate = _scrypt(password, _unb64(salt), *params)
+        else:
+            candidate = hashlib.pbkdf2_hmac("sha256", password.encode(), _unb64(salt), params[0])
+        expected = _unb64(digest)
+    except (ValueError, IndexError, TypeError, OverflowError, MemoryError):
+        return False, False
+    current = "pbkdf2_sha256" if AUTH_HASH == "pbkdf2" else AUTH_HASH
+    return hmac.compare_digest(candidate, expected), (algorithm, params) != (current, _current_params(AUTH_HASH))
+
+_DUMMY_HASH = {}
+
+def _dummy_hash():
+    # Hash di confronto per gli utenti inesistenti: il tempo di risposta non rivela quali username esistono
+    key = (AUTH_HASH, _current_params(AUTH_HASH))
+    if key not in _DUMMY_HASH: _DUMMY_HASH[key] = hash_password(secrets.token_hex(8))
+    return _DUMMY_HASH[key]
+
+def migrate_plaintext_passwords(conn):
+    """Sostituisce con il loro hash le password ancora in chiaro. Non esegue il commit; restituisce le righe convertite."""
+    rows = conn.execute(text("SELECT id, password FROM users WHERE password NOT LIKE 'scrypt$%' AND password NOT LIKE 'pbkdf2\\_sha256$%' ESCAPE '\\'")).fetchall()
+    if rows:
+        conn.execute(text("UPDATE users SET password=:p WHERE id=:id"), [{"id": r.id, "p": hash_password(r.password)} for r in rows])
+    return len(rows)
+
+def authenticate(read_conn, write_conn, username, password):
+    """
+    Utente ({id, username, role, generazione_token}) se le credenziali sono valide, altrimenti None. Se l'hash salvato
+    usa parametri non più correnti viene ricalcolato con write_conn (callable che restituisce il context manager di scrittura).
+    """
+    with read_conn() as conn:
+        row = conn.execute(text("SELECT id, username, password, role, generazione_token FROM users WHERE username=:u"), {"u": username}).first()
+    # L'hash è verificato senza tenere occupata una connessione del pool
+    valid, rehash = verify_password(password, row.password if row else _dummy_hash())
+    if not (row and valid): return None
+    if rehash:
+        with write_conn() as conn:
+            conn.execute(text("UPDATE users SET password=:p WHERE id=:id AND password=:old"), {"id": row.id, "p": hash_password(password), "old": row.password})
+            conn.commit()
+    return {"id": row.id, "username": row.username, "role": row.role, "generazione_token": row.generazione_token}
+
+def create_user(conn, username, password, role):
+    """
+    Inserisce un utente con la password in hash. La generazione dei token parte da un valore casuale: un utente
+    eliminato e ricreato con lo stesso nome (su SQLite anche con lo stesso id) non eredita i token del precedente.
+    Non esegue il commit; solleva IntegrityError se lo username esiste già.
+    """
+    conn.execute(text("INSERT INTO users(username, password, role, generazione_token) VALUES(:u, :p, :r, :g)"),
+                 {"u": username, "p": hash_password(password), "r": role, "g": secrets.randbelow(2 ** 31)})
+
+def revoke_tokens(conn, username):
+    """Invalida tutti i token di sessione emessi finora per l'utente. Non esegue il commit (né invalida la cache di users)."""
+    conn.execute(text("UPDATE users SET generazione_token = generazione_token + 1 WHERE username=:u"), {"u": username})
+
+def update_user(conn, username, password=None, role=None):
+    """Cambia password e/o ruolo dell'utente e ne revoca i token di sessione. Non esegue il commit."""
+    values = {"password": hash_password(password) if password else None, "role": role}
+    sets = [f"{col}=:{col}" for col, value in values.items() if value is not None]
+    if not sets: return
+    conn.execute(text(f"UPDATE users SET {', '.join(sets)} WHERE username=:u"), {"u": username, **{k: v for k, v in values.items() if v is not None}})
+    revoke_tokens(conn, username)
+
+# —————————————————————————————
+# Token di sessione
+# —————————————————————————————
+_secret = {}
+
+def _secret_key():
+    if "key" not in _secret:
+        if os.environ.get("AUTH_SECRET"):
+            _secret["key"] = os.environ["AUTH_SECRET"].encode()
+        else:
+            try:
+                # Creazione esclusiva: se più processi partono insieme, uno solo scrive la chiave e gli altri la leggono
+                fd = os.open(AUTH_SECRET_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+                with os.fdopen(fd, "w") as f: f.write(secrets.token_hex(32))
+            except FileExistsError:
+                pass
+            with open(AUTH_SECRET_FILE) as f:
+                _secret["key"] = f.read().strip().encode()
+    return _secret["key"]
+
+def _sign(payload):
+    return _b64(hmac.new(_secret_key(), payload.encode(), hashlib.sha256).digest())
+
+def issue_token(user, ttl=TOKEN_TTL_S):
+    """Token di sessione per l'utente (mapping con id, username, role, generazione_token)."""
+    data = {"i": int(user["id"]), "u": user["username"], "r": user["role"], "g": int(user["generazione_token"]), "exp": int(time.time()) + ttl}
+    payload = _b64(json.dumps(data, separators=(",", ":")).encode())
+    return f"{payload}.{_sign(payload)}"
+
+def read_token(token):
+    """Contenuto del token ({"i", "u", "r", "g", "exp"}) se la firma è valida e non è scaduto, altrimenti None. Non verifica la revoca (token_matches)."""
+    try:
+        payload, signature = token.split(".")
+        if not hmac.compare_digest(signature, _sign(payload)): return None
+        data = json.loads(_unb64(payload))
+    except (ValueError, TypeError):
+        return None
+    return data if data.get("exp", 0) > time.time() else None
+
+def token_matches(token, user):
+    """
+    Vero se il token (da read_token) vale per l'utente nello stato attuale: stesso id, nome e ruolo e nessuna revoca
+    dopo l'emissione (stessa generazione).
+    """
+    return user is not None and (int(user["id"]), user["username"], user["role"], int(user["generazione_token"])) == \
+        (token.get("i"), token.get("u"), token.get("r"), token.get("g"))
+
+def session_user(conn, token):
+    """Contenuto del token di sessione se è valido e non revocato, altrimenti None (per gli endpoint fuori da Streamlit)."""
+    data = read_token(token)
+    if data is None: return None
+    user = conn.execute(text("SELECT id, username, role, generazione_token FROM users WHERE id=:i"), {"i": data.get("i")}).mappings().first()
+    return data if token_matches(data, user) else None
+
+# —————————————————————————————
+# Limite ai tentativi
+# —————————————————————————————
+class LoginLimiter:
+    """
+    Tentativi falliti per utente in una finestra scorrevole. Il controllo precede il calcolo dell'hash:
+    un attacco a forza bruta su un utente non consuma CPU oltre LOGIN_MAX_FALLITI verifiche per finestra.
+    Lo stato è del processo: con più repliche dell'app il limite vale per ciascuna.
+    """
+    def __init__(self, max_failures=LOGIN_MAX_FALLITI, window_s=LOGIN_FINESTRA_S):
+        self.max_failures, self.window_s = max_failures, window_s
+        self._lock, self._failures = threading.Lock(), {}
+
+    def _recent(self, username, now):
+        failures = self._failures.get(username)
+        while failures and failures[0] <= now - self.window_s: failures.popleft()
+        return failures
+
+    def retry_after(self, username):
+        """Secondi di attesa prima del prossimo tentativo ammesso per l'utente (0 = ammesso)."""
+        now = time.monotonic()
+        with self._lock:
+            failures = self._recent(username, now)
+            if not failures or len(failures) < self.max_failures: return 0
+            return failures[0] + self.window_s - now
+
+    def failed(self, username):
+        now = time.monotonic()
+        with self._lock:
+            self._failures.setdefault(username, deque()).append(now)
+            # Tentativi su molti username diversi: le voci senza errori recenti sono rimosse
+            if len(self._failures) > 10_000:
+                for name in [u for u in self._failures if not self._recent(u, now)]: del self._failures[name]
+
+    def succeeded(self, username):
+        with self._lock:
+            self._failures.pop(username, None)
+
+# —————————————————————————————
+# Confronto dei costi
+# —————————————————————————————
+def compare_costs(repeats=5):
+    """Tempo medio di verifica per algoritmo e costo: da confrontare con i login al secondo da sostenere."""
+    cases = [("scrypt", (n, 8, 1)) for n in (2 ** 13, 2 ** 14, 2 ** 15, 2 ** 16)] + [("pbkdf2", (i,)) for i in (200_000, 600_000, 1_200_000)]
+    results = []
+    for algorithm, params in cases:
+        stored = hash_password("benchmark", algorithm, params)
+        start = time.perf_counter()
+        for _ in range(repeats): verify_password("benchmark", stored)
+        seconds = (time.perf_counter() - start) / repeats
+        memory = 128 * params[0] * params[1] // 2 ** 20 if algorithm == "scrypt" else 0
+        results.append({"algoritmo": algorithm, "parametri": params, "ms_verifica": seconds * 1000, "tentativi_s_core": 1 / seconds, "memoria_mb": memory})
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Strumenti per le credenziali della dashboard fornitori.")
+    parser.add_argument("--confronta", action="store_true", help="misura il costo di verifica con algoritmi e parametri diversi")
+    parser.add_argument("--ripetizioni", type=int, default=5)
+    parser.add_argument("--hash", metavar="PASSWORD", help="stampa l'hash della password con i parametri correnti")
+    args = parser.parse_args()
+    if args.hash:
+        print(hash_password(args.hash))
+    if args.confronta or not args.hash:
+        print(f"{'algoritmo':<10} {'parametri':<20} {'ms/verifica':>12} {'tentativi/s/core':>17} {'memoria MB':>11}")
+        for r in compare_costs(args.ripetizioni):
+            print(f"{r['algoritmo']:<10} {str(r['parametri']):<20} {r['ms_verifica']:>12.1f} {r['tentativi_s_core']:>17.1f} {r['memoria_mb']:>11}")
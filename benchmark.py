@@ -0,0 +1,162 @@
+"""
+Benchmark dei percorsi critici della dashboard su un database sintetico (vedi synthetic_data.py).
+
+    python benchmark.py --database sqlite:///bench.db --genera --rischi 100000 --reminder 20000
+    python benchmark.py --database sqlite:///bench.db --ripetizioni 5 --pagine
+
+Le funzioni dell'app (loader, styling, aggregazioni) sono caricate eseguendo in modalità "bare" le sezioni 1-3
+di "Dashboard fornitori.py"; i casi "freddo" svuotano le cache di Streamlit prima di ogni ripetizione.
+Con --pagine ogni pagina è eseguita per intero con streamlit.testing AppTest, dopo il login dell'amministratore.
+Ogni esecuzione aggiunge una riga JSON a --output (commit, versioni, volumi e tempi per caso), così che
+i risultati di commit diversi si possano confrontare.
+"""
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+import streamlit as st
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+
+import auth
+import db
+import report_pdf
+from save_engine import save_editor_changes
+
+APP_PATH = Path(__file__).with_name("Dashboard fornitori.py")
+PAGES = ["Dashboard", "Modifica", "Follow-up", "Report PDF", "Admin"]
+NO_FILTERS = {"fornitori": None, "stati": None, "gravita": None}
+
+def load_app_helpers():
+    """Esegue le sezioni 1-3 dell'app (helper, stato di sessione, stili) e ne restituisce il namespace."""
+    source = APP_PATH.read_text(encoding="utf-8")
+    namespace = {"__name__": "dashboard_helpers", "__file__": str(APP_PATH)}
+    exec(compile(source[:source.index("# 4) LOGIN")], str(APP_PATH), "exec"), namespace)
+    return namespace
+
+def clear_caches():
+    st.cache_data.clear(); st.cache_resource.clear()
+
+def measure(name, fn, repeats, setup=None):
+    """Esegue fn(setup()) 'repeats' volte, cronometrando solo fn, e restituisce le statistiche dei tempi."""
+    times, result = [], None
+    for _ in range(repeats):
+        arg = setup() if setup else None
+        start = time.perf_counter()
+        result = fn(arg)
+        times.append(time.perf_counter() - start)
+    rows = len(result) if isinstance(result, (pd.DataFrame, list, tuple)) else None
+    return {"caso": name, "min_s": min(times), "mediana_s": statistics.median(times), "max_s": max(times), "ripetizioni": repeats, "righe": rows}
+
+def _edit_state(page, n_edits):
+    return {"edited_rows": {i: {"note": f"benchmark {time.time_ns()}"} for i in range(min(n_edits, len(page)))}, "added_rows": [], "deleted_rows": []}
+
+def _pdf_supplier(pdf_rows):
+    """Fornitore con il numero di rischi più vicino a pdf_rows: il report resta confrontabile tra volumi diversi."""
+    with db.read_connection() as conn:
+        return conn.execute(text("SELECT fornitore FROM risks GROUP BY fornitore ORDER BY ABS(COUNT(*) - :n), fornitore LIMIT 1"), {"n": pdf_rows}).scalar()
+
+def run_functions(app, repeats, n_edits, pdf_rows):
+    results = []
+    results.append(measure("load_reminders_df (freddo)", lambda _: app["load_reminders_df"](), repeats, setup=clear_caches))
+    results.append(measure("load_reminders_df (caldo)", lambda _: app["load_reminders_df"](), repeats))
+    results.append(measure("load_risks_page + count_risks (freddo)", lambda _: (app["load_risks_page"](NO_FILTERS), app["count_risks"](NO_FILTERS))[0], repeats, setup=clear_caches))
+
+    page = app["load_risks_page"](NO_FILTERS)
+    results.append(measure("style_risk_dataframe pagina (freddo)", lambda _: app["style_risk_dataframe"](page).to_html(), repeats, setup=clear_caches))
+    results[-1]["righe"] = len(page)
+
+    def dashboard_aggregations(_):
+        summary = app["load_risk_summary"]()
+        app["risk_kpis"](summary); app["risk_counts_by"](summary, "stato"); app["risk_counts_by"](summary, "gravita")
+        return app["load_overdue_reminders"](app["OVERDUE_BANNER_MAX"])[1]
+    results.append(measure("aggregazioni Dashboard (freddo)", dashboard_aggregations, repeats, setup=clear_caches))
+
+    def modifica_save(page):
+        with db.write_connection() as conn:
+            return save_editor_changes(conn, "risks", page, _edit_state(page, n_edits))
+    results.append(measure(f"salvataggio Modifica ({n_edits} righe)", modifica_save, repeats, setup=lambda: (clear_caches(), app["load_risks_page"](NO_FILTERS))[1]))
+    results[-1]["righe"] = n_edits
+
+    # Ricerca full-text su una parola presente in molte note (caso peggiore) e ricerca approssimata di un fornitore
+    results.append(measure("search_text + load_similar_suppliers (freddo)", lambda _: (app["search_text"]("risks", "evidenze fornitore"),
+                                                                                      app["load_similar_suppliers"]("fornitre 0001"))[0][1], repeats, setup=clear_caches))
+
+    # Costo di un login con i parametri di hash correnti (AUTH_HASH, AUTH_SCRYPT_N, AUTH_PBKDF2_ITERATIONS, ...)
+    stored = auth.hash_password("benchmark")
+    results.append(measure(f"verify_password {stored.rsplit('$', 2)[0]}", lambda _: auth.verify_password("benchmark", stored), repeats))
+    results[-1]["righe"] = None
+
+    supplier = _pdf_supplier(pdf_rows)
+    filters = {**NO_FILTERS, "fornitori": [supplier]}
+    n_pdf = app["count_risks"](filters)
+    with tempfile.TemporaryDirectory() as tmp:
+        def build_pdf(_):
+            with db.read_connection() as conn:
+                report_pdf.build_advanced_pdf(conn, filters, Path(tmp) / "report.pdf")
+        results.append(measure("build_advanced_pdf", build_pdf, repeats))
+    results[-1]["righe"] = n_pdf
+    return results
+
+def run_pages(repeats, user, password):
+    from streamlit.testing.v1 import AppTest
+    at = AppTest.from_file(str(APP_PATH), default_timeout=600)
+    at.run()
+    at.text_input[0].input(user); at.text_input[1].input(password); at.button[0].click(); at.run()
+    results = []
+    for page in PAGES:
+        def visit(_):
+            at.session_state["page"] = page
+            at.run()
+            if at.exception: raise RuntimeError(f"{page}: {at.exception[0].value}")
+        results.append(measure(f"pagina {page} (freddo)", visit, repeats, setup=clear_caches))
+        results.append(measure(f"pagina {page} (caldo)", visit, repeats))
+    return results
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=APP_PATH.parent, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _volumes():
+    with db.read_connection() as conn:
+        return {t: conn.execute(text(f"SELECT COUNT(*) FROM {t}")).scalar_one() for t in ("risks", "reminders", "users")}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark dei percorsi critici della dashboard fornitori.")
+    parser.add_argument("--database", default="sqlite:///bench.db", help="URL SQLAlchemy del database di benchmark")
+    parser.add_argument("--genera", action="store_true", help="popola prima il database con synthetic_data.generate")
+    parser.add_argument("--rischi", type=int, default=10_000)
+    parser.add_argument("--reminder", type=int, default=2_000)
+    parser.add_argument("--skew", type=float, default=1.1)
+    parser.add_argument("--ripetizioni", type=int, default=3)
+    parser.add_argument("--modifiche", type=int, default=20, help="righe modificate nel caso di salvataggio")
+    parser.add_argument("--righe-pdf", type=int, default=500, help="dimensione indicativa del perimetro del report PDF")
+    parser.add_argument("--pagine", action="store_true", help="esegue anche le pagine complete con AppTest")
+    parser.add_argument("--utente", default="Flavio"); parser.add_argument("--password", default="Dashboard2003")
+    parser.add_argument("--output", default="benchmark_results.jsonl", help="file JSON Lines a cui aggiungere i risultati")
+    args = parser.parse_args()
+
+    db.configure(args.database)
+    if args.genera:
+        from synthetic_data import generate
+        generate(n_risks=args.rischi, n_reminders=args.reminder, skew=args.skew)
+    app = load_app_helpers()
+    results = run_functions(app, args.ripetizioni, args.modifiche, args.righe_pdf)
+    if args.pagine:
+        results += run_pages(args.ripetizioni, args.utente, args.password)
+
+    record = {"data": datetime.now().isoformat(timespec="seconds"), "commit": _git_commit(), "backend": make_url(args.database).get_backend_name(),
+              "python": platform.python_version(), "pandas": pd.__version__, "streamlit": st.__version__, "volumi": _volumes(), "risultati": results}
+    with open(args.output, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record) + "\n")
+    print(pd.DataFrame(results).to_string(index=False, float_format=lambda v: f"{v:.4f}"))
+    print(f"Risultati aggiunti a {args.output}")
@@ -0,0 +1,219 @@
+"""
+Export dei rischi e dei reminder in CSV, Parquet o Excel (.xlsx), letti dal database a blocchi.
+
+    python data_export.py risks --formato parquet --output rischi.parquet
+    python data_export.py risks --formato csv --stato aperto --gravita Critical --gravita High > critici.csv
+    python data_export.py reminders --formato xlsx --fornitore "Fornitore 00001" --output reminder.xlsx
+
+Le righe arrivano da un cursore lato server (stream_results) a blocchi di EXPORT_BLOCCO e ogni blocco è
+scritto e rilasciato prima di leggere il successivo, così la memoria resta costante con qualsiasi volume:
+- CSV: ogni blocco è codificato e restituito subito;
+- Parquet: un row group compresso (zstd) per blocco, con lo schema ricavato dalla tabella;
+- XLSX: openpyxl in modalità write_only su un file temporaneo (il formato zip si completa solo alla fine).
+I filtri fornitore/stato/gravita sono quelli della pagina Report PDF (db.risk_filters_sql); per i reminder
+vale solo il filtro fornitore.
+
+Con l'app avviata tramite asgi.py (uvicorn) l'export è servito in streaming da STREAMING_ROUTE: il download
+inizia con il primo blocco, prima che la query sia terminata. Con "streamlit run" la pagina usa st.download_button.
+"""
+import argparse
+import csv
+import io
+import os
+import sys
+import tempfile
+from datetime import date
+from urllib.parse import urlencode
+
+from sqlalchemy import Integer, text
+
+import db
+
+EXPORT_BLOCCO = int(os.environ.get("EXPORT_BLOCCO", 20_000))
+EXPORT_FORMATS = {
+    "csv": ("text/csv", ".csv"),
+    "parquet": ("application/vnd.apache.parquet", ".parquet"),
+    "xlsx": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", ".xlsx"),
+}
+EXPORT_TABLES = ("risks", "reminders")
+# Colonne interne non esportate: versione di riga e id dell'anagrafica fornitori (il nome è già esportato)
+EXPORT_ESCLUSE = ("row_version", "supplier_id")
+# Righe massime per foglio Excel: oltre si prosegue su un nuovo foglio
+XLSX_MAX_RIGHE = 1_048_575
+# Impostata da asgi.py quando l'app espone l'endpoint di export in streaming
+STREAMING_ROUTE = None
+# Filtri dell'URL di export: chiave del filtro -> parametro ripetibile; VUOTO_PARAM elenca i filtri con selezione vuota
+URL_FILTERS = (("fornitori", "fornitore"), ("stati", "stato"), ("gravita", "gravita"))
+VUOTO_PARAM = "vuoto"
+
+# —————————————————————————————
+# Lettura a blocchi
+# —————————————————————————————
+def export_columns(table):
+    return [c.name for c in db.metadata.tables[table].columns if c.name not in EXPORT_ESCLUSE]
+
+def _query(table, filters):
+    if table == "risks":
+        where, params = db.risk_filters_sql(**filters)
+    else:
+        fornitori = filters.get("fornitori")
+        placeholders, params = db.in_list("fornitore", fornitori or [])
+        where = "" if fornitori is None else (f" WHERE fornitore_nome IN {placeholders}" if fornitori else " WHERE 1 = 0")
+    return f"SELECT {', '.join(export_columns(table))} FROM {table}{where} ORDER BY id", params
+
+def count_rows(table, filters):
+    sql, params = _query(table, filters)
+    with db.read_connection() as conn:
+        return conn.execute(text(f"SELECT COUNT(*) FROM ({sql}) AS export"), params).scalar_one()
+
+def iter_chunks(table, filters, chunk_size=EXPORT_BLOCCO):
+    """Blocchi di righe (tuple, nell'ordine di export_columns) letti con un cursore lato server."""
+    sql, params = _query(table, filters)
+    with db.read_connection() as conn:
+        result = conn.execution_options(stream_results=True).execute(text(sql), params)
+        for chunk in result.partitions(chunk_size):
+            yield [tuple(row) for row in chunk]
+
+# —————————————————————————————
+# Formati
+# —————————————————————————————
+def _csv_stream(table, filters, chunk_size):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(export_columns(table))
+    # BOM: Excel apre correttamente gli accenti dei CSV UTF-8
+    yield buffer.getvalue().encode("utf-8-sig")
+    for chunk in iter_chunks(table, filters, chunk_size):
+        buffer.seek(0); buffer.truncate()
+        writer.writerows(chunk)
+        yield buffer.getvalue().encode("utf-8")
+
+class _Drain(io.RawIOBase):
+    """File di sola scrittura che accumula i byte scritti finché take() non li restituisce e li rilascia."""
+    def __init__(self):
+        self._buffer, self._position = bytearray(), 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer += data; self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def take(self):
+        data = bytes(self._buffer); self._buffer.clear()
+        return data
+
+def _parquet_schema(table):
+    import pyarrow as pa
+    dates = db.DATE_COLUMNS.get(table, ())
+    columns = [c for c in db.metadata.tables[table].columns if c.name not in EXPORT_ESCLUSE]
+    return pa.schema([(c.name, pa.date32() if c.name in dates else pa.int64() if isinstance(c.type, Integer) else pa.string()) for c in columns])
+
+def _parquet_stream(table, filters, chunk_size):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema, sink = _parquet_schema(table), _Drain()
+    with pq.ParquetWriter(sink, schema, compression="zstd") as writer:
+        for chunk in iter_chunks(table, filters, chunk_size):
+            columns = list(zip(*chunk))
+            # Le date sono salvate come testo ISO nel database, nelle righe meno recenti con l'ora ('YYYY-MM-DDTHH:MM:SS'):
+            # si tiene la sola parte della data, poi conversione a date32 lato Arrow
+            arrays = [pa.array([v[:10] if v else None for v in values], type=pa.string()).cast(field.type) if field.type == pa.date32()
+                      else pa.array(values, type=field.type) for field, values in zip(schema, columns)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            yield sink.take()
+    yield sink.take()
+
+def _xlsx_stream(table, filters, chunk_size):
+    from openpyxl import Workbook
+    columns, dates = export_columns(table), set(db.DATE_COLUMNS.get(table, ()))
+    date_idx = [i for i, c in enumerate(columns) if c in dates]
+    workbook = Workbook(write_only=True)
+    sheet, rows_in_sheet = None, XLSX_MAX_RIGHE
+    for chunk in iter_chunks(table, filters, chunk_size):
+        for row in chunk:
+            if rows_in_sheet == XLSX_MAX_RIGHE:
+                sheet = workbook.create_sheet(table if sheet is None else f"{table} ({len(workbook.worksheets) + 1})")
+                sheet.append(columns); rows_in_sheet = 0
+            row = list(row)
+            for i in date_idx:
+                if row[i]: row[i] = date.fromisoformat(row[i][:10])
+            sheet.append(row); rows_in_sheet += 1
+    if sheet is None:
+        workbook.create_sheet(table).append(columns)
+    with tempfile.TemporaryFile() as tmp:
+        workbook.save(tmp)
+        tmp.seek(0)
+        while data := tmp.read(1 << 20):
+            yield data
+
+def stream_export(fmt, table, filters, chunk_size=EXPORT_BLOCCO):
+    """Generatore dei byte del file di export: nessun formato tiene in memoria più di un blocco di righe."""
+    if table not in EXPORT_TABLES: raise ValueError(f"Tabella non esportabile: {table}")
+    writers = {"csv": _csv_stream, "parquet": _parquet_stream, "xlsx": _xlsx_stream}
+    if fmt not in writers: raise ValueError(f"Formato non supportato: {fmt}")
+    return writers[fmt](table, filters, chunk_size)
+
+def export_filename(table, fmt):
+    return f"{'rischi' if table == 'risks' else 'reminder'}_{date.today().isoformat()}{EXPORT_FORMATS[fmt][1]}"
+
+# —————————————————————————————
+# Endpoint in streaming (asgi.py)
+# —————————————————————————————
+def export_url(table, fmt, filters, token):
+    """
+    URL relativo dell'endpoint di export. Un filtro None non è incluso (= nessun filtro); una selezione vuota,
+    che non seleziona nessuna riga, è indicata con il parametro VUOTO_PARAM (es. vuoto=stato).
+    """
+    params = [("tabella", table), ("formato", fmt), ("sessione", token)]
+    for key, name in URL_FILTERS:
+        values = filters.get(key)
+        if values is not None and not values: params.append((VUOTO_PARAM, name))
+        params += [(name, v) for v in values or []]
+    return f"{STREAMING_ROUTE}?{urlencode(params)}"
+
+def url_filters(query):
+    """Filtri di export dai parametri dell'URL (inverso di export_url): None se assente, [] se indicato in VUOTO_PARAM."""
+    empty = set(query.getlist(VUOTO_PARAM))
+    return {key: [] if name in empty else query.getlist(name) or None for key, name in URL_FILTERS}
+
+def export_endpoint(request):
+    """Handler Starlette: verifica il token di sessione firmato e non revocato (auth.py) e restituisce l'export in streaming."""
+    from starlette.responses import PlainTextResponse, StreamingResponse
+    from auth import session_user
+    query = request.query_params
+    with db.read_connection() as conn:
+        user = session_user(conn, query.get("sessione", ""))
+    if user is None:
+        return PlainTextResponse("Sessione non valida o scaduta: effettua di nuovo il login.", status_code=401)
+    table, fmt = query.get("tabella"), query.get("formato")
+    if table not in EXPORT_TABLES or fmt not in EXPORT_FORMATS:
+        return PlainTextResponse("Parametri tabella/formato non validi.", status_code=400)
+    filters = url_filters(query)
+    # Il generatore è sincrono: Starlette lo consuma in un thread del pool, senza bloccare il loop degli altri utenti
+    return StreamingResponse(stream_export(fmt, table, filters), media_type=EXPORT_FORMATS[fmt][0],
+                             headers={"Content-Disposition": f'attachment; filename="{export_filename(table, fmt)}"'})
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export dei rischi e dei reminder della dashboard fornitori.")
+    parser.add_argument("tabella", choices=list(EXPORT_TABLES))
+    parser.add_argument("--formato", choices=list(EXPORT_FORMATS), default="csv")
+    parser.add_argument("--output", default="-", help="file di destinazione (default: standard output)")
+    parser.add_argument("--fornitore", action="append", help="filtro fornitore (ripetibile)")
+    parser.add_argument("--stato", action="append", help="filtro stato dei rischi (ripetibile)")
+    parser.add_argument("--gravita", action="append", help="filtro gravità dei rischi (ripetibile)")
+    parser.add_argument("--blocco", type=int, default=EXPORT_BLOCCO, help="righe lette e scritte per blocco")
+    parser.add_argument("--database", default=db.DATABASE_URL, help="URL SQLAlchemy del database (default: DATABASE_URL)")
+    args = parser.parse_args()
+    db.configure(args.database)
+    filters = {"fornitori": args.fornitore, "stati": args.stato, "gravita": args.gravita}
+    out = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+    try:
+        for data in stream_export(args.formato, args.tabella, filters, args.blocco):
+            out.write(data)
+    finally:
+        if out is not sys.stdout.buffer: out.close()
@@ -0,0 +1,117 @@
+"""
+Storico dei rischi e fotografie giornaliere per i grafici di andamento della Dashboard.
+
+- record_risk_changes / record_risk_deletes sono chiamate dai percorsi di salvataggio (editor Modifica,
+  form di censimento, import massivo) nella stessa transazione della scrittura: risk_history riceve i valori
+  di ogni riga inserita, modificata o eliminata, così le UPDATE in place non cancellano la storia.
+- take_snapshot ricalcola la fotografia di un giorno in risk_snapshots: conteggi per (fornitore, stato, gravita)
+  più una riga per (stato, gravita) con fornitore TUTTI_FORNITORI, così i grafici senza filtro fornitore leggono
+  poche righe al giorno. scheduler.py aggiorna il giorno corrente a ogni passaggio; la Dashboard lo crea se manca.
+- backfill_snapshots ricostruisce i giorni passati dalle date dei rischi attuali (data_inizio, data_chiusura).
+
+    python history.py --ricostruisci --dal 2024-01-01
+"""
+import argparse
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import text
+
+import db
+
+# supplier_id è derivato dal nome del fornitore (suppliers.py): non è storicizzato
+HISTORY_COLUMNS = [c.name for c in db.metadata.tables["risks"].columns if c.name not in ("id", "supplier_id")]
+# Valore di 'fornitore' delle righe di risk_snapshots aggregate su tutti i fornitori
+TUTTI_FORNITORI = "*"
+
+# —————————————————————————————
+# Storico
+# —————————————————————————————
+def max_risk_id(conn):
+    """Id massimo prima delle scritture: le righe con id maggiore marcate nella transazione sono inserimenti."""
+    return conn.execute(text("SELECT COALESCE(MAX(id), 0) FROM risks")).scalar_one()
+
+def record_risk_changes(conn, max_id_before, user=None):
+    """
+    Storicizza le righe scritte nella transazione corrente, riconosciute dalla row_version appena assegnata
+    (bump_table_version blocca la versione fino al commit, quindi nessun'altra transazione la condivide).
+    Va chiamata dopo gli INSERT/UPDATE; non esegue il commit.
+    """
+    cols = ", ".join(HISTORY_COLUMNS)
+    conn.execute(text(f"INSERT INTO risk_history(risk_id, operazione, modificato_il, utente, {cols}) "
+                      f"SELECT id, CASE WHEN id > :max_id THEN 'inserimento' ELSE 'modifica' END, :ora, :utente, {cols} "
+                      f"FROM risks WHERE row_version = {db.ROW_VERSION_SQL.format('risks')}"),
+                 {"max_id": max_id_before, "ora": datetime.now().isoformat(timespec="seconds"), "utente": user})
+
+def record_risk_deletes(conn, ids, user=None):
+    """Storicizza gli ultimi valori delle righe da eliminare. Va chiamata prima di db.delete_rows; non esegue il commit."""
+    if not ids: return
+    cols, now = ", ".join(HISTORY_COLUMNS), datetime.now().isoformat(timespec="seconds")
+    conn.execute(text(f"INSERT INTO risk_history(risk_id, operazione, modificato_il, utente, {cols}) "
+                      f"SELECT id, 'eliminazione', :ora, :utente, {cols} FROM risks WHERE id = :id"),
+                 [{"id": int(i), "ora": now, "utente": user} for i in ids])
+
+def risk_history(conn, risk_id):
+    """Versioni storicizzate di un rischio, dalla più recente."""
+    return conn.execute(text("SELECT * FROM risk_history WHERE risk_id = :id ORDER BY id DESC"), {"id": risk_id}).mappings().all()
+
+# —————————————————————————————
+# Fotografie giornaliere
+# —————————————————————————————
+def _days_between(conn, start, end):
+    if conn.dialect.name == "postgresql":
+        return f"(CAST(SUBSTR({end}, 1, 10) AS DATE) - CAST(SUBSTR({start}, 1, 10) AS DATE))"
+    return f"CAST(julianday(SUBSTR({end}, 1, 10)) - julianday(SUBSTR({start}, 1, 10)) AS INTEGER)"
+
+def take_snapshot(conn, day, reconstruct=False):
+    """
+    Sostituisce la fotografia del giorno 'day'. Con reconstruct=True lo stato è dedotto dalle date
+    (aperto fino a data_chiusura, esclusi i rischi con data_inizio successiva) invece che dalla colonna stato:
+    serve a ricostruire i giorni passati. Non esegue il commit; restituisce le righe scritte.
+    """
+    stato = "CASE WHEN data_chiusura IS NOT NULL AND SUBSTR(data_chiusura, 1, 10) <= :giorno THEN 'chiuso' ELSE 'aperto' END" if reconstruct else "stato"
+    where = " WHERE SUBSTR(data_inizio, 1, 10) <= :giorno" if reconstruct else ""
+    closed_today = f"{stato} = 'chiuso' AND SUBSTR(data_chiusura, 1, 10) = :giorno"
+    measures = (f"COUNT(*), SUM(CASE WHEN {stato} = 'aperto' AND SUBSTR(data_fine, 1, 10) < :giorno THEN 1 ELSE 0 END), "
+                f"SUM(CASE WHEN {closed_today} THEN 1 ELSE 0 END), SUM(CASE WHEN {closed_today} THEN {_days_between(conn, 'data_inizio', 'data_chiusura')} ELSE 0 END)")
+    params = {"giorno": day.isoformat(), "tutti": TUTTI_FORNITORI}
+    conn.execute(text("DELETE FROM risk_snapshots WHERE giorno = :giorno"), params)
+    insert = "INSERT INTO risk_snapshots(giorno, fornitore, stato, gravita, rischi, scaduti, chiusi_nel_giorno, giorni_chiusura) "
+    # GROUP BY per posizione: su PostgreSQL l'espressione di stato con parametri non sarebbe riconosciuta come uguale
+    rows = conn.execute(text(f"{insert}SELECT :giorno, fornitore, {stato}, gravita, {measures} FROM risks{where} GROUP BY 2, 3, 4"), params).rowcount
+    conn.execute(text(f"{insert}SELECT :giorno, :tutti, {stato}, gravita, {measures} FROM risks{where} GROUP BY 3, 4"), params)
+    return rows
+
+def ensure_snapshot(conn, day):
+    """Crea la fotografia del giorno se non esiste ancora (es. scheduler.py non in esecuzione). Non esegue il commit."""
+    if conn.execute(text("SELECT 1 FROM risk_snapshots WHERE giorno = :g LIMIT 1"), {"g": day.isoformat()}).first() is None:
+        take_snapshot(conn, day)
+
+def backfill_snapshots(start, end=None, overwrite=False, log=print):
+    """Ricostruisce le fotografie dei giorni da 'start' a 'end' (default: ieri), una transazione per giorno."""
+    end, day, written = end or date.today() - timedelta(days=1), start, 0
+    while day <= end:
+        with db.write_connection() as conn:
+            exists = conn.execute(text("SELECT 1 FROM risk_snapshots WHERE giorno = :g LIMIT 1"), {"g": day.isoformat()}).first()
+            if overwrite or exists is None:
+                take_snapshot(conn, day, reconstruct=True)
+                conn.commit(); written += 1
+        day += timedelta(days=1)
+    log(f"Fotografie ricostruite: {written} giorni")
+    return written
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fotografie giornaliere dei rischi per i grafici di andamento.")
+    parser.add_argument("--database", default=db.DATABASE_URL, help="URL SQLAlchemy del database (default: DATABASE_URL)")
+    parser.add_argument("--ricostruisci", action="store_true", help="ricostruisce i giorni passati dalle date dei rischi")
+    parser.add_argument("--dal", type=date.fromisoformat, default=date.today() - timedelta(days=365), help="primo giorno da ricostruire (AAAA-MM-GG)")
+    parser.add_argument("--al", type=date.fromisoformat, default=None, help="ultimo giorno da ricostruire (default: ieri)")
+    parser.add_argument("--sovrascrivi", action="store_true", help="ricalcola anche i giorni che hanno già una fotografia")
+    args = parser.parse_args()
+    db.configure(args.database)
+    db.init_db()
+    if args.ricostruisci:
+        backfill_snapshots(args.dal, args.al, args.sovrascrivi)
+    with db.write_connection() as conn:
+        take_snapshot(conn, date.today())
+        conn.commit()
+    print(f"Fotografia del {date.today().isoformat()} aggiornata")
@@ -0,0 +1,87 @@
+"""
+Canali di notifica per le escalation dei reminder scaduti (vedi scheduler.py).
+
+Un canale espone send(escalations): riceve un blocco di escalation (dict con id, reminder_id,
+fornitore_nome, data_invio, tentativi) e restituisce, nello stesso ordine, None per ogni notifica
+consegnata o il messaggio d'errore. Il canale è scelto con NOTIFY_SINK:
+- log (default) — stampa le notifiche sullo standard output;
+- smtp — email tramite il server indicato dalle variabili SMTP_*;
+- modulo:Classe — canale esterno, costruito senza argomenti.
+"""
+import importlib
+import os
+import smtplib
+from email.message import EmailMessage
+
+def escalation_message(escalation):
+    """Oggetto e testo della notifica di un reminder scaduto."""
+    subject = f"Reminder scaduto: {escalation['fornitore_nome']}"
+    body = (f"Il reminder inviato a {escalation['fornitore_nome']} il {str(escalation['data_invio'])[:10]} "
+            f"non ha ancora ricevuto risposta.\nControllare le evidenze nella pagina Follow-up della dashboard.")
+    return subject, body
+
+class LogSink:
+    def __init__(self, log=print):
+        self.log = log
+
+    def send(self, escalations):
+        for escalation in escalations:
+            self.log(f"[escalation {escalation['id']}] {escalation_message(escalation)[0]}")
+        return [None] * len(escalations)
+
+class SMTPSink:
+    """
+    Invia un'email per escalation, con una sola connessione SMTP per blocco.
+    Il Message-ID dipende solo dall'escalation: un nuovo tentativo dopo un invio non confermato produce
+    lo stesso messaggio e può essere deduplicato dal destinatario.
+    Per le prove locali: python -m aiosmtpd -n -l localhost:8025 con SMTP_HOST=localhost e SMTP_PORT=8025.
+    """
+    def __init__(self, host, port, sender, recipients, user=None, password=None, starttls=False, timeout=30):
+        self.host, self.port, self.sender, self.recipients = host, port, sender, recipients
+        self.user, self.password, self.starttls, self.timeout = user, password, starttls, timeout
+
+    @classmethod
+    def from_env(cls):
+        return cls(host=os.environ.get("SMTP_HOST", "localhost"), port=int(os.environ.get("SMTP_PORT", 25)),
+                   sender=os.environ.get("SMTP_FROM", "dashboard-fornitori@localhost"),
+                   recipients=[r.strip() for r in os.environ.get("SMTP_TO", "").split(",") if r.strip()],
+                   user=os.environ.get("SMTP_USER") or None, password=os.environ.get("SMTP_PASSWORD") or None,
+                   starttls=os.environ.get("SMTP_STARTTLS", "0") == "1")
+
+    def send(self, escalations):
+        if not self.recipients:
+            return ["Nessun destinatario configurato (SMTP_TO)"] * len(escalations)
+        try:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        except OSError as e:
+            return [f"Connessione SMTP fallita: {e}"] * len(escalations)
+        results = []
+        with smtp:
+            try:
+                if self.starttls: smtp.starttls()
+                if self.user: smtp.login(self.user, self.password)
+            except smtplib.SMTPException as e:
+                return [f"Autenticazione SMTP fallita: {e}"] * len(escalations)
+            for escalation in escalations:
+                subject, body = escalation_message(escalation)
+                msg = EmailMessage()
+                msg["Subject"], msg["From"], msg["To"] = subject, self.sender, ", ".join(self.recipients)
+                msg["Message-ID"] = f"<escalation-{escalation['id']}@dashboard-fornitori>"
+                msg.set_content(body)
+                try:
+                    smtp.send_message(msg); results.append(None)
+                except (OSError, smtplib.SMTPException) as e:
+                    results.append(str(e))
+        return results
+
+SINKS = {"log": LogSink, "smtp": SMTPSink.from_env}
+
+def get_sink(name=None):
+    """Canale indicato da 'name' o da NOTIFY_SINK: un nome di SINKS oppure 'modulo:Classe'."""
+    name = name or os.environ.get("NOTIFY_SINK", "log")
+    if name in SINKS:
+        return SINKS[name]()
+    module, _, attr = name.partition(":")
+    if not attr:
+        raise ValueError(f"Canale di notifica sconosciuto: {name} (usa {', '.join(SINKS)} o modulo:Classe)")
+    return getattr(importlib.import_module(module), attr)()
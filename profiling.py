@@ -0,0 +1,208 @@
+"""
+Strumentazione dei percorsi critici: tempi, righe e variazione di memoria per ogni rerun della pagina.
+
+Si attiva con DASHBOARD_PROFILING=1 o dal pannello Profiling della pagina Admin. Da disattivata:
+- le funzioni decorate con @profiled eseguono solo un controllo su un flag;
+- i listener SQLAlchemy su ogni esecuzione SQL non sono installati.
+Ogni rerun (begin_rerun ... end_rerun) raccoglie gli eventi della propria sessione:
+- loader;
+- query SQL;
+- styling;
+- build del PDF.
+I totali cumulati sono esportati in formato testo Prometheus (prometheus_text). Con PROFILING_PROM_FILE
+impostata, il file è riscritto periodicamente per il textfile collector di node_exporter.
+La memoria è l'RSS del processo (condiviso tra le sessioni): è un'indicazione, non una misura per sessione.
+"""
+import functools
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import pandas as pd
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+try:
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+except ImportError:
+    get_script_run_ctx = None
+
+PROFILING_HISTORY = int(os.environ.get("PROFILING_HISTORY", 50))
+PROFILING_PROM_FILE = os.environ.get("PROFILING_PROM_FILE") or None
+PROM_WRITE_INTERVAL_S = 15
+
+_state = {"enabled": False, "lock": threading.Lock(), "runs": deque(maxlen=PROFILING_HISTORY), "open": {}, "totals": {}, "prom_written": 0.0}
+
+# —————————————————————————————
+# Misure
+# —————————————————————————————
+def _rss_kb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError):
+        return None
+
+def _run_key():
+    # Gli eventi sono attribuiti alla sessione Streamlit; fuori da Streamlit al thread corrente
+    ctx = get_script_run_ctx(suppress_warning=True) if get_script_run_ctx else None
+    return ctx.session_id if ctx else threading.get_ident()
+
+def _rows(result):
+    if isinstance(result, (pd.DataFrame, pd.Series, list)): return len(result)
+    if isinstance(result, tuple) and result and isinstance(result[-1], pd.DataFrame): return len(result[-1])
+    return None
+
+def record(kind, name, seconds, rows=None, memory_kb=None):
+    """Registra un evento nel rerun corrente della sessione (se aperto) e nei totali del processo."""
+    with _state["lock"]:
+        total = _state["totals"].setdefault((kind, name), {"chiamate": 0, "secondi": 0.0, "righe": 0})
+        total["chiamate"] += 1; total["secondi"] += seconds; total["righe"] += rows or 0
+        run = _state["open"].get(_run_key())
+        if run is not None:
+            run["eventi"].append({"tipo": kind, "nome": name, "secondi": seconds, "righe": rows, "memoria_kb": memory_kb})
+            run["ultimo"] = time.perf_counter()
+
+@contextmanager
+def span(kind, name):
+    if not _state["enabled"]:
+        yield; return
+    rss, start = _rss_kb(), time.perf_counter()
+    try:
+        yield
+    finally:
+        after = _rss_kb()
+        record(kind, name, time.perf_counter() - start, memory_kb=after - rss if rss is not None and after is not None else None)
+
+def profiled(name, kind="loader"):
+    """Decoratore: registra tempo, righe restituite e variazione di memoria di ogni chiamata quando il profiling è attivo."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _state["enabled"]:
+                return fn(*args, **kwargs)
+            rss, start = _rss_kb(), time.perf_counter()
+            result = fn(*args, **kwargs)
+            after = _rss_kb()
+            record(kind, name, time.perf_counter() - start, _rows(result), after - rss if rss is not None and after is not None else None)
+            return result
+        return wrapper
+    return decorator
+
+# —————————————————————————————
+# SQL
+# —————————————————————————————
+_PLACEHOLDERS = re.compile(r"\((?:\?|%\(\w+\)s|:\w+)(?:, (?:\?|%\(\w+\)s|:\w+))*\)")
+
+def _statement_name(statement):
+    # Le liste di segnaposto (es. IN generate da db.in_list) hanno lunghezza variabile: sono ridotte a (...) per limitare le etichette
+    return _PLACEHOLDERS.sub("(...)", " ".join(statement.split()))[:120]
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("profiling_start", []).append(time.perf_counter())
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    # Profiling attivato (da Admin) mentre la query era in corso: senza l'inizio registrato l'evento è ignorato,
+    # un errore qui arriverebbe alla query dell'utente
+    starts = conn.info.get("profiling_start")
+    if not starts: return
+    start = starts.pop()
+    record("sql", _statement_name(statement), time.perf_counter() - start, cursor.rowcount if cursor.rowcount >= 0 else None)
+
+def _on_error(exception_context):
+    if exception_context.connection is not None and exception_context.connection.info.get("profiling_start"):
+        exception_context.connection.info["profiling_start"].pop()
+
+SQL_LISTENERS = (("before_cursor_execute", _before_execute), ("after_cursor_execute", _after_execute), ("handle_error", _on_error))
+
+def set_enabled(flag):
+    """Attiva o disattiva il profiling per tutto il processo, installando o rimuovendo i listener SQL."""
+    with _state["lock"]:
+        if flag == _state["enabled"]: return
+        for name, listener in SQL_LISTENERS:
+            (event.listen if flag else event.remove)(Engine, name, listener)
+        _state["enabled"] = flag
+
+def enabled():
+    return _state["enabled"]
+
+# —————————————————————————————
+# Rerun
+# —————————————————————————————
+def _close(run, interrupted):
+    end = time.perf_counter() if not interrupted else run["ultimo"]
+    after = _rss_kb()
+    sql = [e for e in run["eventi"] if e["tipo"] == "sql"]
+    _state["runs"].append({**run, "secondi": end - run["t0"], "interrotto": interrupted,
+                           "memoria_kb": after - run["rss"] if after is not None and run["rss"] is not None else None,
+                           "sql_n": len(sql), "sql_secondi": sum(e["secondi"] for e in sql)})
+    total = _state["totals"].setdefault(("pagina", run["pagina"]), {"chiamate": 0, "secondi": 0.0, "righe": 0})
+    total["chiamate"] += 1; total["secondi"] += end - run["t0"]
+
+def begin_rerun(page, user=None):
+    """Apre il rerun della sessione corrente; un rerun precedente non chiuso (st.rerun, st.stop) viene chiuso come interrotto."""
+    if not _state["enabled"]: return
+    key = _run_key()
+    with _state["lock"]:
+        previous = _state["open"].pop(key, None)
+        if previous is not None: _close(previous, interrupted=True)
+        now = time.perf_counter()
+        _state["open"][key] = {"pagina": page, "utente": user, "inizio": time.strftime("%H:%M:%S"), "t0": now, "ultimo": now, "rss": _rss_kb(), "eventi": []}
+
+def end_rerun():
+    if not _state["enabled"]: return
+    with _state["lock"]:
+        run = _state["open"].pop(_run_key(), None)
+        if run is not None: _close(run, interrupted=False)
+    if PROFILING_PROM_FILE and time.time() - _state["prom_written"] > PROM_WRITE_INTERVAL_S:
+        write_prometheus(PROFILING_PROM_FILE)
+
+def recent_runs():
+    """Rerun conclusi, dal più recente."""
+    with _state["lock"]:
+        return list(reversed(_state["runs"]))
+
+def merge(events):
+    """Aggiunge eventi misurati in un altro processo (es. il worker dei report PDF)."""
+    for e in events or []:
+        record(e["tipo"], e["nome"], e["secondi"], e["righe"], e["memoria_kb"])
+
+@contextmanager
+def collect():
+    """Raccoglie gli eventi del thread corrente fuori da Streamlit (es. nel worker PDF): restituisce la lista degli eventi."""
+    key, events = _run_key(), []
+    with _state["lock"]:
+        _state["open"][key] = {"pagina": None, "t0": time.perf_counter(), "ultimo": 0, "rss": None, "eventi": events}
+    try:
+        yield events
+    finally:
+        with _state["lock"]: _state["open"].pop(key, None)
+
+# —————————————————————————————
+# Esportazione
+# —————————————————————————————
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+def prometheus_text():
+    """Totali cumulati per (tipo, nome) nel formato di esposizione testuale di Prometheus."""
+    with _state["lock"]:
+        totals = dict(_state["totals"])
+    lines = []
+    for metric, key, help_text in (("dashboard_profiling_seconds_total", "secondi", "Tempo cumulato per operazione"),
+                                   ("dashboard_profiling_calls_total", "chiamate", "Numero di esecuzioni per operazione"),
+                                   ("dashboard_profiling_rows_total", "righe", "Righe restituite o modificate per operazione")):
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+        lines += [f'{metric}{{tipo="{_label(kind)}",nome="{_label(name)}"}} {total[key]}' for (kind, name), total in sorted(totals.items())]
+    return "\n".join(lines) + "\n"
+
+def write_prometheus(path):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f: f.write(prometheus_text())
+    os.replace(tmp, path)
+    _state["prom_written"] = time.time()
+
+set_enabled(os.environ.get("DASHBOARD_PROFILING", "0") == "1")
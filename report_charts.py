@@ -0,0 +1,82 @@
+"""
+Grafici del report PDF disegnati con matplotlib, senza browser headless.
+
+Le immagini PNG sono salvate in CHART_CACHE_DIR con chiave l'hash del tipo di grafico e dei dati
+aggregati: report diversi con gli stessi conteggi riusano la stessa immagine. Se matplotlib non è
+installato si ricade su plotly + kaleido, se disponibili.
+"""
+import hashlib
+import os
+from io import BytesIO
+from pathlib import Path
+
+import profiling
+
+try:
+    from matplotlib.figure import Figure
+except ImportError:
+    Figure = None
+
+CHART_CACHE_DIR = Path(os.environ.get("CHART_CACHE_DIR", os.path.join(os.environ.get("REPORT_CACHE_DIR", "report_cache"), "grafici")))
+CHART_CACHE_MAX = int(os.environ.get("CHART_CACHE_MAX", 200))
+GRAVITA_COLORS = {"Critical": "#d9534f", "High": "#f0ad4e", "Low": "#5cb85c"}
+STATO_COLORS = {"aperto": "#3182bd", "chiuso": "#4A5568"}
+
+# —————————————————————————————
+# Rendering
+# —————————————————————————————
+def _render_matplotlib(kind, data, title, size):
+    fig = Figure(figsize=(size[0] / 100, size[1] / 100), dpi=150)
+    ax = fig.add_subplot()
+    if kind == "torta":
+        ax.pie(data["count"], labels=data["gravita"], autopct="%1.0f%%", startangle=90, wedgeprops={"width": 0.6},
+               colors=[GRAVITA_COLORS.get(g, "#999999") for g in data["gravita"]])
+        ax.axis("equal")
+    elif kind == "barre":
+        ax.barh(data["fornitore"].astype(str)[::-1], data["count"][::-1], color="#3182bd")
+        ax.set_xlabel("Rischi")
+    elif kind == "andamento":
+        pivot = data.pivot_table(index="mese", columns="stato", values="count", aggfunc="sum", fill_value=0).sort_index()
+        for stato in pivot.columns:
+            ax.plot(pivot.index, pivot[stato], marker="o", label=stato, color=STATO_COLORS.get(stato))
+        ax.set_ylabel("Rischi"); ax.legend()
+        ax.tick_params(axis="x", labelrotation=45)
+    ax.set_title(title)
+    fig.tight_layout()
+    buffer = BytesIO()
+    fig.savefig(buffer, format="png")
+    return buffer.getvalue()
+
+def _render_kaleido(kind, data, title, size):
+    import plotly.express as px
+    if kind == "torta":
+        fig = px.pie(data, values="count", names="gravita", title=title, color="gravita", color_discrete_map=GRAVITA_COLORS)
+    elif kind == "barre":
+        fig = px.bar(data, x="count", y="fornitore", orientation="h", title=title)
+    else:
+        fig = px.line(data.sort_values("mese"), x="mese", y="count", color="stato", markers=True, title=title, color_discrete_map=STATO_COLORS)
+    # Il motore è kaleido (l'argomento engine non è più accettato da plotly 6.1 in poi)
+    return fig.to_image(format="png", width=size[0], height=size[1])
+
+# —————————————————————————————
+# Cache per contenuto
+# —————————————————————————————
+@profiling.profiled("chart_png", kind="pdf")
+def chart_png(kind, data, title, size=(500, 350)):
+    """
+    Immagine PNG del grafico 'kind' (torta | barre | andamento) per i dati aggregati 'data'.
+    Prima di disegnare cerca un'immagine già prodotta per lo stesso input.
+    """
+    payload = f"{kind}|{title}|{size}|{data.to_json(orient='split', index=False)}"
+    path = CHART_CACHE_DIR / f"{hashlib.sha256(payload.encode()).hexdigest()}.png"
+    if path.exists():
+        return path.read_bytes()
+    png = (_render_matplotlib if Figure is not None else _render_kaleido)(kind, data, title, size)
+    CHART_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    tmp.write_bytes(png)
+    os.replace(tmp, path)
+    # Rimuove le immagini meno recenti oltre CHART_CACHE_MAX
+    for old in sorted(CHART_CACHE_DIR.glob("*.png"), key=lambda p: p.stat().st_mtime, reverse=True)[CHART_CACHE_MAX:]:
+        old.unlink(missing_ok=True)
+    return png
@@ -0,0 +1,249 @@
+"""
+Report PDF avanzato, generato in processi worker separati dalla sessione Streamlit.
+
+I file prodotti sono salvati in una cache indirizzata per contenuto (REPORT_CACHE_DIR): la chiave è
+l'hash dei filtri e della versione della tabella risks, quindi un report già generato per lo stesso
+perimetro e gli stessi dati viene servito subito, da qualunque sessione. I grafici sono prodotti da report_charts.
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import types
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from io import BytesIO
+from itertools import islice
+from pathlib import Path
+
+from reportlab.lib.pagesizes import A4
+from reportlab.platypus import BaseDocTemplate, Frame, PageTemplate, Table, TableStyle, Paragraph, Spacer, Image
+from reportlab.lib import colors
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from sqlalchemy import text
+
+import db
+import profiling
+from aggregations import risk_counts_by, risk_counts_by_fornitore, risk_summary, risk_trend
+from db import risk_filters_sql
+from report_charts import chart_png
+
+REPORT_CACHE_DIR = Path(os.environ.get("REPORT_CACHE_DIR", "report_cache"))
+REPORT_CACHE_MAX = int(os.environ.get("REPORT_CACHE_MAX", 50))
+REPORT_WORKERS = int(os.environ.get("REPORT_WORKERS", 2))
+# Righe lette dal cursore (e flowable tenuti in memoria) per blocco durante la generazione
+REPORT_CHUNK = int(os.environ.get("REPORT_CHUNK", 500))
+# Secondi dopo i quali un job concluso viene dimenticato (il file resta nella cache)
+JOB_TTL = 3600
+
+class _FlowableStream(list):
+    """
+    Lista di flowable alimentata a blocchi da un generatore. BaseDocTemplate.build consuma la lista dalla testa:
+    in memoria restano solo i flowable del blocco corrente e non l'intera story del report.
+    """
+    def __init__(self, flowables, chunk_size):
+        super().__init__()
+        self._source, self._chunk_size = iter(flowables), chunk_size
+
+    def _fill(self):
+        if list.__len__(self) < self._chunk_size // 2:
+            self.extend(islice(self._source, self._chunk_size))
+
+    def __len__(self):
+        self._fill()
+        return list.__len__(self)
+
+    def __getitem__(self, index):
+        self._fill()
+        return list.__getitem__(self, index)
+
+def _format_date(value):
+    return datetime.fromisoformat(str(value)[:10]).strftime('%d/%m/%Y') if value else 'N/A'
+
+@profiling.profiled("build_advanced_pdf", kind="pdf")
+def build_advanced_pdf(conn, filters, path, chunk_size=None):
+    """
+    Scrive il report in 'path' leggendo i rischi a blocchi di REPORT_CHUNK righe dal cursore.
+    I totali e il grafico derivano dalle aggregazioni SQL; stili e TableStyle sono condivisi per gravità,
+    quindi la memoria occupata non cresce con il numero di rischi.
+    """
+    chunk_size = chunk_size or REPORT_CHUNK
+    sel_suppliers = filters.get("fornitori") or []
+    doc = BaseDocTemplate(str(path), pagesize=A4, leftMargin=30, rightMargin=30, topMargin=30, bottomMargin=50, pageCompression=1)
+    styles=getSampleStyleSheet()
+    style_title, style_h1, style_h2, style_body = styles['Title'], styles['h1'], styles['h2'], styles['BodyText']
+    style_body.leading = 14
+    color_map = {"Critical": colors.HexColor("#d9534f"), "High": colors.HexColor("#f0ad4e"), "Low": colors.HexColor("#5cb85c")}
+    title_styles, table_styles = {}, {}
+
+    def risk_styles(gravita):
+        if gravita not in title_styles:
+            risk_color = color_map.get(gravita, colors.black)
+            title_styles[gravita] = ParagraphStyle(name=f'RiskTitleStyle_{gravita}', parent=style_h2, textColor=risk_color)
+            table_styles[gravita] = TableStyle([('VALIGN', (0,0), (-1,-1), 'TOP'), ('ALIGN', (0,0), (-1,-1), 'LEFT'), ('FONTNAME', (0,0), (0,-1), 'Helvetica-Bold'), ('BOX', (0,0), (-1,-1), 1, risk_color), ('INNERGRID', (0,0), (-1,-1), 0.25, colors.grey), ('BACKGROUND', (0,0), (0,-1), colors.HexColor("#F0F0F0"))])
+        return title_styles[gravita], table_styles[gravita]
+
+    def header_footer(canvas, doc):
+        canvas.saveState()
+        canvas.setFont('Helvetica', 9)
+        canvas.drawString(doc.leftMargin, doc.pagesize[1] - 20, "Report Rischi Fornitori | Confidenziale")
+        canvas.drawRightString(doc.pagesize[0] - doc.rightMargin, doc.bottomMargin - 20, f"Pagina {doc.page}")
+        canvas.restoreState()
+
+    frame = Frame(doc.leftMargin, doc.bottomMargin, doc.width, doc.height, id='normal')
+    template = PageTemplate(id='main', frames=frame, onPage=header_footer)
+    doc.addPageTemplates([template])
+
+    def story():
+        summary = risk_summary(conn, filters.get("fornitori"))
+        by_stato = risk_counts_by(summary, "stato", filters.get("stati"), filters.get("gravita")).set_index("stato")["count"]
+        by_gravita = risk_counts_by(summary, "gravita", filters.get("stati"), filters.get("gravita"))
+        yield Paragraph("Report di Analisi Rischi", style_title); yield Spacer(1, 24)
+        yield Paragraph(f"Data di Generazione: {datetime.now().strftime('%d/%m/%Y %H:%M')}", style_body)
+        yield Paragraph(f"Fornitori Analizzati: {', '.join(sel_suppliers) if sel_suppliers else 'Tutti'}", style_body); yield Spacer(1, 48)
+        yield Paragraph("Executive Summary", style_h1); yield Spacer(1, 12)
+        total, open_r, critical = int(by_stato.sum()), int(by_stato.get('aperto', 0)), int(by_gravita.loc[by_gravita['gravita'] == 'Critical', 'count'].sum())
+        yield Paragraph(f"Totale riscontri: {total} | Aperti: {open_r} | Critici: {critical}", style_body); yield Spacer(1, 24)
+
+        charts = [("torta", by_gravita, "Ripartizione per Gravità", (500, 350)),
+                  ("barre", risk_counts_by_fornitore(conn, filters), "Rischi per Fornitore (primi 15)", (500, 380)),
+                  ("andamento", risk_trend(conn, filters), "Andamento per Stato (mese di inizio)", (500, 320))]
+        for kind, data, title, size in charts:
+            if data.empty: continue
+            try: yield Image(BytesIO(chart_png(kind, data, title, size)), width=size[0] * 0.9, height=size[1] * 0.9)
+            except Exception as e: yield Paragraph(f"Errore generazione grafico: {e}", style_body)
+            yield Spacer(1, 12)
+
+        yield Spacer(1, 24); yield Paragraph("Dettaglio dei Riscontri", style_h1)
+        # Ordinati per fornitore: i gruppi si chiudono mentre il cursore avanza, senza raggruppare in memoria
+        where, params = risk_filters_sql(**filters)
+        result = conn.execution_options(stream_results=True).execute(text(
+            f"SELECT id, fornitore, rischio, gravita, stato, data_fine, contract_owner, perc_avanzamento, note, data_chiusura FROM risks{where} ORDER BY fornitore, id DESC"), params)
+        fornitore = None
+        for chunk in result.mappings().partitions(chunk_size):
+            for risk in chunk:
+                if risk['fornitore'] != fornitore:
+                    fornitore = risk['fornitore']
+                    yield Spacer(1, 12); yield Paragraph(f"Fornitore: {fornitore}", style_h2)
+                risk_title_style, risk_table_style = risk_styles(risk['gravita'])
+                yield Spacer(1, 12); yield Paragraph(f"ID {risk['id']}: {risk['rischio'] or 'N/D'}", risk_title_style)
+                details_data = [['Gravità:', Paragraph(f"<b>{risk['gravita'] or 'N/D'}</b>", style_body)],
+                                ['Stato:', risk['stato'] or 'N/D'],
+                                ['Due Date:', _format_date(risk['data_fine'])],
+                                ['Owner:', risk['contract_owner'] or 'N/D'], ['Avanz.:', f"{risk['perc_avanzamento'] or 0}%"],
+                                ['Note:', Paragraph(risk['note'] or 'Nessuna nota.', style_body)],
+                                ['Data Chiusura:', _format_date(risk['data_chiusura'])]]
+                details_table = Table(details_data, colWidths=[100, doc.width - 100])
+                details_table.setStyle(risk_table_style)
+                yield details_table
+
+    doc.build(_FlowableStream(story(), chunk_size))
+
+# —————————————————————————————
+# Cache per contenuto
+# —————————————————————————————
+def report_key(filters, version):
+    """Chiave della cache: hash dei filtri (fornitori/stati/gravita) e della versione dei dati."""
+    payload = json.dumps({"filtri": {k: sorted(v) if v is not None else None for k, v in filters.items()}, "versione": version}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def cached_report(key):
+    path = REPORT_CACHE_DIR / f"{key}.pdf"
+    return path if path.exists() else None
+
+def _store_report(key, write):
+    """Esegue write(percorso) su un file temporaneo nella cache e lo pubblica con una rinomina atomica."""
+    REPORT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    path, tmp = REPORT_CACHE_DIR / f"{key}.pdf", REPORT_CACHE_DIR / f"{key}.{os.getpid()}.tmp"
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+    # Rimuove i report meno recenti oltre REPORT_CACHE_MAX
+    for old in sorted(REPORT_CACHE_DIR.glob("*.pdf"), key=lambda p: p.stat().st_mtime, reverse=True)[REPORT_CACHE_MAX:]:
+        old.unlink(missing_ok=True)
+    return path
+
+def render_report(database_url, filters, profile=False):
+    """
+    Genera il PDF dei rischi filtrati direttamente nella cache. Eseguita nel processo worker:
+    versione e righe sono lette nella stessa transazione, così che la chiave corrisponda al contenuto.
+    Restituisce il percorso del file e gli eventi di profiling misurati nel worker (vuoti se profile è False).
+    """
+    db.configure(database_url)
+    profiling.set_enabled(profile)
+    with profiling.collect() as events, db.read_connection() as conn:
+        key = report_key(filters, db.get_table_version(conn, "risks"))
+        path = cached_report(key) or _store_report(key, lambda tmp: build_advanced_pdf(conn, filters, tmp))
+    return {"file": str(path), "profilo": events}
+
+# —————————————————————————————
+# Coda dei job
+# —————————————————————————————
+_executor = None
+_jobs, _inflight = {}, {}
+_jobs_lock = threading.Lock()
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        # spawn: il worker non eredita i thread e i lock del server Streamlit
+        _executor = ProcessPoolExecutor(max_workers=REPORT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+@contextmanager
+def _neutral_main():
+    """
+    Un processo 'spawn' riesegue il modulo __main__ del padre, che sotto Streamlit è lo script della dashboard
+    (init_db, pagine, ...). I worker sono avviati da submit: nel frattempo __main__ è un modulo vuoto, senza file da rieseguire.
+    """
+    main = sys.modules["__main__"]
+    sys.modules["__main__"] = types.ModuleType("__main__")
+    try:
+        yield
+    finally:
+        sys.modules["__main__"] = main
+
+def submit_report(filters, version):
+    """
+    Accoda la generazione del report e restituisce l'id del job. Un job ancora in corso per lo
+    stesso perimetro e la stessa versione dei dati viene riutilizzato.
+    """
+    key = report_key(filters, version)
+    with _jobs_lock:
+        for old_id in [j for j, job in _jobs.items() if job["future"].done() and time.time() - job["inviato"] > JOB_TTL]:
+            del _jobs[old_id]
+        job_id = _inflight.get(key)
+        if job_id not in _jobs: job_id = None
+        if job_id and not _jobs[job_id]["future"].done():
+            return job_id
+        job_id = uuid.uuid4().hex
+        with _neutral_main():
+            future = _get_executor().submit(render_report, db.DATABASE_URL, filters, profiling.enabled())
+        _jobs[job_id] = {"future": future, "inviato": time.time()}
+        _inflight[key] = job_id
+    return job_id
+
+def job_status(job_id):
+    """Stato del job: {"stato": in coda | in corso | completato | errore | sconosciuto, "file", "errore", "secondi"}."""
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+    if job is None:
+        return {"stato": "sconosciuto"}
+    future, status = job["future"], {"secondi": time.time() - job["inviato"]}
+    if not future.done():
+        return {**status, "stato": "in corso" if future.running() else "in coda"}
+    if future.exception() is not None:
+        return {**status, "stato": "errore", "errore": str(future.exception())}
+    result = future.result()
+    with _jobs_lock:
+        # Gli eventi misurati nel worker confluiscono una sola volta nel profiling del processo Streamlit
+        merge, job["profilo_unito"] = not job.get("profilo_unito"), True
+    if merge: profiling.merge(result["profilo"])
+    return {**status, "stato": "completato", "file": result["file"]}
@@ -0,0 +1,224 @@
+"""
+Import massivo dei rischi fornitore da file CSV o Excel (.xlsx), dalla pagina "Import Rischi" o da riga di comando.
+
+    python risk_import.py valutazione_annuale.xlsx
+    python risk_import.py rischi.csv --blocco 10000 --errori errori.csv
+    python risk_import.py rischi.csv --verifica            # solo validazione, nessun inserimento
+
+Il file è letto a blocchi (pandas.read_csv con chunksize, openpyxl in sola lettura per gli .xlsx) senza
+caricarlo per intero in memoria. Ogni blocco è validato con le stesse regole del form "Censimento Fornitori"
+(validate_risks) e le righe valide sono inserite con un executemany, una transazione per blocco: un errore
+a metà file lascia importati i blocchi precedenti, e --salta permette di riprendere. Le righe scartate
+sono riportate con numero di riga del file, colonna e motivo.
+"""
+import argparse
+import csv
+import io
+import time
+from datetime import date, datetime
+from pathlib import Path
+
+import pandas as pd
+
+import db
+from history import max_risk_id, record_risk_changes
+from suppliers import after_write
+
+GRAVITA_VALUES = ("Low", "High", "Critical")
+STATI_RISCHIO = ("aperto", "chiuso")
+RISCHIO_SCENARI = ("Inadeguate Security of third party", "Inadeguate resilience of third party", "Inadequate outsourcing of third party")
+RISK_COLUMNS = ("data_inizio", "data_fine", "fornitore", "rischio", "stato", "gravita", "note", "data_chiusura",
+                "contract_owner", "area_riferimento", "perc_avanzamento")
+# Colonne che il file deve contenere; note, data_chiusura e perc_avanzamento sono facoltative come nel form
+REQUIRED_COLUMNS = ("data_inizio", "data_fine", "fornitore", "rischio", "stato", "gravita", "contract_owner", "area_riferimento")
+# Intestazioni accettate oltre ai nomi delle colonne: le etichette del form (minuscole, spazi come _)
+HEADER_ALIASES = {"nome_fornitore": "fornitore", "scenario_di_rischio": "rischio", "livello_di_gravità": "gravita", "gravità": "gravita",
+                  "due_date": "data_fine", "data_di_chiusura_effettiva": "data_chiusura", "area_di_riferimento": "area_riferimento",
+                  "percentuale_di_avanzamento_(%)": "perc_avanzamento", "percentuale_di_avanzamento": "perc_avanzamento", "note_libere": "note"}
+IMPORT_BLOCCO = 5000
+
+# —————————————————————————————
+# Validazione
+# —————————————————————————————
+def _parse_dates(values):
+    # ISO (anche con orario, es. celle data di Excel) oppure gg/mm/aaaa
+    parsed = pd.to_datetime(values, format="ISO8601", errors="coerce")
+    retry = parsed.isna() & (values != "")
+    if retry.any():
+        parsed[retry] = pd.to_datetime(values[retry], format="%d/%m/%Y", errors="coerce")
+    return parsed
+
+def validate_risks(df, first_row=2):
+    """
+    Valida un blocco di rischi (una riga per rischio, colonne come RISK_COLUMNS, valori stringa o nativi).
+    Restituisce (record pronti per insert_risks, errori); ogni errore è {riga, colonna, valore, errore},
+    con 'riga' = first_row + posizione nel blocco (la riga del file, se la riga 1 è l'intestazione).
+    """
+    df = df.reset_index(drop=True).reindex(columns=RISK_COLUMNS)
+    for col in RISK_COLUMNS:
+        df[col] = df[col].fillna("").astype(str).str.strip()
+    errors = []
+
+    def flag(mask, col, message):
+        errors.extend({"riga": first_row + i, "colonna": col, "valore": df.at[i, col], "errore": message} for i in mask[mask].index)
+
+    for col in ("fornitore", "contract_owner", "area_riferimento", "rischio", "gravita", "stato", "data_inizio", "data_fine"):
+        flag(df[col] == "", col, "Campo obbligatorio")
+    flag((df["rischio"] != "") & ~df["rischio"].isin(RISCHIO_SCENARI), "rischio", "Scenario di rischio non previsto")
+    flag((df["gravita"] != "") & ~df["gravita"].isin(GRAVITA_VALUES), "gravita", f"Gravità ammesse: {', '.join(GRAVITA_VALUES)}")
+    flag((df["stato"] != "") & ~df["stato"].isin(STATI_RISCHIO), "stato", f"Stati ammessi: {', '.join(STATI_RISCHIO)}")
+
+    chiuso = df["stato"] == "chiuso"
+    # Come nel form: la data di chiusura è richiesta per i rischi chiusi e ignorata per quelli aperti
+    df.loc[~chiuso, "data_chiusura"] = ""
+    flag(chiuso & (df["data_chiusura"] == ""), "data_chiusura", "Obbligatoria per i rischi chiusi")
+    for col in ("data_inizio", "data_fine", "data_chiusura"):
+        parsed = _parse_dates(df[col])
+        flag((df[col] != "") & parsed.isna(), col, "Data non valida (aaaa-mm-gg o gg/mm/aaaa)")
+        df[col] = parsed.dt.strftime("%Y-%m-%d")
+
+    perc = pd.to_numeric(df["perc_avanzamento"].replace("", "0"), errors="coerce")
+    flag(perc.isna() | (perc % 1 != 0) | (perc < 0) | (perc > 100), "perc_avanzamento", "Intero tra 0 e 100")
+
+    bad = sorted({e["riga"] - first_row for e in errors})
+    valid = df.drop(index=bad)
+    valid["note"] = valid["note"].mask(valid["note"] == "")
+    valid["perc_avanzamento"] = perc.drop(index=bad).astype(int)
+    errors.sort(key=lambda e: e["riga"])
+    # Record costruiti per colonne (più veloce di DataFrame.to_dict su blocchi grandi), con None al posto dei valori mancanti
+    columns = [valid[c].astype(object).where(valid[c].notna(), None).tolist() for c in RISK_COLUMNS]
+    return [dict(zip(RISK_COLUMNS, values)) for values in zip(*columns)], errors
+
+def insert_risks(conn, records, user=None):
+    """Inserisce i rischi già validati (i record ricevono row_version) con un executemany, li indicizza per la ricerca, li collega all'anagrafica fornitori e li registra nello storico. Non esegue il commit."""
+    if not records: return
+    db.bump_table_version(conn, "risks")
+    max_id = max_risk_id(conn)
+    # La versione è letta una volta per blocco invece di un sotto-select ROW_VERSION_SQL per riga
+    version = db.get_table_version(conn, "risks")
+    for r in records: r["row_version"] = version
+    # Insert Core sulla tabella (come migrate_db.py): executemany diretto sul cursore del driver;
+    # l'indice di ricerca è aggiornato una volta per blocco invece che dai trigger riga per riga
+    with db.bulk_search_insert(conn, "risks", max_id):
+        conn.execute(db.metadata.tables["risks"].insert(), records)
+    after_write(conn, "risks")
+    record_risk_changes(conn, max_id, user)
+
+# —————————————————————————————
+# Lettura a blocchi
+# —————————————————————————————
+def _normalize_header(name):
+    key = str(name).strip().lower().replace(" ", "_")
+    return HEADER_ALIASES.get(key, key)
+
+def _cell(value):
+    if value is None: return ""
+    if isinstance(value, datetime): return value.date().isoformat()
+    if isinstance(value, date): return value.isoformat()
+    if isinstance(value, float) and value.is_integer(): return str(int(value))
+    return str(value)
+
+def _detect_sep(source):
+    # Export CSV di Excel in italiano usano ';': il separatore è dedotto dalla riga di intestazione
+    if isinstance(source, (str, Path)):
+        with open(source, encoding="utf-8-sig", newline="") as f: sample = f.readline()
+    else:
+        sample = source.read(4096); source.seek(0)
+        sample = (sample.decode("utf-8-sig", errors="ignore") if isinstance(sample, bytes) else sample).splitlines()[0] if sample else ""
+    return max(",;\t|", key=sample.count)
+
+def read_chunks(source, kind, chunk_size=IMPORT_BLOCCO, skip=0):
+    """DataFrame di al più chunk_size righe (valori stringa, intestazioni normalizzate) letti in sequenza da un CSV o da un .xlsx."""
+    if kind == "csv":
+        reader = pd.read_csv(source, sep=_detect_sep(source), dtype=str, keep_default_na=False, encoding="utf-8-sig",
+                             chunksize=chunk_size, skiprows=range(1, skip + 1))
+        with reader:
+            for chunk in reader:
+                yield chunk.rename(columns=_normalize_header)
+    elif kind == "xlsx":
+        from openpyxl import load_workbook
+        workbook = load_workbook(source, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = [_normalize_header(h) for h in next(rows, ())]
+            batch = []
+            for i, row in enumerate(rows):
+                if i < skip: continue
+                batch.append([_cell(v) for v in row[:len(header)]] + [""] * (len(header) - len(row)))
+                if len(batch) == chunk_size:
+                    yield pd.DataFrame(batch, columns=header); batch = []
+            if batch:
+                yield pd.DataFrame(batch, columns=header)
+        finally:
+            workbook.close()
+    else:
+        raise ValueError(f"Formato non supportato: {kind} (usa .csv o .xlsx)")
+
+def file_kind(name):
+    return Path(name).suffix.lower().lstrip(".")
+
+# —————————————————————————————
+# Import
+# —————————————————————————————
+def import_risks(source, kind, chunk_size=IMPORT_BLOCCO, dry_run=False, skip=0, on_errors=None, on_progress=None, user=None):
+    """
+    Importa i rischi di 'source' (percorso o file aperto) a blocchi. on_errors riceve gli errori di ogni blocco,
+    on_progress il riepilogo aggiornato dopo ogni blocco. Con dry_run le righe sono solo validate.
+    Solleva ValueError se mancano colonne obbligatorie (prima di inserire qualsiasi riga).
+    """
+    summary, start = {"lette": 0, "importate": 0, "scartate": 0, "errori": 0, "secondi": 0.0}, time.perf_counter()
+    for chunk in read_chunks(source, kind, chunk_size, skip):
+        if not summary["lette"]:
+            missing = [c for c in REQUIRED_COLUMNS if c not in chunk.columns]
+            if missing: raise ValueError(f"Colonne mancanti nel file: {', '.join(missing)}")
+        records, errors = validate_risks(chunk, first_row=2 + skip + summary["lette"])
+        if records and not dry_run:
+            with db.write_connection() as conn:
+                insert_risks(conn, records, user)
+                conn.commit()
+        summary["lette"] += len(chunk)
+        summary["importate"] += 0 if dry_run else len(records)
+        summary["scartate"] += len(chunk) - len(records)
+        summary["errori"] += len(errors)
+        summary["secondi"] = time.perf_counter() - start
+        if errors and on_errors: on_errors(errors)
+        if on_progress: on_progress(summary)
+    return summary
+
+def errors_csv(errors):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=["riga", "colonna", "valore", "errore"])
+    writer.writeheader(); writer.writerows(errors)
+    return buffer.getvalue()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import massivo dei rischi fornitore da CSV o Excel.")
+    parser.add_argument("file", help="file .csv o .xlsx con una riga di intestazione")
+    parser.add_argument("--database", default=db.DATABASE_URL, help="URL SQLAlchemy del database (default: DATABASE_URL)")
+    parser.add_argument("--blocco", type=int, default=IMPORT_BLOCCO, help="righe per blocco (una transazione per blocco)")
+    parser.add_argument("--verifica", action="store_true", help="valida il file senza inserire righe")
+    parser.add_argument("--salta", type=int, default=0, help="righe di dati da saltare (per riprendere un import interrotto)")
+    parser.add_argument("--errori", default=None, help="file CSV in cui scrivere le righe scartate (default: a video)")
+    args = parser.parse_args()
+    db.configure(args.database)
+    db.init_db()
+
+    out = open(args.errori, "w", newline="", encoding="utf-8") if args.errori else None
+    writer = csv.DictWriter(out, fieldnames=["riga", "colonna", "valore", "errore"]) if out else None
+    if writer: writer.writeheader()
+
+    def report_errors(errors):
+        if writer: writer.writerows(errors)
+        else:
+            for e in errors: print(f"riga {e['riga']}, {e['colonna']}: {e['errore']} ({e['valore']!r})")
+
+    def report_progress(s):
+        print(f"{s['lette']} righe lette, {s['importate']} importate, {s['scartate']} scartate ({s['lette'] / max(s['secondi'], 1e-9):,.0f} righe/s)")
+
+    try:
+        summary = import_risks(args.file, file_kind(args.file), args.blocco, args.verifica, args.salta, report_errors, report_progress)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    finally:
+        if out: out.close()
+    print(f"Completato in {summary['secondi']:.1f}s: {summary['importate']} righe importate, {summary['scartate']} scartate ({summary['errori']} errori).")
@@ -0,0 +1,121 @@
+"""
+Salvataggio delle modifiche dei data_editor (Modifica, Follow-up).
+Legge lo stato delta del widget (edited_rows / added_rows / deleted_rows) invece di confrontare
+l'intero DataFrame e applica tutte le modifiche in un'unica transazione con executemany.
+I conflitti (riga modificata o eliminata da un altro utente nel frattempo) sono rilevati tramite row_version;
+i rischi aggiunti nell'editor sono validati con le regole del form di censimento (risk_import.validate_risks).
+Per i rischi ogni modifica è registrata anche in risk_history (vedi history.py), nella stessa transazione;
+le righe scritte sono collegate all'anagrafica fornitori e i punteggi aggiornati per differenza (vedi suppliers.py).
+"""
+import pandas as pd
+from sqlalchemy import text
+
+from db import ROW_VERSION_SQL, bump_table_version, delete_rows, in_list
+from history import max_risk_id, record_risk_changes, record_risk_deletes
+from risk_import import RISK_COLUMNS, validate_risks
+from suppliers import after_write, before_write
+
+# Colonne scrivibili dagli editor e relativo tipo di conversione verso il DB
+EDITABLE_COLUMNS = {
+    "risks": {"data_inizio": "date", "data_fine": "date", "fornitore": "text", "rischio": "text", "stato": "text", "gravita": "text",
+              "note": "text", "data_chiusura": "date", "contract_owner": "text", "area_riferimento": "text", "perc_avanzamento": "int"},
+    "reminders": {"fornitore_nome": "text", "stato_reminder": "text", "note": "text", "test_bc": "int", "test_it": "int",
+                  "test_pt_va": "int", "access_review": "int", "ppt": "int"},
+}
+
+class SaveConflict(Exception):
+    """Alcune righe sono state modificate o eliminate da un altro utente dopo il caricamento dell'editor."""
+    def __init__(self, ids):
+        super().__init__(f"Righe modificate o eliminate da un altro utente: {', '.join(map(str, ids))}. Nessuna modifica è stata salvata.")
+        self.ids = ids
+
+class InvalidRows(Exception):
+    """Righe aggiunte nell'editor che non superano la validazione; 'errors' come in risk_import.validate_risks (riga = n. della riga aggiunta)."""
+    def __init__(self, errors):
+        super().__init__(f"Righe aggiunte non valide ({len(errors)} errori). Nessuna modifica è stata salvata.")
+        self.errors = errors
+
+def _to_db(value, kind):
+    if value is None or (not isinstance(value, (list, tuple)) and pd.isna(value)):
+        return 0 if kind == "int" else None
+    if kind == "date": return pd.to_datetime(value).date().isoformat()
+    if kind == "int": return int(value)
+    return str(value)
+
+def collect_changes(table, original, editor_state):
+    """
+    Traduce lo stato del data_editor in (updates, inserts, deletes).
+    Le posizioni di edited_rows/deleted_rows si riferiscono alle righe di 'original' nell'ordine mostrato: 'original'
+    deve essere la pagina su cui l'utente ha fatto le modifiche (non i dati riletti al salvataggio), così le
+    row_version attese sono quelle lette dall'utente.
+    updates: [(valori, id, row_version attesa)], inserts: [valori], deletes: [(id, row_version attesa)]
+    """
+    cols = EDITABLE_COLUMNS[table]
+    original = original.reset_index(drop=True)
+    deleted_pos = {int(p) for p in editor_state.get("deleted_rows", [])}
+    updates = []
+    for pos, edits in editor_state.get("edited_rows", {}).items():
+        if int(pos) in deleted_pos: continue
+        row = original.iloc[int(pos)]
+        values = {c: _to_db(row[c], kind) for c, kind in cols.items()}
+        values.update({c: _to_db(v, cols[c]) for c, v in edits.items() if c in cols})
+        updates.append((values, int(row["id"]), int(row["row_version"])))
+    inserts = [{c: _to_db(r.get(c), kind) for c, kind in cols.items()} for r in editor_state.get("added_rows", [])]
+    deletes = [(int(original.iloc[p]["id"]), int(original.iloc[p]["row_version"])) for p in sorted(deleted_pos)]
+    return updates, inserts, deletes
+
+def apply_changes(conn, table, updates, inserts, deletes, user=None):
+    """
+    Applica le modifiche in un'unica transazione (su SQLite aperta con BEGIN IMMEDIATE, su PostgreSQL con le righe
+    bloccate da SELECT ... FOR UPDATE): verifica le row_version attese, poi esegue UPDATE/INSERT/DELETE con executemany.
+    In caso di conflitto o errore nessuna modifica viene salvata.
+    Restituisce il numero di righe modificate, inserite ed eliminate.
+    """
+    cols = list(EDITABLE_COLUMNS[table])
+    lock_sql = " FOR UPDATE" if conn.dialect.name == "postgresql" else ""
+    try:
+        expected = {row_id: version for _, row_id, version in updates}
+        expected.update(deletes)
+        current, ids = {}, list(expected)
+        for i in range(0, len(ids), 500):
+            placeholders, params = in_list("id", ids[i:i + 500])
+            current.update({r[0]: r[1] for r in conn.execute(text(f"SELECT id, row_version FROM {table} WHERE id IN {placeholders}{lock_sql}"), params)})
+        conflicts = sorted(row_id for row_id, version in expected.items() if current.get(row_id) != version)
+        if conflicts: raise SaveConflict(conflicts)
+
+        bump_table_version(conn, table)
+        version_sql = ROW_VERSION_SQL.format(table)
+        history = table == "risks"
+        if history: max_id = max_risk_id(conn)
+        # Punteggi dei fornitori: via il contributo delle righe modificate o eliminate, poi quello delle righe scritte
+        before_write(conn, table, list(expected))
+        if updates:
+            conn.execute(text(f"UPDATE {table} SET {', '.join(f'{c}=:{c}' for c in cols)}, row_version={version_sql} WHERE id=:id"),
+                         [{**values, "id": row_id} for values, row_id, _ in updates])
+        if inserts:
+            conn.execute(text(f"INSERT INTO {table}({', '.join(cols)}, row_version) VALUES({', '.join(f':{c}' for c in cols)}, {version_sql})"), inserts)
+        if updates or inserts:
+            after_write(conn, table)
+        if history and (updates or inserts):
+            record_risk_changes(conn, max_id, user)
+        if deletes:
+            if history: record_risk_deletes(conn, [row_id for row_id, _ in deletes], user)
+            delete_rows(conn, table, [row_id for row_id, _ in deletes])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return {"modificate": len(updates), "inserite": len(inserts), "eliminate": len(deletes)}
+
+def save_editor_changes(conn, table, original, editor_state, user=None):
+    """
+    Salva lo stato delta di un data_editor costruito su 'original' ('user' è registrato nello storico). Vedi collect_changes
+    e apply_changes; solleva InvalidRows, senza scrivere nulla, se un rischio aggiunto non è valido.
+    """
+    updates, inserts, deletes = collect_changes(table, original, editor_state or {})
+    if table == "risks" and inserts:
+        inserts, errors = validate_risks(pd.DataFrame(inserts, columns=RISK_COLUMNS), first_row=1)
+        if errors: raise InvalidRows(errors)
+    if not (updates or inserts or deletes):
+        return {"modificate": 0, "inserite": 0, "eliminate": 0}
+    return apply_changes(conn, table, updates, inserts, deletes, user)
@@ -0,0 +1,171 @@
+"""
+Processo in background, da avviare accanto all'app Streamlit, per l'escalation dei reminder scaduti.
+
+    python scheduler.py                      # ciclo continuo, un passaggio ogni --intervallo secondi
+    python scheduler.py --una-volta          # un solo passaggio (es. da cron)
+    NOTIFY_SINK=smtp SMTP_HOST=... SMTP_TO=... python scheduler.py
+
+Ogni passaggio:
+1. scansione incrementale: i reminder 'Attivo' scaduti oltre il watermark (data_invio, id) salvato in
+   scheduler_state sono registrati in reminder_escalations, al più una escalation per reminder;
+2. notifica: le escalation in attesa sono prenotate a blocchi, inviate con il canale di notifications.py
+   e marcate come inviate (quelle dei reminder nel frattempo risposti come non necessarie); gli errori sono
+   ritentati con attesa crescente fino a MAX_TENTATIVI;
+3. fotografia: la riga del giorno corrente di risk_snapshots è ricalcolata (history.take_snapshot), così
+   l'ultimo punto dei grafici di andamento segue le modifiche della giornata; i punteggi dei fornitori
+   contano i rischi scaduti nel nuovo giorno (suppliers.advance_scores); i tombstone più vecchi di
+   db.TOMBSTONE_GIORNI sono rimossi (db.prune_tombstones).
+Entrambe le fasi lavorano a blocchi, con una transazione per blocco, e si possono ripetere senza duplicati.
+"""
+import argparse
+import json
+import time
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import text
+
+import db
+from history import take_snapshot
+from notifications import get_sink
+from suppliers import advance_scores
+
+BLOCCO = 500
+MAX_TENTATIVI = 5
+# Attesa prima del primo nuovo tentativo (raddoppia a ogni errore)
+RITARDO_BASE_S = 60
+# Le escalation prenotate da un passaggio non sono riprese da altri processi prima di questa durata
+PRENOTAZIONE_S = 300
+
+def _timestamp(dt=None):
+    return (dt or datetime.now()).isoformat(timespec="seconds")
+
+def get_state(conn, key, default=None):
+    value = conn.execute(text("SELECT valore FROM scheduler_state WHERE chiave=:k"), {"k": key}).scalar()
+    return json.loads(value) if value is not None else default
+
+def set_state(conn, key, value):
+    conn.execute(text("INSERT INTO scheduler_state(chiave, valore) VALUES(:k, :v) ON CONFLICT (chiave) DO UPDATE SET valore = excluded.valore"),
+                 {"k": key, "v": json.dumps(value)})
+
+# —————————————————————————————
+# Scansione
+# —————————————————————————————
+def _record_escalations(conn, rows):
+    now = _timestamp()
+    conn.execute(text("INSERT INTO reminder_escalations(reminder_id, fornitore_nome, data_invio, creata_il, prossimo_tentativo) "
+                      "VALUES(:id, :fornitore_nome, :data_invio, :now, :now) ON CONFLICT (reminder_id) DO NOTHING"),
+                 [{**r._mapping, "now": now} for r in rows])
+
+def scan_reminders(conn, today, batch_size=BLOCCO):
+    """
+    Registra le escalation dei reminder scaduti non ancora esaminati e restituisce quanti reminder ha esaminato.
+    Il watermark (data_invio, id) avanza con la soglia di scadenza; i reminder inseriti dopo l'ultimo passaggio
+    con una data_invio già superata dal watermark (es. retrodatati) sono recuperati tramite l'id massimo visto.
+    """
+    limite = (today - timedelta(days=db.REMINDER_SOGLIA_GIORNI - 1)).isoformat()
+    wm_data, wm_id = get_state(conn, "escalation_watermark", ["", 0])
+    top_id = conn.execute(text("SELECT COALESCE(MAX(id), 0) FROM reminders")).scalar_one()
+    # Al primo passaggio la scansione per watermark copre già tutti i reminder esistenti
+    max_id = get_state(conn, "escalation_max_id", top_id)
+    examined = 0
+    while True:
+        rows = conn.execute(text("SELECT id, fornitore_nome, data_invio FROM reminders WHERE stato_reminder = 'Attivo' AND data_invio < :limite "
+                                 "AND data_invio >= :wm_data AND (data_invio > :wm_data OR id > :wm_id) ORDER BY data_invio, id LIMIT :n"),
+                            {"limite": limite, "wm_data": wm_data, "wm_id": wm_id, "n": batch_size}).fetchall()
+        if not rows: break
+        _record_escalations(conn, rows)
+        wm_data, wm_id = rows[-1].data_invio, rows[-1].id
+        set_state(conn, "escalation_watermark", [wm_data, wm_id])
+        conn.commit()
+        examined += len(rows)
+    while max_id < top_id:
+        rows = conn.execute(text("SELECT id, fornitore_nome, data_invio FROM reminders WHERE id > :after AND id <= :top "
+                                 "AND stato_reminder = 'Attivo' AND data_invio < :wm_data ORDER BY id LIMIT :n"),
+                            {"after": max_id, "top": top_id, "wm_data": wm_data, "n": batch_size}).fetchall()
+        if rows: _record_escalations(conn, rows)
+        max_id = rows[-1].id if len(rows) == batch_size else top_id
+        set_state(conn, "escalation_max_id", max_id)
+        conn.commit()
+        examined += len(rows)
+    set_state(conn, "escalation_max_id", max_id)
+    conn.commit()
+    return examined
+
+# —————————————————————————————
+# Notifica
+# —————————————————————————————
+def deliver_escalations(conn, sink, batch_size=BLOCCO):
+    """
+    Invia le escalation in attesa con 'sink', un blocco alla volta. Ogni blocco è prenotato (prossimo_tentativo
+    spostato di PRENOTAZIONE_S) prima dell'invio, così che un altro processo o un passaggio interrotto non lo
+    invii due volte. Lo stato del reminder è ricontrollato a ogni blocco (anche per i nuovi tentativi): le escalation
+    dei reminder risposti o eliminati dopo la scansione sono marcate 'non necessaria' e non sono inviate.
+    Restituisce (inviate, errori, non necessarie).
+    """
+    lock_sql = " FOR UPDATE OF e SKIP LOCKED" if conn.dialect.name == "postgresql" else ""
+    sent = failed = skipped = 0
+    while True:
+        now = datetime.now()
+        skipped += conn.execute(text("UPDATE reminder_escalations SET stato_notifica='non necessaria' WHERE stato_notifica = 'in attesa' AND prossimo_tentativo <= :now "
+                                     "AND NOT EXISTS (SELECT 1 FROM reminders r WHERE r.id = reminder_escalations.reminder_id AND r.stato_reminder = 'Attivo')"),
+                                {"now": _timestamp(now)}).rowcount
+        rows = conn.execute(text(f"SELECT e.id, e.reminder_id, e.fornitore_nome, e.data_invio, e.tentativi FROM reminder_escalations e "
+                                 f"JOIN reminders r ON r.id = e.reminder_id AND r.stato_reminder = 'Attivo' "
+                                 f"WHERE e.stato_notifica = 'in attesa' AND e.prossimo_tentativo <= :now ORDER BY e.prossimo_tentativo, e.id LIMIT :n{lock_sql}"),
+                            {"now": _timestamp(now), "n": batch_size}).fetchall()
+        if not rows:
+            conn.commit()
+            break
+        conn.execute(text("UPDATE reminder_escalations SET prossimo_tentativo=:t WHERE id=:id"),
+                     [{"id": r.id, "t": _timestamp(now + timedelta(seconds=PRENOTAZIONE_S))} for r in rows])
+        conn.commit()
+
+        escalations = [dict(r._mapping) for r in rows]
+        try:
+            results = sink.send(escalations)
+        except Exception as e:
+            results = [str(e)] * len(escalations)
+        done = [{"id": e["id"], "t": _timestamp()} for e, error in zip(escalations, results) if error is None]
+        retry = [{"id": e["id"], "errore": error, "fallita": e["tentativi"] + 1 >= MAX_TENTATIVI,
+                  "t": _timestamp(now + timedelta(seconds=RITARDO_BASE_S * 2 ** e["tentativi"]))}
+                 for e, error in zip(escalations, results) if error is not None]
+        if done:
+            conn.execute(text("UPDATE reminder_escalations SET stato_notifica='inviata', inviata_il=:t, tentativi=tentativi+1, ultimo_errore=NULL WHERE id=:id"), done)
+        if retry:
+            conn.execute(text("UPDATE reminder_escalations SET stato_notifica=CASE WHEN :fallita THEN 'fallita' ELSE 'in attesa' END, "
+                              "prossimo_tentativo=:t, tentativi=tentativi+1, ultimo_errore=:errore WHERE id=:id"), retry)
+        conn.commit()
+        sent, failed = sent + len(done), failed + len(retry)
+    return sent, failed, skipped
+
+def run_once(sink, batch_size=BLOCCO, log=print):
+    start = time.perf_counter()
+    with db.write_connection() as conn:
+        examined = scan_reminders(conn, date.today(), batch_size)
+        sent, failed, skipped = deliver_escalations(conn, sink, batch_size)
+        take_snapshot(conn, date.today())
+        advance_scores(conn, date.today())
+        db.prune_tombstones(conn)
+        conn.commit()
+    log(f"{_timestamp()} reminder esaminati: {examined}, notifiche inviate: {sent}, errori: {failed}, non necessarie: {skipped} ({time.perf_counter() - start:.1f}s)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Escalation e notifica dei reminder scaduti della dashboard fornitori.")
+    parser.add_argument("--database", default=db.DATABASE_URL, help="URL SQLAlchemy del database (default: DATABASE_URL)")
+    parser.add_argument("--canale", default=None, help="canale di notifica: log, smtp o modulo:Classe (default: NOTIFY_SINK)")
+    parser.add_argument("--intervallo", type=int, default=60, help="secondi tra un passaggio e il successivo")
+    parser.add_argument("--blocco", type=int, default=BLOCCO, help="reminder ed escalation per transazione")
+    parser.add_argument("--una-volta", action="store_true", help="esegue un solo passaggio ed esce")
+    args = parser.parse_args()
+    db.configure(args.database)
+    db.init_db()
+    sink = get_sink(args.canale)
+    while True:
+        try:
+            run_once(sink, args.blocco)
+        except Exception as e:
+            # Un errore transitorio (es. database occupato) non ferma il processo: il passaggio successivo riprende dal watermark
+            if args.una_volta: raise
+            print(f"{_timestamp()} errore: {e}")
+        if args.una_volta: break
+        time.sleep(args.intervallo)
@@ -0,0 +1,160 @@
+"""
+Ricerca testuale su rischi e reminder e ricerca approssimata dei nomi dei fornitori.
+
+Su SQLite le query usano gli indici FTS5 creati da db.create_search_index (risks_fts, reminders_fts),
+mantenuti allineati dai trigger a ogni INSERT/UPDATE/DELETE: nessun percorso di salvataggio deve aggiornarli.
+I risultati sono ordinati per pertinenza (bm25, con il fornitore che pesa più del testo delle note) e paginati;
+oltre SEARCH_RANK_MAX risultati (parole presenti in gran parte delle righe) bm25 costerebbe secondi senza
+distinguere davvero le righe: l'ordine diventa dal più recente, che FTS5 legge direttamente dall'indice.
+Ogni parola cercata è trattata come prefisso ("evid" trova "evidenze"), senza distinzione di maiuscole e accenti.
+
+I nomi dei fornitori sono indicizzati a trigrammi (fornitori_nomi_fts): match_suppliers trova le grafie diverse
+dello stesso fornitore ("ACME S.p.A.", "Acme spa", "Acmee") e le ordina per somiglianza.
+Su altri backend, o con un SQLite senza FTS5, le stesse funzioni ripiegano su LIKE (senza ordinamento per pertinenza).
+
+    python search.py "evidenze fornitore"
+    python search.py --fornitore "acme spa"
+"""
+import argparse
+import re
+import unicodedata
+from difflib import SequenceMatcher
+
+import pandas as pd
+from sqlalchemy import text
+
+import db
+
+# Pesi bm25 per colonna, nell'ordine di db.SEARCH_INDEXES
+SEARCH_WEIGHTS = {"risks": (5.0, 2.0, 1.0), "reminders": (5.0, 1.0)}
+SEARCH_PAGE_SIZE = 20
+SEARCH_RANK_MAX = 10_000
+# Caratteri di contesto attorno alla prima parola trovata nell'estratto delle note, e marcatori delle parole trovate
+ESTRATTO_CONTESTO = 60
+EVIDENZIA = ("«", "»")
+# Nomi candidati letti dall'indice a trigrammi prima del confronto puntuale, e somiglianza minima (0-1) per proporli
+FORNITORI_CANDIDATI = 200
+SIMILARITA_MIN = 0.75
+# Forme societarie ignorate nel confronto dei nomi
+_LEGAL_FORMS = re.compile(r"\b(s\.?\s?p\.?\s?a|s\.?\s?r\.?\s?l\.?\s?s?|s\.?\s?n\.?\s?c|s\.?\s?a\.?\s?s|ltd|inc|gmbh|llc|sa|ag)\b\.?")
+
+def fts_available(conn):
+    return conn.dialect.name == "sqlite" and conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'risks_fts'")).first() is not None
+
+def _terms(query):
+    return re.findall(r"\w+", query.lower())
+
+def fts_query(query):
+    """Traduce il testo digitato in una query FTS5 sicura: ogni parola tra virgolette, come prefisso, tutte obbligatorie."""
+    return " ".join(f'"{t}"*' for t in _terms(query))
+
+# —————————————————————————————
+# Rischi e reminder
+# —————————————————————————————
+def _like_search(table, terms):
+    cols = db.SEARCH_INDEXES[table]
+    clauses, params = [], {}
+    for i, term in enumerate(terms):
+        clauses.append("(" + " OR ".join(f"LOWER({c}) LIKE :t{i}" for c in cols) + ")"); params[f"t{i}"] = f"%{term}%"
+    return f"FROM {table} WHERE {' AND '.join(clauses)}", params
+
+def highlight(note, terms, context=ESTRATTO_CONTESTO):
+    """Estratto della nota attorno alla prima parola trovata, con le parole trovate tra i marcatori EVIDENZIA."""
+    # Le note vuote arrivano da pandas come None o NaN
+    if not isinstance(note, str) or not note: return None
+    pattern = re.compile(r"\b(" + "|".join(re.escape(t) for t in terms) + r")\w*", re.IGNORECASE)
+    first = pattern.search(note)
+    start = max(0, first.start() - context) if first else 0
+    excerpt = note[start:start + 2 * context + (first.end() - first.start() if first else 0)]
+    return ("…" if start else "") + pattern.sub(lambda m: f"{EVIDENZIA[0]}{m.group(0)}{EVIDENZIA[1]}", excerpt) + ("…" if start + len(excerpt) < len(note) else "")
+
+def search(conn, table, query, limit=SEARCH_PAGE_SIZE, offset=0):
+    """
+    Righe di 'table' (risks o reminders) che contengono tutte le parole di 'query', per pertinenza.
+    Restituisce (numero totale di risultati, DataFrame della pagina); la colonna 'estratto' riporta
+    il passaggio delle note con le parole evidenziate.
+    """
+    if table not in db.SEARCH_INDEXES: raise ValueError(f"Tabella non indicizzata: {table}")
+    terms = _terms(query)
+    if not terms: return 0, pd.DataFrame()
+    columns = [c.name for c in db.metadata.tables[table].columns if c.name not in ("row_version", "supplier_id")]
+    if fts_available(conn):
+        params = {"q": fts_query(query), "limit": limit, "offset": offset}
+        total = conn.execute(text(f"SELECT COUNT(*) FROM {table}_fts WHERE {table}_fts MATCH :q"), params).scalar_one()
+        order = f"bm25({table}_fts, {', '.join(map(str, SEARCH_WEIGHTS[table]))}), rowid DESC" if total <= SEARCH_RANK_MAX else "rowid DESC"
+        # Prima gli id della pagina dal solo indice, poi le righe: la tabella è letta per LIMIT righe, non per tutti i risultati
+        ids = conn.execute(text(f"SELECT rowid FROM {table}_fts WHERE {table}_fts MATCH :q ORDER BY {order} LIMIT :limit OFFSET :offset"), params).scalars().all()
+        placeholders, id_params = db.in_list("id", ids)
+        sql, params = f"SELECT {', '.join(columns)} FROM {table} WHERE id IN {placeholders}" if ids else f"SELECT {', '.join(columns)} FROM {table} WHERE 1 = 0", id_params
+    else:
+        where, params = _like_search(table, terms)
+        total = conn.execute(text(f"SELECT COUNT(*) {where}"), params).scalar_one()
+        sql, params = f"SELECT {', '.join(columns)} {where} ORDER BY id DESC LIMIT :limit OFFSET :offset", {**params, "limit": limit, "offset": offset}
+        ids = None
+    page = pd.read_sql_query(text(sql), conn, params=params, parse_dates=db.parse_dates(table))
+    if ids:
+        found = set(page["id"])
+        page = page.set_index("id").loc[[i for i in ids if i in found]].reset_index()
+    page["estratto"] = [highlight(n, terms) for n in page["note"]]
+    return total, page
+
+# —————————————————————————————
+# Fornitori
+# —————————————————————————————
+def normalize_supplier(name):
+    """Forma di confronto di un nome: minuscole, senza accenti, punteggiatura e forma societaria."""
+    name = unicodedata.normalize("NFKD", name.lower()).encode("ascii", "ignore").decode()
+    return " ".join(re.sub(r"[^\w]+", " ", _LEGAL_FORMS.sub(" ", name)).split())
+
+def _supplier_candidates(conn, name):
+    normalized = normalize_supplier(name)
+    if fts_available(conn) and len(normalized) >= 3:
+        # Trigrammi del nome in OR: i nomi che ne condividono di più hanno bm25 migliore
+        trigrams = {normalized[i:i + 3] for i in range(len(normalized) - 2)}
+        query = " OR ".join('"' + t.replace('"', '""') + '"' for t in trigrams)
+        return conn.execute(text("SELECT nome FROM fornitori_nomi_fts WHERE fornitori_nomi_fts MATCH :q ORDER BY rank LIMIT :n"),
+                            {"q": query, "n": FORNITORI_CANDIDATI}).scalars().all()
+    return conn.execute(text("SELECT fornitore FROM risks UNION SELECT fornitore_nome FROM reminders")).scalars().all()
+
+def match_suppliers(conn, name, limit=10, min_similarity=SIMILARITA_MIN):
+    """
+    Fornitori con nome simile a 'name' (anche grafie diverse dello stesso fornitore), dal più simile.
+    Restituisce [{"fornitore", "somiglianza", "rischi", "reminder"}]; i nomi non più usati sono esclusi.
+    """
+    target = normalize_supplier(name)
+    if not target: return []
+    scored = []
+    for candidate in _supplier_candidates(conn, name):
+        if candidate is None: continue
+        normalized = normalize_supplier(candidate)
+        score = 1.0 if normalized == target else SequenceMatcher(None, target, normalized).ratio()
+        # Un nome che contiene quello cercato (es. sigla) è un buon candidato anche se molto più lungo
+        if target in normalized.split() or normalized.startswith(target): score = max(score, 0.9)
+        if score >= min_similarity: scored.append((score, candidate))
+    results = []
+    for score, candidate in sorted(scored, key=lambda s: (-s[0], s[1])):
+        risks = conn.execute(text("SELECT COUNT(*) FROM risks WHERE fornitore = :f"), {"f": candidate}).scalar_one()
+        reminders = conn.execute(text("SELECT COUNT(*) FROM reminders WHERE fornitore_nome = :f"), {"f": candidate}).scalar_one()
+        if risks or reminders: results.append({"fornitore": candidate, "somiglianza": round(score, 2), "rischi": risks, "reminder": reminders})
+        if len(results) == limit: break
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ricerca testuale su rischi e reminder della dashboard fornitori.")
+    parser.add_argument("testo", nargs="?", help="parole da cercare")
+    parser.add_argument("--tabella", choices=list(db.SEARCH_INDEXES), default="risks")
+    parser.add_argument("--fornitore", help="cerca i fornitori con nome simile")
+    parser.add_argument("--pagina", type=int, default=1)
+    parser.add_argument("--database", default=db.DATABASE_URL, help="URL SQLAlchemy del database (default: DATABASE_URL)")
+    args = parser.parse_args()
+    db.configure(args.database)
+    db.init_db()
+    with db.read_connection() as conn:
+        if args.fornitore:
+            for m in match_suppliers(conn, args.fornitore):
+                print(f"{m['somiglianza']:.2f}  {m['fornitore']}  (rischi: {m['rischi']}, reminder: {m['reminder']})")
+        if args.testo:
+            total, page = search(conn, args.tabella, args.testo, offset=(args.pagina - 1) * SEARCH_PAGE_SIZE)
+            print(f"{total} risultati")
+            with pd.option_context("display.width", 200, "display.max_columns", None, "display.max_colwidth", 60):
+                print(page.to_string(index=False))
@@ -0,0 +1,209 @@
+"""
+Anagrafica dei fornitori e punteggio di rischio per fornitore.
+
+Rischi e reminder conservano il nome del fornitore così come è stato scritto (fornitore, fornitore_nome) e
+ricevono l'id del fornitore in supplier_id. Ogni grafia è registrata in supplier_aliases; grafie con lo stesso
+nome normalizzato (maiuscole, accenti, punteggiatura, forma societaria: "ACME S.p.A." = "Acme spa") sono lo
+stesso fornitore. Le righe senza id (database precedenti, scritture esterne all'app) sono collegate da
+migrate_suppliers, eseguita da db.init_db.
+
+Punteggio di un fornitore (più alto = più rischioso):
+- ogni rischio aperto pesa GRAVITA_PESI[gravita] * (1 - perc_avanzamento / 200): l'avanzamento dimezza il peso al 100%;
+- il peso dei rischi aperti con data_fine superata è contato (1 + PESO_SCADUTO) volte;
+- ogni test non ancora ricevuto nei reminder del fornitore (TEST_FLAGS) aggiunge PESO_TEST.
+Le componenti (conteggi e pesi interi, moltiplicati per SCALA) sono salvate in suppliers e aggiornate per
+differenza dai percorsi di salvataggio: before_write sottrae il contributo delle righe che saranno modificate o
+eliminate, after_write aggiunge quello delle righe scritte. Solo i fornitori toccati sono aggiornati, senza
+ricalcolare il resto. I rischi che scadono con il passare dei giorni sono aggiunti da advance_scores, una volta
+al giorno (scheduler.py, Dashboard, e prima di ogni scrittura), leggendo solo quelli scaduti dall'ultimo giorno.
+
+    python suppliers.py                  # collega le righe senza fornitore e stampa la classifica
+    python suppliers.py --ricalcola      # ricalcolo completo dei punteggi (verifica/riparazione)
+"""
+import argparse
+from datetime import date
+
+from sqlalchemy import text
+
+import db
+from search import normalize_supplier
+
+GRAVITA_PESI = {"Critical": 10, "High": 4, "Low": 1}
+PESO_SCADUTO = 1
+PESO_TEST = 0.5
+TEST_FLAGS = ("test_bc", "test_it", "test_pt_va", "access_review", "ppt")
+# Pesi interi: peso di un rischio = GRAVITA_PESI * (SCALA - perc_avanzamento), il punteggio li divide per SCALA
+SCALA = 200
+# Colonna con il nome del fornitore in ciascuna tabella collegata
+NAME_COLUMNS = {"risks": "fornitore", "reminders": "fornitore_nome"}
+COMPONENTS = ("rischi", "rischi_aperti", "rischi_scaduti", "peso_aperti", "peso_scaduti", "reminder", "test_mancanti")
+# Chiave di scheduler_state con il giorno a cui si riferiscono le componenti "scaduti"
+GIORNO_KEY = "punteggi_giorno"
+_BLOCCO_IN = 500
+
+# —————————————————————————————
+# Anagrafica
+# —————————————————————————————
+def _supplier_key(name):
+    return normalize_supplier(name) or name.strip().lower()
+
+def _in_chunks(values):
+    values = list(values)
+    for i in range(0, len(values), _BLOCCO_IN):
+        yield db.in_list("v", values[i:i + _BLOCCO_IN])
+
+def intern_names(conn, names):
+    """
+    Id del fornitore di ciascun nome ({nome: id}); i nomi nuovi sono registrati come grafie di un fornitore esistente
+    con la stessa chiave o di un nuovo fornitore, che prende il primo nome incontrato. Non esegue il commit.
+    """
+    names = [n for n in dict.fromkeys(names) if n is not None]
+    ids = {}
+    for placeholders, params in _in_chunks(names):
+        ids.update(conn.execute(text(f"SELECT nome, supplier_id FROM supplier_aliases WHERE nome IN {placeholders}"), params).all())
+    missing = [n for n in names if n not in ids]
+    if not missing: return ids
+    keys = {n: _supplier_key(n) for n in missing}
+    new_suppliers = list({k: n for n, k in reversed(list(keys.items()))}.items())
+    conn.execute(text("INSERT INTO suppliers(nome, chiave) VALUES(:nome, :chiave) ON CONFLICT DO NOTHING"),
+                 [{"chiave": k, "nome": n} for k, n in new_suppliers])
+    by_key = {}
+    for placeholders, params in _in_chunks(set(keys.values())):
+        by_key.update(conn.execute(text(f"SELECT chiave, id FROM suppliers WHERE chiave IN {placeholders}"), params).all())
+    conn.execute(text("INSERT INTO supplier_aliases(nome, supplier_id) VALUES(:nome, :id)"), [{"nome": n, "id": by_key[keys[n]]} for n in missing])
+    ids.update({n: by_key[keys[n]] for n in missing})
+    return ids
+
+def supplier_aliases(conn):
+    """{nome del fornitore: [grafie usate in rischi e reminder]}, per tradurre un fornitore nei filtri per nome."""
+    aliases = {}
+    for name, alias in conn.execute(text("SELECT s.nome, a.nome FROM supplier_aliases a JOIN suppliers s ON s.id = a.supplier_id ORDER BY s.nome, a.nome")):
+        aliases.setdefault(name, []).append(alias)
+    return aliases
+
+def supplier_names(conn):
+    """Nomi dei fornitori con almeno un rischio, in ordine alfabetico (dall'anagrafica, senza scorrere i rischi)."""
+    return conn.execute(text("SELECT nome FROM suppliers WHERE rischi > 0 ORDER BY nome")).scalars().all()
+
+# —————————————————————————————
+# Componenti del punteggio
+# —————————————————————————————
+def _risk_weight():
+    cases = " ".join(f"WHEN '{g}' THEN {w}" for g, w in GRAVITA_PESI.items())
+    return f"(CASE gravita {cases} ELSE 1 END) * ({SCALA} - COALESCE(perc_avanzamento, 0))"
+
+def _components_sql(table, where, supplier="supplier_id", source=None):
+    """SELECT di (fornitore, componenti...) per le righe di 'table' che soddisfano 'where', con gli scaduti riferiti a :giorno."""
+    source = source or table
+    if table == "risks":
+        overdue, weight = "stato = 'aperto' AND data_fine < :giorno", _risk_weight()
+        measures = (f"COUNT(*), SUM(CASE WHEN stato = 'aperto' THEN 1 ELSE 0 END), SUM(CASE WHEN {overdue} THEN 1 ELSE 0 END), "
+                    f"SUM(CASE WHEN stato = 'aperto' THEN {weight} ELSE 0 END), SUM(CASE WHEN {overdue} THEN {weight} ELSE 0 END), 0, 0")
+    else:
+        missing = " + ".join(f"(CASE WHEN {f} = 0 THEN 1 ELSE 0 END)" for f in TEST_FLAGS)
+        measures = f"0, 0, 0, 0, 0, COUNT(*), SUM({missing})"
+    return f"SELECT {supplier}, {measures} FROM {source} WHERE {where} GROUP BY {supplier}"
+
+def _apply(conn, rows, sign=1):
+    """Somma (o sottrae, sign=-1) le componenti ai fornitori e ricalcola il loro punteggio nella stessa UPDATE."""
+    params = [{"id": r[0], **{c: sign * (v or 0) for c, v in zip(COMPONENTS, r[1:])}} for r in rows if r[0] is not None]
+    if not params: return
+    score = f"((peso_aperti + :peso_aperti) + {PESO_SCADUTO} * (peso_scaduti + :peso_scaduti)) / {float(SCALA)} + {PESO_TEST} * (test_mancanti + :test_mancanti)"
+    conn.execute(text(f"UPDATE suppliers SET {', '.join(f'{c} = {c} + :{c}' for c in COMPONENTS)}, punteggio = {score} WHERE id = :id"), params)
+
+def score_day(conn):
+    value = conn.execute(text("SELECT valore FROM scheduler_state WHERE chiave = :k"), {"k": GIORNO_KEY}).scalar()
+    return date.fromisoformat(value) if value else None
+
+def _set_score_day(conn, day):
+    conn.execute(text("INSERT INTO scheduler_state(chiave, valore) VALUES(:k, :v) ON CONFLICT(chiave) DO UPDATE SET valore = excluded.valore"),
+                 {"k": GIORNO_KEY, "v": day.isoformat()})
+
+def recompute_scores(conn, day=None):
+    """Ricalcolo completo delle componenti di tutti i fornitori (migrazione iniziale, verifica). Non esegue il commit."""
+    day = day or date.today()
+    conn.execute(text(f"UPDATE suppliers SET {', '.join(f'{c} = 0' for c in COMPONENTS)}, punteggio = 0"))
+    for table in NAME_COLUMNS:
+        _apply(conn, conn.execute(text(_components_sql(table, "supplier_id IS NOT NULL")), {"giorno": day.isoformat()}).all())
+    _set_score_day(conn, day)
+
+def advance_scores(conn, day=None):
+    """
+    Porta le componenti "scaduti" al giorno 'day': aggiunge solo i rischi aperti con data_fine tra l'ultimo giorno
+    calcolato e 'day' (indice parziale idx_risks_aperti_fine). Non fa nulla se già aggiornate. Non esegue il commit.
+    """
+    day = day or date.today()
+    current = score_day(conn)
+    if current is None: return recompute_scores(conn, day)
+    if current >= day: return
+    weight = _risk_weight()
+    rows = conn.execute(text(f"SELECT supplier_id, 0, 0, COUNT(*), 0, SUM({weight}), 0, 0 FROM risks "
+                             f"WHERE stato = 'aperto' AND data_fine >= :dal AND data_fine < :al GROUP BY supplier_id"),
+                        {"dal": current.isoformat(), "al": day.isoformat()}).all()
+    _apply(conn, rows)
+    _set_score_day(conn, day)
+
+# —————————————————————————————
+# Aggiornamento nelle scritture
+# —————————————————————————————
+def before_write(conn, table, ids):
+    """Sottrae dai punteggi il contributo delle righe 'ids' prima di modificarle o eliminarle. Non esegue il commit."""
+    if not ids: return
+    advance_scores(conn)
+    for placeholders, params in _in_chunks(int(i) for i in ids):
+        _apply(conn, conn.execute(text(_components_sql(table, f"id IN {placeholders}")), {**params, "giorno": score_day(conn).isoformat()}).all(), -1)
+
+def after_write(conn, table):
+    """
+    Collega al fornitore le righe scritte nella transazione corrente (riconosciute dalla row_version appena assegnata,
+    come in history.record_risk_changes) e ne aggiunge il contributo ai punteggi. Va chiamata una volta dopo gli
+    INSERT/UPDATE; non esegue il commit.
+    """
+    advance_scores(conn)
+    name, written = NAME_COLUMNS[table], f"row_version = {db.ROW_VERSION_SQL.format(table)}"
+    intern_names(conn, conn.execute(text(f"SELECT DISTINCT {name} FROM {table} WHERE {written}")).scalars().all())
+    conn.execute(text(f"UPDATE {table} SET supplier_id = (SELECT supplier_id FROM supplier_aliases a WHERE a.nome = {table}.{name}) WHERE {written}"))
+    _apply(conn, conn.execute(text(_components_sql(table, written)), {"giorno": score_day(conn).isoformat()}).all())
+
+def migrate_suppliers(conn, day=None):
+    """
+    Collega a un fornitore le righe di rischi e reminder senza supplier_id e ne conteggia il contributo.
+    Al primo avvio registra tutti i nomi (la grafia più frequente dà il nome al fornitore) e calcola i punteggi.
+    Restituisce le righe collegate; non esegue il commit.
+    """
+    day, linked = day or date.today(), 0
+    first_run = score_day(conn) is None
+    if not first_run: advance_scores(conn, day)
+    for table, name in NAME_COLUMNS.items():
+        names = conn.execute(text(f"SELECT {name} FROM {table} WHERE supplier_id IS NULL GROUP BY {name} ORDER BY COUNT(*) DESC")).scalars().all()
+        if not names: continue
+        intern_names(conn, names)
+        if not first_run:
+            source = f"{table} JOIN supplier_aliases a ON a.nome = {table}.{name}"
+            _apply(conn, conn.execute(text(_components_sql(table, f"{table}.supplier_id IS NULL", "a.supplier_id", source)), {"giorno": day.isoformat()}).all())
+        linked += conn.execute(text(f"UPDATE {table} SET supplier_id = (SELECT supplier_id FROM supplier_aliases a WHERE a.nome = {table}.{name}) "
+                                    f"WHERE supplier_id IS NULL")).rowcount
+    if first_run: recompute_scores(conn, day)
+    return linked
+
+def supplier_ranking(conn, limit=20):
+    """Fornitori con punteggio più alto (indice idx_suppliers_punteggio), con le componenti del punteggio."""
+    return conn.execute(text(f"SELECT id, nome, punteggio, {', '.join(COMPONENTS)} FROM suppliers WHERE punteggio > 0 "
+                             f"ORDER BY punteggio DESC, nome LIMIT :n"), {"n": limit}).mappings().all()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Anagrafica fornitori e punteggi di rischio della dashboard fornitori.")
+    parser.add_argument("--database", default=db.DATABASE_URL, help="URL SQLAlchemy del database (default: DATABASE_URL)")
+    parser.add_argument("--ricalcola", action="store_true", help="ricalcola da zero i punteggi di tutti i fornitori")
+    parser.add_argument("--classifica", type=int, default=20, help="fornitori da stampare")
+    args = parser.parse_args()
+    db.configure(args.database)
+    db.init_db()
+    with db.write_connection() as conn:
+        if args.ricalcola: recompute_scores(conn)
+        else: advance_scores(conn)
+        conn.commit()
+    with db.read_connection() as conn:
+        print(f"{'fornitore':<40} {'punteggio':>10} {'aperti':>7} {'scaduti':>8} {'test mancanti':>14}")
+        for r in supplier_ranking(conn, args.classifica):
+            print(f"{r['nome'][:40]:<40} {r['punteggio']:>10.1f} {r['rischi_aperti']:>7} {r['rischi_scaduti']:>8} {r['test_mancanti']:>14}")
@@ -0,0 +1,124 @@
+"""
+Popola un database con dati sintetici per i benchmark (vedi benchmark.py).
+
+    python synthetic_data.py --database sqlite:///bench.db --rischi 1000000 --reminder 100000
+    python synthetic_data.py --csv rischi.csv --rischi 1000000      # file per l'import massivo (risk_import.py)
+
+I fornitori hanno una distribuzione a legge di potenza (--skew): pochi fornitori concentrano gran parte
+dei rischi e dei reminder, come nei dati reali. Le righe sono generate con numpy e inserite a blocchi
+con executemany, una transazione per blocco, marcate con row_version come le scritture dell'app.
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+import db
+from auth import hash_password
+from risk_import import RISCHIO_SCENARI
+from suppliers import migrate_suppliers
+
+GRAVITA = (["Low", "High", "Critical"], [0.5, 0.35, 0.15])
+AREE = ["IT", "Real Estate", "Procurement", "HR", "Finance", "Legal", "Operations", "Marketing"]
+# Gli stessi scenari del form di censimento: i file generati con --csv superano la validazione dell'import
+RISCHI = list(RISCHIO_SCENARI)
+OGGI = np.datetime64("today", "D")
+
+def supplier_names(n):
+    return np.array([f"Fornitore {i:05d}" for i in range(1, n + 1)])
+
+def supplier_weights(n, skew):
+    """Probabilità di ogni fornitore proporzionale a 1 / rango^skew (skew=0: distribuzione uniforme)."""
+    weights = 1.0 / np.arange(1, n + 1) ** skew
+    return weights / weights.sum()
+
+def _dates(days):
+    return days.astype("datetime64[D]").astype(str)
+
+def risk_rows(rng, n, suppliers, weights):
+    inizio = OGGI - rng.integers(0, 3 * 365, n)
+    fine = inizio + rng.integers(30, 365, n)
+    chiuso = rng.random(n) < 0.4
+    chiusura = _dates(np.minimum(fine, OGGI))
+    note = rng.random(n) < 0.5
+    cols = {
+        "data_inizio": _dates(inizio), "data_fine": _dates(fine), "fornitore": rng.choice(suppliers, n, p=weights),
+        "rischio": rng.choice(RISCHI, n), "stato": np.where(chiuso, "chiuso", "aperto"), "gravita": rng.choice(GRAVITA[0], n, p=GRAVITA[1]),
+        "note": np.where(note, "Evidenze richieste al fornitore", None), "data_chiusura": np.where(chiuso, chiusura, None),
+        "contract_owner": rng.choice([f"Owner {i:02d}" for i in range(30)], n), "area_riferimento": rng.choice(AREE, n),
+        "perc_avanzamento": np.where(chiuso, 100, rng.integers(0, 100, n)),
+    }
+    return [dict(zip(cols, values)) for values in zip(*(c.tolist() for c in cols.values()))]
+
+def reminder_rows(rng, n, suppliers, weights):
+    attivo = rng.random(n) < 0.2
+    cols = {
+        "fornitore_nome": rng.choice(suppliers, n, p=weights), "data_invio": _dates(OGGI - rng.integers(0, 2 * 365, n)),
+        "stato_reminder": np.where(attivo, "Attivo", "Risposto"), "note": np.where(rng.random(n) < 0.3, "Sollecito inviato", None),
+        **{flag: (rng.random(n) < 0.5).astype(int) for flag in ("test_bc", "test_it", "test_pt_va", "access_review", "ppt")},
+    }
+    return [dict(zip(cols, values)) for values in zip(*(c.tolist() for c in cols.values()))]
+
+def user_rows(n):
+    roles = ["read", "modify", "admin"]
+    # Un solo hash condiviso (password "bench"): calcolarne uno per utente renderebbe lenta la generazione
+    password = hash_password("bench")
+    return [{"username": f"utente{i:04d}", "password": password, "role": roles[i % 3]} for i in range(n)]
+
+def _insert(conn, table, rows):
+    cols, values = list(rows[0]), ", ".join(f":{c}" for c in rows[0])
+    if table in db.DELTA_TABLES:
+        cols, values = cols + ["row_version"], values + f", {db.ROW_VERSION_SQL.format(table)}"
+    db.bump_table_version(conn, table)
+    conn.execute(text(f"INSERT INTO {table}({', '.join(cols)}) VALUES({values})"), rows)
+    conn.commit()
+
+def generate(database_url=None, n_risks=10_000, n_reminders=2_000, n_users=20, n_suppliers=None, skew=1.1, seed=42, chunk_size=20_000, log=print):
+    """Aggiunge al database n_risks rischi, n_reminders reminder e n_users utenti sintetici."""
+    if database_url: db.configure(database_url)
+    db.init_db()
+    rng = np.random.default_rng(seed)
+    # Cardinalità realistica: circa un fornitore ogni 50 rischi, con un minimo di 20
+    n_suppliers = n_suppliers or max(20, n_risks // 50)
+    suppliers, weights = supplier_names(n_suppliers), supplier_weights(n_suppliers, skew)
+    with db.write_connection() as conn:
+        for table, total, make_rows in (("risks", n_risks, lambda n: risk_rows(rng, n, suppliers, weights)),
+                                        ("reminders", n_reminders, lambda n: reminder_rows(rng, n, suppliers, weights))):
+            start = time.perf_counter()
+            for done in range(0, total, chunk_size):
+                _insert(conn, table, make_rows(min(chunk_size, total - done)))
+            log(f"{table}: {total} righe in {time.perf_counter() - start:.1f}s")
+        # Le righe sono inserite senza supplier_id: collegamento all'anagrafica e punteggi come per un database esistente
+        migrate_suppliers(conn); conn.commit()
+        existing = conn.execute(text("SELECT COUNT(*) FROM users WHERE username LIKE 'utente%'")).scalar_one()
+        if n_users > existing:
+            _insert(conn, "users", user_rows(n_users)[existing:])
+    return {"rischi": n_risks, "reminder": n_reminders, "utenti": n_users, "fornitori": n_suppliers, "skew": skew, "seed": seed}
+
+def write_risks_csv(path, n_risks=10_000, n_suppliers=None, skew=1.1, seed=42, chunk_size=20_000):
+    """Scrive n_risks rischi sintetici in un CSV con le colonne attese da risk_import.py, a blocchi."""
+    rng = np.random.default_rng(seed)
+    n_suppliers = n_suppliers or max(20, n_risks // 50)
+    suppliers, weights = supplier_names(n_suppliers), supplier_weights(n_suppliers, skew)
+    for done in range(0, n_risks, chunk_size):
+        pd.DataFrame(risk_rows(rng, min(chunk_size, n_risks - done), suppliers, weights)).to_csv(path, mode="w" if done == 0 else "a", header=done == 0, index=False)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Genera dati sintetici per i benchmark della dashboard fornitori.")
+    parser.add_argument("--database", default=db.DATABASE_URL, help="URL SQLAlchemy del database da popolare")
+    parser.add_argument("--rischi", type=int, default=10_000)
+    parser.add_argument("--reminder", type=int, default=2_000)
+    parser.add_argument("--utenti", type=int, default=20)
+    parser.add_argument("--fornitori", type=int, default=None, help="numero di fornitori distinti (default: rischi / 50)")
+    parser.add_argument("--skew", type=float, default=1.1, help="esponente della distribuzione dei fornitori")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--blocco", type=int, default=20_000, help="righe per transazione")
+    parser.add_argument("--csv", default=None, help="scrive i rischi in questo file CSV invece che nel database")
+    args = parser.parse_args()
+    if args.csv:
+        write_risks_csv(args.csv, args.rischi, args.fornitori, args.skew, args.seed, args.blocco)
+        print(f"{args.rischi} rischi scritti in {args.csv}")
+    else:
+        generate(args.database, args.rischi, args.reminder, args.utenti, args.fornitori, args.skew, args.seed, args.blocco)
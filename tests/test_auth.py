@@ -0,0 +1,62 @@
+import pytest
+import streamlit as st
+from sqlalchemy import text
+from streamlit.testing.v1 import AppTest
+
+import db
+from auth import authenticate, create_user, issue_token, read_token, revoke_tokens, session_user, token_matches, update_user, verify_password
+from conftest import ADMIN, ROOT
+
+def login(username=ADMIN[0], password=ADMIN[1]):
+    return authenticate(db.read_connection, db.write_connection, username, password)
+
+def token_valid(token):
+    with db.read_connection() as conn:
+        return session_user(conn, token) is not None
+
+def test_token_is_revoked_by_logout_and_user_changes(database):
+    user = login()
+    assert user["role"] == "admin" and login(ADMIN[0], "sbagliata") is None
+    token = issue_token(user)
+    assert token_matches(read_token(token), user) and token_valid(token)
+    with db.write_connection() as conn:
+        revoke_tokens(conn, ADMIN[0]); conn.commit()
+    assert not token_valid(token)
+    token = issue_token(login())
+    with db.write_connection() as conn:
+        update_user(conn, ADMIN[0], role="modify"); conn.commit()
+    assert not token_valid(token)
+    token = issue_token(login())
+    with db.write_connection() as conn:
+        update_user(conn, ADMIN[0], password="nuova"); conn.commit()
+    assert not token_valid(token) and login() is None and login(ADMIN[0], "nuova")["role"] == "modify"
+
+@pytest.mark.parametrize("stored", ["scrypt$abc", "scrypt$16384$8$1$salt", "scrypt$x$8$1$c2FsdA$ZGln", "scrypt$3$8$1$c2FsdA$ZGln",
+                                    "scrypt$16384$8$1$c2FsdA$Z", "pbkdf2_sha256$$c2FsdA$ZGln", "pbkdf2_sha256$0$c2FsdA$ZGln"])
+def test_malformed_hash_is_a_wrong_password(database, stored):
+    assert verify_password("x", stored) == (False, False)
+    with db.write_connection() as conn:
+        conn.execute(text("UPDATE users SET password = :p WHERE username = :u"), {"p": stored, "u": ADMIN[0]}); conn.commit()
+    assert login() is None
+
+def test_recreated_user_does_not_inherit_tokens(database):
+    with db.write_connection() as conn:
+        create_user(conn, "ospite", "x", "read"); conn.commit()
+        user = conn.execute(text("SELECT id, username, role, generazione_token FROM users WHERE username = 'ospite'")).mappings().one()
+        token = issue_token(user)
+        conn.execute(text("DELETE FROM users WHERE username = 'ospite'"))
+        create_user(conn, "ospite", "x", "read"); conn.commit()
+    assert not token_valid(token)
+
+def test_logout_revokes_session_link(app):
+    token = app.query_params["sessione"]
+    # Lo stesso URL apre la sessione in un altro browser finché l'utente non esce
+    st.cache_data.clear()
+    other = AppTest.from_file(str(ROOT / "Dashboard fornitori.py"), default_timeout=60)
+    other.query_params["sessione"] = token
+    assert other.run().session_state["authenticated"]
+    [b for b in app.button if b.label == "🔓 Logout"][0].click(); app.run()
+    assert not app.session_state["authenticated"]
+    again = AppTest.from_file(str(ROOT / "Dashboard fornitori.py"), default_timeout=60)
+    again.query_params["sessione"] = token
+    assert not again.run().session_state["authenticated"]
@@ -0,0 +1,36 @@
+import pandas as pd
+import pytest
+
+import report_charts
+
+CHARTS = [("torta", pd.DataFrame({"gravita": ["Critical", "High", "Low"], "count": [2, 5, 3]})),
+          ("barre", pd.DataFrame({"fornitore": ["ACME", "Beta Srl"], "count": [7, 3]})),
+          ("andamento", pd.DataFrame({"mese": ["2025-01", "2025-01", "2025-02"], "stato": ["aperto", "chiuso", "aperto"], "count": [4, 1, 5]}))]
+
+@pytest.fixture(autouse=True)
+def chart_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(report_charts, "CHART_CACHE_DIR", tmp_path)
+    return tmp_path
+
+@pytest.mark.parametrize("kind, data", CHARTS)
+def test_chart_png_with_matplotlib_is_cached(kind, data, chart_cache, monkeypatch):
+    rendered = []
+    render = report_charts._render_matplotlib
+    monkeypatch.setattr(report_charts, "_render_matplotlib", lambda *args: rendered.append(args[0]) or render(*args))
+    png = report_charts.chart_png(kind, data, "Titolo", (400, 300))
+    assert png.startswith(b"\x89PNG")
+    # Stesso input: l'immagine è letta dalla cache senza disegnare di nuovo; dati diversi: nuova immagine
+    assert report_charts.chart_png(kind, data.copy(), "Titolo", (400, 300)) == png
+    report_charts.chart_png(kind, data.assign(count=data["count"] + 1), "Titolo", (400, 300))
+    assert rendered == [kind, kind] and len(list(chart_cache.glob("*.png"))) == 2
+
+@pytest.mark.parametrize("kind, data", CHARTS)
+def test_chart_png_falls_back_to_kaleido_without_matplotlib(kind, data, monkeypatch):
+    monkeypatch.setattr(report_charts, "Figure", None)
+    try:
+        png = report_charts.chart_png(kind, data, "Titolo", (400, 300))
+    except Exception as e:
+        # kaleido 1.x usa un Chrome installato a parte (plotly_get_chrome)
+        if "chrome" not in str(e).lower(): raise
+        pytest.skip(f"kaleido senza browser: {e}")
+    assert png.startswith(b"\x89PNG")
@@ -0,0 +1,40 @@
+import csv
+import io
+from urllib.parse import urlsplit
+
+import pytest
+from starlette.datastructures import QueryParams
+
+import data_export
+from conftest import add_risks, risk
+
+@pytest.mark.parametrize("filters", [
+    {"fornitori": None, "stati": None, "gravita": None},
+    {"fornitori": ["ACME", "Beta Srl"], "stati": ["aperto"], "gravita": None},
+    {"fornitori": None, "stati": [], "gravita": ["Low"]},
+    {"fornitori": [], "stati": [], "gravita": []},
+])
+def test_export_url_round_trip(monkeypatch, filters):
+    monkeypatch.setattr(data_export, "STREAMING_ROUTE", "/api/esporta")
+    url = data_export.export_url("risks", "csv", filters, "token")
+    assert data_export.url_filters(QueryParams(urlsplit(url).query)) == filters
+
+def test_stream_export_csv_filters(database):
+    add_risks([risk("ACME", gravita="Low"), risk("ACME", "chiuso", gravita="Low"), risk("Beta Srl", gravita="High")])
+    def rows(filters):
+        data = b"".join(data_export.stream_export("csv", "risks", filters, chunk_size=2)).decode("utf-8-sig")
+        return list(csv.DictReader(io.StringIO(data)))
+    assert len(rows({})) == 3
+    assert [r["fornitore"] for r in rows({"gravita": ["Low"], "stati": ["aperto"]})] == ["ACME"]
+    # Selezione vuota (nessuno stato scelto nella pagina): nessuna riga, come nella griglia
+    assert rows({"stati": [], "gravita": ["Low"]}) == []
+    assert "supplier_id" not in data_export.export_columns("risks")
+
+def test_stream_export_parquet_accepts_dates_with_time(database):
+    import pyarrow.parquet as pq
+    # Righe meno recenti: date salvate con l'ora
+    add_risks([risk("ACME", data_fine="2025-06-22T00:00:00"), risk("Beta Srl", data_fine="2025-07-01")])
+    table = pq.read_table(io.BytesIO(b"".join(data_export.stream_export("parquet", "risks", {}, chunk_size=1))))
+    assert table.num_rows == 2
+    assert [d.isoformat() for d in table.column("data_fine").to_pylist()] == ["2025-06-22", "2025-07-01"]
+    assert table.column("data_chiusura").null_count == 2
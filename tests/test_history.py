@@ -0,0 +1,67 @@
+from datetime import date, timedelta
+
+import pandas as pd
+from sqlalchemy import text
+
+import db
+from aggregations import snapshot_trends, trend_charts_data
+from conftest import risk
+from history import risk_history, take_snapshot
+from save_engine import EDITABLE_COLUMNS, apply_changes
+
+def apply(user, updates=(), inserts=(), deletes=()):
+    with db.write_connection() as conn:
+        return apply_changes(conn, "risks", list(updates), list(inserts), list(deletes), user)
+
+def current(risk_id):
+    with db.read_connection() as conn:
+        row = conn.execute(text("SELECT * FROM risks WHERE id = :id"), {"id": risk_id}).mappings().one()
+    return {c: row[c] for c in EDITABLE_COLUMNS["risks"]}, row["id"], row["row_version"]
+
+def test_history_records_inserts_updates_and_deletes(database):
+    apply("mario", inserts=[risk("ACME", note="prima", perc_avanzamento=10), risk("Beta Srl", note="da eliminare")])
+    values, first, version = current(1)
+    _, second, second_version = current(2)
+    apply("luca", updates=[({**values, "note": "dopo", "stato": "chiuso", "data_chiusura": date.today().isoformat(), "perc_avanzamento": 100}, first, version)],
+          deletes=[(second, second_version)])
+
+    with db.read_connection() as conn:
+        modifica, inserimento = risk_history(conn, first)
+        eliminazione = risk_history(conn, second)[0]
+    assert (inserimento["operazione"], inserimento["utente"], inserimento["note"], inserimento["stato"], inserimento["perc_avanzamento"]) == \
+        ("inserimento", "mario", "prima", "aperto", 10)
+    assert (modifica["operazione"], modifica["utente"], modifica["note"], modifica["stato"], modifica["perc_avanzamento"]) == \
+        ("modifica", "luca", "dopo", "chiuso", 100)
+    assert modifica["row_version"] > inserimento["row_version"]
+    # Per le eliminazioni lo storico conserva gli ultimi valori della riga
+    assert (eliminazione["operazione"], eliminazione["utente"], eliminazione["fornitore"], eliminazione["note"]) == \
+        ("eliminazione", "luca", "Beta Srl", "da eliminare")
+    with db.read_connection() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM risks")).scalar_one() == 1
+
+def test_snapshot_trend_figures(database):
+    today = date.today()
+    def day(n): return (today + timedelta(days=n)).isoformat()
+    apply("mario", inserts=[
+        risk("ACME", "chiuso", "High", data_inizio=day(-10), data_fine=day(30), data_chiusura=day(-2)),
+        risk("Beta Srl", "aperto", "Critical", data_inizio=day(-10), data_fine=day(-1)),
+        risk("ACME", "aperto", "Low", data_inizio=day(-3), data_fine=day(30))])
+    with db.write_connection() as conn:
+        # Giorni passati ricostruiti dalle date, giorno corrente dalla colonna stato
+        take_snapshot(conn, today - timedelta(days=5), reconstruct=True)
+        take_snapshot(conn, today - timedelta(days=2), reconstruct=True)
+        take_snapshot(conn, today)
+        conn.commit()
+    with db.read_connection() as conn:
+        open_df, overdue_df, mttc_df = trend_charts_data(snapshot_trends(conn))
+        acme_open, _, _ = trend_charts_data(snapshot_trends(conn, ["ACME"]))
+        critical_open, _, _ = trend_charts_data(snapshot_trends(conn, gravita=["Critical"], dal=today - timedelta(days=2)))
+
+    days = [pd.Timestamp(today - timedelta(days=n)) for n in (5, 2, 0)]
+    assert open_df.to_dict("list") == {"giorno": days, "aperti": [2, 2, 2]}
+    overdue = overdue_df.pivot(index="giorno", columns="situazione", values="rischi")
+    assert overdue["Scaduti"].tolist() == [0, 0, 1] and overdue["In tempo"].tolist() == [2, 2, 1]
+    # Un rischio chiuso dopo 8 giorni, nel mese della chiusura
+    assert mttc_df.to_dict("records") == [{"mese": (today - timedelta(days=2)).strftime("%Y-%m"), "giorni_medi": 8.0}]
+    assert acme_open["aperti"].tolist() == [1, 1, 1]
+    assert critical_open.to_dict("list") == {"giorno": days[1:], "aperti": [1, 1]}
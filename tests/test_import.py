@@ -0,0 +1,39 @@
+import io
+
+import pytest
+from sqlalchemy import text
+
+import db
+from risk_import import REQUIRED_COLUMNS, import_risks, validate_risks
+
+CSV = """Nome fornitore;rischio;stato;gravita;data_inizio;Due Date;contract_owner;area_riferimento;data_chiusura;perc_avanzamento
+ACME;Inadeguate Security of third party;aperto;High;2025-01-10;31/12/2025;Mario;IT;;10
+Beta Srl;Inadeguate resilience of third party;chiuso;Low;2025-02-01;2025-06-30;Anna;Acquisti;2025-05-15;100
+Gamma;Scenario inventato;aperto;Medium;2025-03-01;2025-09-30;Luca;IT;;0
+Delta;Inadequate outsourcing of third party;chiuso;Critical;2025-03-01;2025-09-30;;IT;;0
+"""
+
+def test_validate_risks_reports_file_rows():
+    import pandas as pd
+    records, errors = validate_risks(pd.DataFrame([{"fornitore": "ACME", "stato": "aperto"}]), first_row=7)
+    assert records == []
+    assert {e["colonna"] for e in errors} == set(REQUIRED_COLUMNS) - {"fornitore", "stato"}
+    assert {e["riga"] for e in errors} == {7}
+
+def test_import_risks(database):
+    errors = []
+    summary = import_risks(io.StringIO(CSV), "csv", chunk_size=2, on_errors=errors.extend, user="import")
+    assert (summary["lette"], summary["importate"], summary["scartate"]) == (4, 2, 2)
+    assert sorted((e["riga"], e["colonna"]) for e in errors) == [(4, "gravita"), (4, "rischio"), (5, "contract_owner"), (5, "data_chiusura")]
+    with db.read_connection() as conn:
+        rows = conn.execute(text("SELECT fornitore, data_fine, data_chiusura, supplier_id FROM risks ORDER BY id")).all()
+        assert [tuple(r[:3]) for r in rows] == [("ACME", "2025-12-31", None), ("Beta Srl", "2025-06-30", "2025-05-15")]
+        assert all(r.supplier_id is not None for r in rows)
+        assert conn.execute(text("SELECT COUNT(*) FROM risk_history WHERE utente = 'import'")).scalar_one() == 2
+
+def test_import_dry_run_and_missing_columns(database):
+    assert import_risks(io.StringIO(CSV), "csv", dry_run=True)["importate"] == 0
+    with pytest.raises(ValueError, match="contract_owner"):
+        import_risks(io.StringIO("fornitore;rischio\nACME;x\n"), "csv")
+    with db.read_connection() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM risks")).scalar_one() == 0
@@ -0,0 +1,81 @@
+from datetime import date, timedelta
+
+import pandas as pd
+import pytest
+from sqlalchemy import text
+
+import db
+from aggregations import overdue_reminders, risk_counts_by, risk_kpis, risk_summary
+from conftest import add_reminder, add_risks, risk
+
+PAGES = ["Dashboard", "Censimento Fornitori", "Import Rischi", "Modifica", "Follow-up", "Report PDF", "Admin"]
+
+@pytest.fixture
+def risks(database):
+    add_risks([risk("ACME", "aperto", "Critical"), risk("ACME", "chiuso", "Low"), risk("Beta Srl", "aperto", "High"),
+               risk("Beta Srl", "aperto", "Low"), risk("Gamma", "chiuso", "High")])
+
+def test_risk_summary_and_kpis(risks):
+    with db.read_connection() as conn:
+        summary = risk_summary(conn, ["ACME"])
+    assert risk_kpis(summary) == {"totale": 5, "aperti": 3, "chiusi": 2}
+    by_gravita = risk_counts_by(summary, "gravita")
+    assert dict(zip(by_gravita["gravita"], by_gravita["count"])) == {"Critical": 1, "Low": 1}
+    by_stato = risk_counts_by(summary, "stato", gravita=["Critical"])
+    assert by_stato.to_dict("records") == [{"stato": "aperto", "count": 1}]
+
+@pytest.mark.parametrize("filters, expected", [
+    ({}, 5),
+    ({"fornitori": ["ACME"]}, 2),
+    ({"stati": ["aperto"], "gravita": ["Low", "High"]}, 2),
+    ({"stati": []}, 0),
+])
+def test_risk_filters_sql(risks, filters, expected):
+    where, params = db.risk_filters_sql(**filters)
+    with db.read_connection() as conn:
+        assert conn.execute(text(f"SELECT COUNT(*) FROM risks{where}"), params).scalar_one() == expected
+
+def test_overdue_reminders(database):
+    today = date.today()
+    add_reminder("ACME", today - timedelta(days=10))
+    add_reminder("Beta Srl", today - timedelta(days=db.REMINDER_SOGLIA_GIORNI))
+    add_reminder("Gamma", today - timedelta(days=1))
+    add_reminder("Delta", today - timedelta(days=30), stato="Risposto")
+    with db.read_connection() as conn:
+        total, df = overdue_reminders(conn, today, limit=1)
+    assert total == 2
+    assert df["fornitore_nome"].tolist() == ["ACME"] and df["giorni_trascorsi"].tolist() == [10]
+
+@pytest.mark.parametrize("page", PAGES)
+def test_app_pages_render(app, page, risks):
+    at = app.page(page)
+    assert not at.exception and not at.error
+
+def test_app_loaders_follow_writes(app):
+    metrics = lambda at: {m.label: m.value for m in at.metric}
+    at = app.page("Dashboard")
+    assert metrics(at)["Rischi Totali"] == "0"
+    add_risks([risk("ACME"), risk("ACME", "chiuso")])
+    at = app.page("Dashboard")
+    assert metrics(at)["Rischi Totali"] == "2" and metrics(at)["Rischi Aperti"] == "1"
+    assert "ACME" in at.selectbox(key="dashboard_sel").options
+
+def test_delta_loader_reloads_after_tombstones_are_pruned(app):
+    from datetime import datetime
+    from save_engine import save_editor_changes
+    add_reminder("ACME", date(2025, 1, 10)); add_reminder("Beta Srl", date(2025, 1, 12)); add_reminder("Gamma", date(2025, 1, 14))
+    shown = lambda at: sorted(at.dataframe[0].value["fornitore_nome"])
+    assert shown(app.page("Follow-up")) == ["ACME", "Beta Srl", "Gamma"]
+    with db.write_connection() as conn:
+        reminders = pd.read_sql_query(text("SELECT * FROM reminders ORDER BY id"), conn)
+        save_editor_changes(conn, "reminders", reminders, {"deleted_rows": [0]})
+    assert shown(app.page("Follow-up")) == ["Beta Srl", "Gamma"]
+    with db.write_connection() as conn:
+        save_editor_changes(conn, "reminders", reminders.iloc[1:], {"deleted_rows": [0]})
+        # Tombstone recenti conservati, poi rimossi quando superano TOMBSTONE_GIORNI
+        assert db.prune_tombstones(conn) == 0
+        assert db.prune_tombstones(conn, datetime.now() + timedelta(days=db.TOMBSTONE_GIORNI + 1)) == 2
+        conn.commit()
+        assert conn.execute(text("SELECT COUNT(*) FROM tombstones")).scalar_one() == 0
+    # La versione in memoria precede i tombstone rimossi: la tabella è riletta per intero, senza la riga eliminata
+    assert shown(app.page("Follow-up")) == ["Gamma"]
@@ -0,0 +1,43 @@
+from sqlalchemy import create_engine, text
+
+import db
+from conftest import add_reminder, add_risks, risk
+from migrate_db import migrate
+
+def _counts(url):
+    engine = create_engine(url)
+    with engine.connect() as conn:
+        counts = {t: conn.execute(text(f"SELECT COUNT(*) FROM {t}")).scalar_one() for t in ("users", "risks", "reminders", "suppliers", "risk_history")}
+    engine.dispose()
+    return counts
+
+def _source(tmp_path):
+    from datetime import date
+    url = f"sqlite:///{tmp_path / 'sorgente.db'}"
+    db.configure(url); db.init_db()
+    add_risks([risk("ACME"), risk("ACME S.p.A.", "chiuso"), risk("Beta Srl")])
+    add_reminder("ACME", date(2025, 1, 10))
+    db.configure()
+    return url
+
+def test_migrate_copies_all_tables(tmp_path, database_url):
+    source = _source(tmp_path)
+    migrate(source, database_url, chunk_size=2, log=lambda _: None)
+    assert _counts(database_url) == _counts(source) == {"users": 1, "risks": 3, "reminders": 1, "suppliers": 2, "risk_history": 3}
+    # L'app lavora sul database copiato: gli id continuano dopo quelli copiati
+    db.configure(database_url)
+    try:
+        db.init_db()
+        add_risks([risk("Gamma")])
+        with db.read_connection() as conn:
+            assert conn.execute(text("SELECT MAX(id) FROM risks")).scalar_one() == 4
+            assert conn.execute(text("SELECT rischi FROM suppliers WHERE nome = 'ACME'")).scalar_one() == 2
+    finally:
+        db.configure()
+
+def test_migrate_replace(tmp_path, database_url):
+    source = _source(tmp_path)
+    migrate(source, database_url, log=lambda _: None)
+    # Una seconda copia su una destinazione con dati (e chiavi esterne verso suppliers) la sostituisce per intero
+    migrate(source, database_url, replace=True, log=lambda _: None)
+    assert _counts(database_url) == _counts(source)
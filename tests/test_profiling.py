@@ -0,0 +1,24 @@
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+
+import db
+import profiling
+
+def test_query_finishing_after_profiling_is_enabled(database):
+    # Profiling attivato da Admin mentre la query di un'altra sessione è in corso: quella query
+    # arriva al listener di fine esecuzione senza il tempo di inizio registrato
+    event.listen(Engine, "after_cursor_execute", profiling._after_execute)
+    try:
+        with db.read_connection() as conn:
+            assert conn.execute(text("SELECT 1")).scalar_one() == 1
+    finally:
+        event.remove(Engine, "after_cursor_execute", profiling._after_execute)
+    profiling.set_enabled(True)
+    try:
+        profiling.begin_rerun("test")
+        with db.read_connection() as conn:
+            assert conn.execute(text("SELECT 2")).scalar_one() == 2
+        profiling.end_rerun()
+    finally:
+        profiling.set_enabled(False)
+    assert any(e["tipo"] == "sql" and e["nome"] == "SELECT 2" for e in profiling.recent_runs()[0]["eventi"])
@@ -0,0 +1,84 @@
+import sys
+import time
+import types
+
+import pytest
+from pypdf import PdfReader
+
+import db
+import report_charts
+import report_pdf
+from conftest import add_risks, risk
+
+@pytest.fixture
+def report_cache(tmp_path, monkeypatch):
+    """Cache dei report e dei grafici in una cartella del test, anche per i worker (che leggono le variabili d'ambiente)."""
+    monkeypatch.setenv("REPORT_CACHE_DIR", str(tmp_path / "report"))
+    monkeypatch.setenv("CHART_CACHE_DIR", str(tmp_path / "grafici"))
+    monkeypatch.setattr(report_pdf, "REPORT_CACHE_DIR", tmp_path / "report")
+    monkeypatch.setattr(report_charts, "CHART_CACHE_DIR", tmp_path / "grafici")
+    monkeypatch.setattr(report_pdf, "_executor", None)
+    monkeypatch.setattr(report_pdf, "_jobs", {}); monkeypatch.setattr(report_pdf, "_inflight", {})
+    yield tmp_path
+    if report_pdf._executor is not None: report_pdf._executor.shutdown()
+
+def wait_for(job_id, timeout=120):
+    deadline = time.time() + timeout
+    while (status := report_pdf.job_status(job_id))["stato"] in ("in coda", "in corso"):
+        assert time.time() < deadline, "report non completato"
+        time.sleep(0.2)
+    return status
+
+def test_report_is_built_by_worker_and_cached(database, report_cache):
+    add_risks([risk("ACME", "aperto", "Critical"), risk("ACME", "chiuso", "Low", note="Verifica completata"), risk("Beta Srl", "aperto", "High")])
+    filters = {"fornitori": None, "stati": None, "gravita": None}
+    with db.read_connection() as conn:
+        version = db.get_table_version(conn, "risks")
+    job_id = report_pdf.submit_report(filters, version)
+    # Un job in corso per lo stesso perimetro e la stessa versione è riutilizzato
+    assert report_pdf.submit_report(filters, version) == job_id
+    status = wait_for(job_id)
+    assert status["stato"] == "completato", status
+    assert status["file"] == str(report_pdf.cached_report(report_pdf.report_key(filters, version)))
+
+    with open(status["file"], "rb") as f:
+        reader = PdfReader(f)
+        text = "\n".join(page.extract_text() for page in reader.pages)
+        images = sum(len(page.images) for page in reader.pages)
+    for section in ("Report di Analisi Rischi", "Executive Summary", "Totale riscontri: 3 | Aperti: 2 | Critici: 1",
+                    "Dettaglio dei Riscontri", "Fornitore: ACME", "Fornitore: Beta Srl", "Verifica completata", "Pagina 1"):
+        assert section in text
+    # Torta per gravità, barre per fornitore e andamento per stato
+    assert images == 3
+
+def test_workers_do_not_rerun_the_main_script(database, report_cache, monkeypatch):
+    # Sotto Streamlit __main__ è lo script della dashboard: un worker 'spawn' non deve rieseguirlo
+    script, marker = report_cache / "script.py", report_cache / "script_eseguito"
+    script.write_text(f"open({str(marker)!r}, 'w').close()\n")
+    main = types.ModuleType("__main__"); main.__file__ = str(script)
+    monkeypatch.setitem(sys.modules, "__main__", main)
+    assert wait_for(report_pdf.submit_report({"fornitori": None, "stati": None, "gravita": None}, 0))["stato"] == "completato"
+    assert not marker.exists()
+    assert sys.modules["__main__"] is main
+
+def test_report_job_error_is_reported(database, report_cache):
+    job_id = report_pdf.submit_report({"fornitori": None, "stati": None, "gravita": None, "sconosciuto": None}, 0)
+    assert wait_for(job_id)["stato"] == "errore"
+
+def test_flowable_stream_keeps_one_chunk_in_memory(database, report_cache, monkeypatch):
+    # _FlowableStream si appoggia al modo in cui BaseDocTemplate.build consuma la lista (len, [0], del [0]):
+    # se reportlab cambiasse, il dettaglio mancherebbe dal PDF o la story verrebbe caricata tutta insieme
+    add_risks([risk(f"Fornitore {i % 3}", rischio=f"Rischio numero {i}") for i in range(40)])
+    buffered = []
+
+    class RecordingStream(report_pdf._FlowableStream):
+        def _fill(self):
+            super()._fill()
+            buffered.append(list.__len__(self))
+    monkeypatch.setattr(report_pdf, "_FlowableStream", RecordingStream)
+    path = report_cache / "report.pdf"
+    with db.read_connection() as conn:
+        report_pdf.build_advanced_pdf(conn, {"fornitori": None, "stati": None, "gravita": None}, path, chunk_size=8)
+    text = "\n".join(page.extract_text() for page in PdfReader(path).pages)
+    assert all(f"Rischio numero {i}" in text for i in range(40))
+    assert max(buffered) <= 8 + 8 // 2
@@ -0,0 +1,70 @@
+import pandas as pd
+import pytest
+from sqlalchemy import text
+
+import db
+from conftest import add_reminder, add_risks, risk
+from history import risk_history
+from save_engine import InvalidRows, SaveConflict, save_editor_changes
+
+def load(table):
+    with db.read_connection() as conn:
+        return pd.read_sql_query(text(f"SELECT * FROM {table} ORDER BY id"), conn)
+
+def save(table, original, state, user="test"):
+    with db.write_connection() as conn:
+        return save_editor_changes(conn, table, original, state, user)
+
+@pytest.fixture
+def risks(database):
+    add_risks([risk("ACME", note="uno"), risk("Beta Srl", note="due"), risk("Gamma", note="tre")])
+    return load("risks")
+
+def test_save_updates_inserts_and_deletes(risks):
+    state = {"edited_rows": {0: {"note": "modificata", "perc_avanzamento": 50}}, "deleted_rows": [2],
+             "added_rows": [risk("Delta", data_inizio="2025-01-01", data_fine="2025-12-31")]}
+    assert save("risks", risks, state) == {"modificate": 1, "inserite": 1, "eliminate": 1}
+    after = load("risks")
+    assert after["fornitore"].tolist() == ["ACME", "Beta Srl", "Delta"]
+    assert after.loc[0, ["note", "perc_avanzamento"]].tolist() == ["modificata", 50]
+    assert after["supplier_id"].notna().all()
+    with db.read_connection() as conn:
+        assert [h["operazione"] for h in risk_history(conn, int(risks.loc[0, "id"]))] == ["modifica", "inserimento"]
+        assert [h["operazione"] for h in risk_history(conn, int(risks.loc[2, "id"]))] == ["eliminazione", "inserimento"]
+        assert conn.execute(text("SELECT row_id FROM tombstones WHERE tabella = 'risks'")).scalar_one() == risks.loc[2, "id"]
+
+def test_added_risks_are_validated_like_the_form(risks):
+    state = {"edited_rows": {0: {"note": "modificata"}},
+             "added_rows": [risk("Delta", contract_owner=None), risk("Epsilon", gravita="Medium", stato="sospeso"),
+                            risk("Zeta", data_chiusura="2025-01-31")]}
+    with pytest.raises(InvalidRows) as invalid:
+        save("risks", risks, state)
+    assert [(e["riga"], e["colonna"]) for e in invalid.value.errors] == [(1, "contract_owner"), (2, "gravita"), (2, "stato")]
+    # Nessuna modifica salvata, nemmeno quelle delle righe esistenti
+    assert load("risks")["note"].tolist() == ["uno", "due", "tre"]
+    state["added_rows"] = state["added_rows"][2:]
+    assert save("risks", risks, state) == {"modificate": 1, "inserite": 1, "eliminate": 0}
+    # Come nel form la data di chiusura di un rischio aperto è ignorata
+    assert load("risks").iloc[-1][["fornitore", "data_chiusura"]].tolist() == ["Zeta", None]
+
+def test_save_without_changes_writes_nothing(risks):
+    with db.read_connection() as conn: version = db.get_table_version(conn, "risks")
+    assert save("risks", risks, {}) == {"modificate": 0, "inserite": 0, "eliminate": 0}
+    with db.read_connection() as conn: assert db.get_table_version(conn, "risks") == version
+
+def test_save_detects_concurrent_changes(risks):
+    # Un altro utente modifica la prima riga ed elimina la terza dopo il caricamento dell'editor
+    save("risks", risks, {"edited_rows": {0: {"note": "altro utente"}}, "deleted_rows": [2]}, user="altro")
+    with pytest.raises(SaveConflict) as conflict:
+        save("risks", risks, {"edited_rows": {0: {"note": "mia"}, 1: {"note": "mia"}}, "deleted_rows": [2]})
+    assert conflict.value.ids == sorted(int(i) for i in risks.loc[[0, 2], "id"])
+    # Nessuna modifica della transazione in conflitto è stata salvata
+    assert load("risks")["note"].tolist() == ["altro utente", "due"]
+
+def test_save_reminders(database):
+    from datetime import date
+    add_reminder("ACME", date(2025, 1, 10)); add_reminder("Beta Srl", date(2025, 1, 12))
+    reminders = load("reminders")
+    assert save("reminders", reminders, {"edited_rows": {1: {"stato_reminder": "Risposto", "test_bc": True}}})["modificate"] == 1
+    after = load("reminders")
+    assert after["stato_reminder"].tolist() == ["Attivo", "Risposto"] and after["test_bc"].tolist() == [0, 1]
@@ -0,0 +1,74 @@
+import sqlite3
+from datetime import date, timedelta
+
+from sqlalchemy import text
+
+import db
+from conftest import add_reminder
+from scheduler import deliver_escalations, scan_reminders
+
+class RecordingSink:
+    """Canale di notifica dei test: registra le escalation inviate; 'errore' fa fallire ogni invio."""
+    def __init__(self, errore=None):
+        self.sent, self.errore = [], errore
+
+    def send(self, escalations):
+        self.sent += [e["reminder_id"] for e in escalations]
+        return [self.errore] * len(escalations)
+
+def _answer(reminder_id):
+    with db.write_connection() as conn:
+        conn.execute(text("UPDATE reminders SET stato_reminder = 'Risposto' WHERE id = :id"), {"id": reminder_id})
+        conn.commit()
+
+def _states():
+    with db.read_connection() as conn:
+        return dict(conn.execute(text("SELECT reminder_id, stato_notifica FROM reminder_escalations")).all())
+
+def test_escalation_of_reminder_answered_after_scan_is_not_sent(database):
+    scaduto = date.today() - timedelta(days=db.REMINDER_SOGLIA_GIORNI + 5)
+    add_reminder("ACME", scaduto); add_reminder("Beta", scaduto)
+    with db.write_connection() as conn:
+        assert scan_reminders(conn, date.today()) == 2
+    _answer(1)
+    sink = RecordingSink()
+    with db.write_connection() as conn:
+        assert deliver_escalations(conn, sink) == (1, 0, 1)
+    assert sink.sent == [2]
+    assert _states() == {1: "non necessaria", 2: "inviata"}
+
+def test_retry_of_answered_reminder_is_not_sent(database):
+    add_reminder("ACME", date.today() - timedelta(days=db.REMINDER_SOGLIA_GIORNI + 5))
+    with db.write_connection() as conn:
+        scan_reminders(conn, date.today())
+        assert deliver_escalations(conn, RecordingSink("SMTP non raggiungibile")) == (0, 1, 0)
+        # Nuovo tentativo già dovuto
+        conn.execute(text("UPDATE reminder_escalations SET prossimo_tentativo = '2000-01-01T00:00:00'"))
+        conn.commit()
+    _answer(1)
+    sink = RecordingSink()
+    with db.write_connection() as conn:
+        assert deliver_escalations(conn, sink) == (0, 0, 1)
+    assert sink.sent == [] and _states() == {1: "non necessaria"}
+
+def test_init_db_accepts_new_escalation_state_on_legacy_sqlite_table(tmp_path):
+    path = tmp_path / "legacy.db"
+    legacy = sqlite3.connect(path)
+    legacy.executescript("""
+        CREATE TABLE reminder_escalations (id INTEGER PRIMARY KEY, reminder_id INTEGER NOT NULL UNIQUE, fornitore_nome TEXT NOT NULL,
+                                           data_invio TEXT NOT NULL, creata_il TEXT NOT NULL,
+                                           stato_notifica TEXT NOT NULL DEFAULT 'in attesa' CHECK (stato_notifica IN ('in attesa', 'inviata', 'fallita')),
+                                           tentativi INTEGER NOT NULL DEFAULT 0, prossimo_tentativo TEXT NOT NULL, inviata_il TEXT, ultimo_errore TEXT);
+        CREATE INDEX idx_escalations_da_notificare ON reminder_escalations(stato_notifica, prossimo_tentativo);
+        INSERT INTO reminder_escalations(reminder_id, fornitore_nome, data_invio, creata_il, prossimo_tentativo)
+        VALUES(7, 'ACME', '2024-01-01', '2024-02-01T00:00:00', '2024-02-01T00:00:00');
+    """)
+    legacy.commit(); legacy.close()
+    db.configure(f"sqlite:///{path}")
+    try:
+        db.init_db()
+        with db.write_connection() as conn:
+            assert deliver_escalations(conn, RecordingSink()) == (0, 0, 1)
+        assert _states() == {7: "non necessaria"}
+    finally:
+        db.configure()
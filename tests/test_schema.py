@@ -0,0 +1,65 @@
+import sqlite3
+
+from sqlalchemy import inspect, text
+
+import db
+from auth import verify_password
+from conftest import ADMIN, risk, add_risks
+
+def test_create_schema_is_idempotent(database):
+    with db.write_connection() as conn:
+        db.create_schema(conn)
+        db.create_schema(conn)
+        conn.commit()
+    with db.read_connection() as conn:
+        tables = set(inspect(conn).get_table_names())
+        assert set(db.metadata.tables) <= tables
+        for table in db.DELTA_TABLES:
+            columns = {c["name"] for c in inspect(conn).get_columns(table)}
+            assert {"row_version", "supplier_id"} <= columns
+        versions = dict(conn.execute(text("SELECT tabella, versione FROM table_versions")).all())
+        assert set(versions) == set(db.CACHED_TABLES)
+
+def test_init_db_creates_admin_with_hashed_password(database):
+    with db.read_connection() as conn:
+        row = conn.execute(text("SELECT password, role FROM users WHERE username = :u"), {"u": ADMIN[0]}).one()
+    assert row.role == "admin"
+    assert verify_password(ADMIN[1], row.password)[0]
+
+def test_bump_table_version_marks_written_rows(database):
+    add_risks([risk()])
+    with db.read_connection() as conn:
+        version = db.get_table_version(conn, "risks")
+        assert conn.execute(text("SELECT row_version FROM risks")).scalar_one() == version > 0
+
+def test_init_db_upgrades_legacy_sqlite_database(tmp_path):
+    # Schema e dati come li creava la prima versione dell'app (sqlite3, password in chiaro)
+    path = tmp_path / "legacy.db"
+    legacy = sqlite3.connect(path)
+    legacy.executescript("""
+        CREATE TABLE users (id INTEGER PRIMARY KEY, username TEXT UNIQUE NOT NULL, password TEXT NOT NULL,
+                            role TEXT NOT NULL CHECK(role IN ('read','modify','admin')));
+        CREATE TABLE risks (id INTEGER PRIMARY KEY, data_inizio TEXT NOT NULL, data_fine TEXT NOT NULL, fornitore TEXT NOT NULL,
+                            rischio TEXT NOT NULL, stato TEXT NOT NULL, gravita TEXT NOT NULL, note TEXT, data_chiusura TEXT,
+                            contract_owner TEXT NOT NULL, area_riferimento TEXT NOT NULL, perc_avanzamento INTEGER NOT NULL DEFAULT 0);
+        CREATE TABLE reminders (id INTEGER PRIMARY KEY, fornitore_nome TEXT NOT NULL, data_invio TEXT NOT NULL,
+                                stato_reminder TEXT NOT NULL CHECK(stato_reminder IN ('Attivo', 'Risposto')), note TEXT,
+                                test_bc INTEGER NOT NULL DEFAULT 0, test_it INTEGER NOT NULL DEFAULT 0, test_pt_va INTEGER NOT NULL DEFAULT 0,
+                                access_review INTEGER NOT NULL DEFAULT 0, ppt INTEGER NOT NULL DEFAULT 0);
+        INSERT INTO users(username, password, role) VALUES('Flavio', 'Dashboard2003', 'admin');
+        INSERT INTO risks(data_inizio, data_fine, fornitore, rischio, stato, gravita, contract_owner, area_riferimento)
+        VALUES('2024-01-10', '2024-06-30', 'Acme S.p.A.', 'Inadeguate Security of third party', 'aperto', 'Critical', 'Mario', 'IT'),
+              ('2024-02-01', '2024-03-31', 'ACME spa', 'Inadeguate resilience of third party', 'chiuso', 'Low', 'Mario', 'IT');
+        INSERT INTO reminders(fornitore_nome, data_invio, stato_reminder) VALUES('Acme S.p.A.', '2024-05-01', 'Attivo');
+    """)
+    legacy.commit(); legacy.close()
+    db.configure(f"sqlite:///{path}")
+    try:
+        db.init_db()
+        with db.read_connection() as conn:
+            assert conn.execute(text("SELECT COUNT(*) FROM risks WHERE supplier_id IS NULL")).scalar_one() == 0
+            assert conn.execute(text("SELECT COUNT(DISTINCT supplier_id) FROM risks")).scalar_one() == 1
+            assert conn.execute(text("SELECT rischi, rischi_aperti, reminder FROM suppliers")).one() == (2, 1, 1)
+            assert conn.execute(text("SELECT password FROM users")).scalar_one().startswith("scrypt$")
+    finally:
+        db.configure()
@@ -0,0 +1,85 @@
+import pytest
+from sqlalchemy import text
+
+import db
+import search
+from conftest import add_reminder, add_risks, risk
+from save_engine import EDITABLE_COLUMNS, apply_changes
+
+def find(table, query, **kwargs):
+    with db.read_connection() as conn:
+        total, page = search.search(conn, table, query, **kwargs)
+    return total, page["id"].tolist() if total else []
+
+def edit(updates=(), inserts=(), deletes=()):
+    with db.write_connection() as conn:
+        rows = {r["id"]: r for r in conn.execute(text("SELECT * FROM risks")).mappings()}
+        apply_changes(conn, "risks", [({**{c: rows[i][c] for c in EDITABLE_COLUMNS["risks"]}, **values}, i, rows[i]["row_version"]) for i, values in updates],
+                      list(inserts), [(i, rows[i]["row_version"]) for i in deletes], "test")
+
+def check_index(database):
+    if database.startswith("sqlite"):
+        with db.write_connection() as conn:
+            # Errore se l'indice non corrisponde alla tabella di origine
+            for table in db.SEARCH_INDEXES: conn.execute(text(f"INSERT INTO {table}_fts({table}_fts, rank) VALUES('integrity-check', 1)"))
+            conn.rollback()
+
+@pytest.fixture
+def risks(database):
+    # Import massivo (trigger sospesi, indicizzazione alla fine) e poi salvataggi dell'editor (trigger)
+    add_risks([risk("ACME S.p.A.", note="Evidenze del piano di continuità richieste"), risk("Beta Srl", note="Penetration test da ripetere")])
+    edit(inserts=[risk("Gamma", rischio="Inadeguate resilience of third party", note="Nessuna evidenza del test di ripristino")])
+    return database
+
+def test_index_follows_inserts_updates_and_deletes(risks):
+    assert find("risks", "evid") == (2, [3, 1])
+    assert find("risks", "penetration test") == (1, [2])
+    edit(updates=[(2, {"note": "Report del penetration test ricevuto"}), (1, {"fornitore": "Delta"})])
+    assert find("risks", "ripetere") == (0, [])
+    assert find("risks", "report ricevuto") == (1, [2])
+    assert find("risks", "acme") == (0, []) and find("risks", "delta evidenze") == (1, [1])
+    edit(deletes=[3])
+    assert find("risks", "evid") == (1, [1])
+    check_index(risks)
+
+def test_reminders_index(database):
+    from datetime import date
+    add_reminder("ACME S.p.A.", date(2025, 1, 10))
+    with db.write_connection() as conn:
+        conn.execute(text("UPDATE reminders SET note = 'Sollecito inviato al referente' WHERE id = 1"))
+        conn.commit()
+    assert find("reminders", "sollecito") == (1, [1])
+    check_index(database)
+
+def test_results_are_ranked_and_paginated(database):
+    if not database.startswith("sqlite"): pytest.skip("ordinamento per pertinenza solo con FTS5")
+    # Il fornitore pesa più delle note: ACME (inserito per primo) precede le note che citano ACME
+    add_risks([risk("ACME"), risk("Beta Srl", note="Subfornitore di ACME"), risk("Gamma", note="Come ACME, anche ACME Cloud")])
+    total, ids = find("risks", "acme")
+    assert total == 3 and ids[0] == 1
+    assert find("risks", "acme", limit=1, offset=1) == (3, ids[1:2])
+    with db.read_connection() as conn:
+        _, page = search.search(conn, "risks", "subfornitore")
+    assert page["estratto"].tolist() == ["«Subfornitore» di ACME"]
+
+@pytest.mark.parametrize("query", ["evid", "penetration test", "third party", "gamma ripristino", "inesistente"])
+def test_like_fallback_returns_the_same_rows(risks, query, monkeypatch):
+    total, ids = find("risks", query)
+    monkeypatch.setattr(search, "fts_available", lambda conn: False)
+    assert find("risks", query, limit=100) == (total, sorted(ids, reverse=True))
+
+def test_match_suppliers_finds_spelling_variants(database, monkeypatch):
+    add_risks([risk("ACME S.p.A."), risk("Acme spa"), risk("Acmee"), risk("Beta Srl"), risk("Acme Cloud Services")])
+    with db.read_connection() as conn:
+        matches = search.match_suppliers(conn, "acme spa")
+    assert [m["fornitore"] for m in matches] == ["ACME S.p.A.", "Acme spa", "Acme Cloud Services", "Acmee"]
+    assert [m["somiglianza"] for m in matches][:3] == [1.0, 1.0, 0.9]
+    monkeypatch.setattr(search, "fts_available", lambda conn: False)
+    with db.read_connection() as conn:
+        assert search.match_suppliers(conn, "acme spa") == matches
+    monkeypatch.undo()
+    # Un nome rinominato esce dai risultati, il nuovo nome entra
+    edit(updates=[(3, {"fornitore": "ACME Spa"})])
+    with db.read_connection() as conn:
+        names = {m["fornitore"] for m in search.match_suppliers(conn, "acme")}
+    assert "ACME Spa" in names and "Acmee" not in names
@@ -0,0 +1,68 @@
+from datetime import date
+
+from sqlalchemy import text
+
+import db
+from conftest import add_reminder, add_risks, risk
+from save_engine import EDITABLE_COLUMNS, apply_changes
+from suppliers import COMPONENTS, recompute_scores
+
+def scores(conn):
+    rows = conn.execute(text(f"SELECT nome, {', '.join(COMPONENTS)}, punteggio FROM suppliers ORDER BY nome")).all()
+    return [(*r[:-1], round(r[-1], 6)) for r in rows]
+
+def edit(table, updates=(), inserts=(), deletes=()):
+    """apply_changes con i valori attuali delle righe modificate ({id: nuovi valori}) e le row_version attese."""
+    with db.write_connection() as conn:
+        rows = {r["id"]: r for r in conn.execute(text(f"SELECT * FROM {table}")).mappings()}
+        current = lambda i: {c: rows[i][c] for c in EDITABLE_COLUMNS[table]}
+        apply_changes(conn, table, [({**current(i), **values}, i, rows[i]["row_version"]) for i, values in dict(updates).items()],
+                      list(inserts), [(i, rows[i]["row_version"]) for i in deletes], "test")
+
+def assert_scores_match_recompute():
+    with db.write_connection() as conn:
+        incremental = scores(conn)
+        recompute_scores(conn, date.today())
+        assert scores(conn) == incremental
+        conn.rollback()
+    return incremental
+
+def test_incremental_scores_follow_edits_and_deletes(database):
+    add_risks([risk("ACME", "aperto", "Critical"), risk("Acme S.p.A.", "aperto", "High", giorni_fine=-3), risk("Beta Srl", "aperto", "Low")])
+    add_reminder("ACME", date(2025, 1, 10)); add_reminder("Beta Srl", date(2025, 1, 12))
+    assert_scores_match_recompute()
+    steps = [
+        ("risks", {"updates": {1: {"perc_avanzamento": 50}, 3: {"gravita": "Critical", "data_fine": "2000-01-01"}}}),
+        # Cambio di fornitore: il contributo passa da un fornitore all'altro
+        ("risks", {"updates": {2: {"fornitore": "Beta Srl"}}, "inserts": [risk("Gamma", "aperto", "High")]}),
+        ("risks", {"updates": {1: {"stato": "chiuso", "data_chiusura": date.today().isoformat()}}, "deletes": [3]}),
+        ("reminders", {"updates": {1: {"test_bc": 1, "ppt": 1}, 2: {"fornitore_nome": "Gamma"}}}),
+        ("reminders", {"deletes": [1]}),
+        ("risks", {"deletes": [1, 2, 4]}),
+    ]
+    for table, changes in steps:
+        edit(table, **changes)
+        incremental = assert_scores_match_recompute()
+    # Nessun rischio e un solo reminder (Gamma, 5 test mancanti) rimasti
+    assert [(r[0], r[1], r[6], r[7], r[8]) for r in incremental if any(r[1:])] == [("Gamma", 0, 1, 5, 2.5)]
+
+def test_init_db_links_rows_written_outside_the_app(database):
+    add_risks([risk("ACME", "aperto", "Critical")])
+    # Righe scritte senza supplier_id (synthetic_data, migrate_db, strumenti esterni) dopo il primo avvio
+    with db.write_connection() as conn:
+        for fornitore, stato in (("Acme S.p.A.", "aperto"), ("Nuovo Fornitore", "chiuso")):
+            conn.execute(text("INSERT INTO risks(data_inizio, data_fine, fornitore, rischio, stato, gravita, contract_owner, area_riferimento) "
+                              "VALUES('2025-01-01', '2025-02-01', :f, 'Inadeguate Security of third party', :s, 'High', 'Mario', 'IT')"),
+                         {"f": fornitore, "s": stato})
+        conn.execute(text("INSERT INTO reminders(fornitore_nome, data_invio, stato_reminder) VALUES('ACME', '2025-01-10', 'Attivo')"))
+        conn.commit()
+    db.configure(database)
+    db.init_db()
+    with db.read_connection() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM risks WHERE supplier_id IS NULL")).scalar_one() == 0
+        assert conn.execute(text("SELECT COUNT(*) FROM reminders WHERE supplier_id IS NULL")).scalar_one() == 0
+        incremental = scores(conn)
+    assert [r[:3] + r[6:7] for r in incremental] == [("ACME", 2, 2, 1), ("Nuovo Fornitore", 1, 0, 0)]
+    with db.write_connection() as conn:
+        recompute_scores(conn, date.today())
+        assert scores(conn) == incremental